@@ -6,6 +6,7 @@ __license__ = "MIT License"
 __version__ = "1.2.2"
 
 import ast
+import heapq
 import re
 import sys
 import tokenize
@@ -36,6 +37,12 @@ def parse(source: _t.Union[str, bytes, ast.AST], *args, **kwargs) -> ast.AST:
     return tree
 
 
+def enrich(source: _t.Union[str, bytes], tree: ast.AST) -> ast.AST:
+    """attach the comments of the source to a tree from ast.parse(source)"""
+    _enrich(source, tree)
+    return tree
+
+
 def _enrich(source: _t.Union[str, bytes], tree: ast.AST) -> None:
     if isinstance(source, bytes):
         source = source.decode()
@@ -61,17 +68,26 @@ def _enrich(source: _t.Union[str, bytes], tree: ast.AST) -> None:
     if not comment_nodes:
         return
 
-    tree_intervals = _get_tree_intervals_and_update_ast_nodes(tree, source)
+    source_lines = _SourceLines(source)
+    tree_intervals = _get_tree_intervals_and_update_ast_nodes(tree, source_lines)
+
+    # The target of a comment is the containing interval with the highest lower bound (and
+    # the lowest upper bound on a tie). The comments come in line order, so a sweep over the
+    # intervals sorted by their lower bound can drop every interval that ended before it.
+    intervals = sorted(tree_intervals, reverse=True)
+    candidates: _t.List[_t.Tuple[int, int]] = []
+    targets = {}
     for c_node in comment_nodes:
         c_lineno = c_node.lineno
-        possible_intervals_for_c_node = [
-            (x, y) for x, y in tree_intervals if x <= c_lineno <= y
-        ]
+        while intervals and intervals[-1][0] <= c_lineno:
+            low, high = intervals.pop()
+            heapq.heappush(candidates, (-low, high))
+        while candidates and candidates[0][1] < c_lineno:
+            heapq.heappop(candidates)
 
-        if possible_intervals_for_c_node:
-            target_interval = tree_intervals[
-                max(possible_intervals_for_c_node, key=lambda item: (item[0], -item[1]))
-            ]
+        if candidates:
+            low, high = candidates[0]
+            target_interval = tree_intervals[(-low, high)]
 
             target_node = target_interval["node"]
             # intervals for every attribute from _CONTAINER_ATTRS for the target node
@@ -89,7 +105,14 @@ def _enrich(source: _t.Union[str, bytes], tree: ast.AST) -> None:
             target_attr = "body"
 
         attr = getattr(target_node, target_attr)
-        attr.append(c_node)
+        if id(attr) not in targets:
+            targets[id(attr)] = (attr, [])
+        targets[id(attr)][1].append(c_node)
+
+    # Every body is merged only once. The sort is stable and the comments are in line order,
+    # so this is the same order as sorting the body after each single comment was appended.
+    for attr, comments in targets.values():
+        attr.extend(comments)
         attr.sort(key=lambda x: (x.end_lineno, isinstance(x, Comment)))
 
         # NOTE:
@@ -115,10 +138,12 @@ def _enrich(source: _t.Union[str, bytes], tree: ast.AST) -> None:
 
 
 def _get_tree_intervals_and_update_ast_nodes(
-    node: ast.AST, source: str
+    node: ast.AST, source: _t.Union[str, "_SourceLines"]
 ) -> _t.Dict[
     _t.Tuple[int, int], _t.Dict[str, _t.Union[_t.List[_t.Tuple[int, int]], ast.AST]]
 ]:
+    if not isinstance(source, _SourceLines):
+        source = _SourceLines(source)
     res = {}
     for node in ast.walk(node):
         attr_intervals = []
@@ -128,17 +153,17 @@ def _get_tree_intervals_and_update_ast_nodes(
                 if not isinstance(items, Iterable):
                     continue
                 attr_intervals.append(
-                    (*_extend_interval(_get_interval(items), source), attr)
+                    (*source.extend_interval(_get_interval(items)), attr)
                 )
         if attr_intervals:
             # If the parent node hast lineno and end_lineno we extend them too, because there
             # could be comments at the end not covered by the intervals gathered in the attributes
             if hasattr(node, "lineno") and hasattr(node, "end_lineno"):
-                low, high = _extend_interval((node.lineno, node.end_lineno), source)
+                low, high = source.extend_interval((node.lineno, node.end_lineno))
                 node.lineno = low
                 node.end_lineno = high
                 # also update the end col offset corresponding to the new line
-                node.end_col_offset = len(source.split("\n")[high - 1])
+                node.end_col_offset = len(source.lines[high])
             else:
                 low = (
                     min(node.lineno, min(attr_intervals)[0])
@@ -155,52 +180,88 @@ def _get_tree_intervals_and_update_ast_nodes(
     return res
 
 
+class _SourceLines:
+    """
+    The source split into lines (with an empty line 0 so that the ast lineno can be used
+    as an index) along with the indentation tables that _extend_interval needs. Each table
+    is computed once, so extending an interval does not rescan the lines of the block.
+    """
+
+    def __init__(self, code: str) -> None:
+        self.lines = lines = [""] + code.split("\n")
+        size = len(lines)
+        self.indentation = indentation = [_get_indentation_lvl(line) for line in lines]
+        comment = [bool(_COMMENT_LINE.match(line)) for line in lines]
+        # the indentation of the first line not being a comment at or after each line
+        self.code_indentation = code_indentation = [0] * (size + 1)
+        for i in range(size - 1, -1, -1):
+            if not lines[i].strip() or comment[i]:
+                code_indentation[i] = code_indentation[i + 1]
+            else:
+                code_indentation[i] = indentation[i]
+        # the next line with a lower indentation - everything before can be skipped
+        self.next_lower = next_lower = [size] * size
+        stack: _t.List[int] = []
+        for i in range(size - 1, -1, -1):
+            while stack and indentation[stack[-1]] >= indentation[i]:
+                stack.pop()
+            if stack:
+                next_lower[i] = stack[-1]
+            stack.append(i)
+        # going upwards the comments are skipped regardless of their indentation and
+        # the empty line 0 is a stopper
+        self.upper_indentation = upper = [
+            sys.maxsize if comment[i] else indentation[i] for i in range(size)
+        ]
+        upper[0] = -1
+        self.prev_lower = prev_lower = [0] * size
+        stack = []
+        for i in range(size):
+            while stack and upper[stack[-1]] >= upper[i]:
+                stack.pop()
+            if stack:
+                prev_lower[i] = stack[-1]
+            stack.append(i)
+
+    def extend_interval(self, interval: _t.Tuple[int, int]) -> _t.Tuple[int, int]:
+        # same as _extend_interval(interval, code) but without scanning the lines again
+        low = interval[0]
+        high = interval[1]
+        skip_lower = False
+
+        if low == high:
+            start_indentation = self.indentation[low]
+        else:
+            lower_bound = self.indentation[low]
+            start_indentation = max(lower_bound, self.code_indentation[low + 1])
+            if start_indentation != lower_bound:
+                skip_lower = True
+
+        if not skip_lower:
+            upper, prev_lower = self.upper_indentation, self.prev_lower
+            above = low - 1
+            while above > 0 and start_indentation <= upper[above]:
+                above = prev_lower[above]
+            low = above + 1
+
+        indentation, next_lower = self.indentation, self.next_lower
+        below = high + 1
+        while below < len(indentation) and start_indentation <= indentation[below]:
+            below = next_lower[below]
+        high = below - 1
+
+        return low, high
+
+
+_COMMENT_LINE = re.compile(r"^ *#.*")
+
+
 # Try to move lower bound lower and upper bound higher while not going out of bounds concerning
 # the current block. The method is based on indentation levels to find the correct upper and lower
 # bounds of the interval looked at by checking where the indentation changes, and it marks the end
 # of the interval
 def _extend_interval(interval: _t.Tuple[int, int], code: str) -> _t.Tuple[int, int]:
-    lines = code.split("\n")
-    # Insert an empty line to correspond to the lineno values from ast nodes which start at 1
-    # instead of 0
-    lines.insert(0, "")
-
-    low = interval[0]
-    high = interval[1]
-    skip_lower = False
-
-    if low == high:
-        # Covering inner blocks like the inside of an if block consisting of only one line
-        start_indentation = _get_indentation_lvl(lines[low])
-    else:
-        # Covering cases of blocks starting at an outer term like 'if' and blocks with more than
-        # one line
-        lower_bound = _get_indentation_lvl(lines[low])
-        start_indentation = max(
-            lower_bound,
-            _get_indentation_lvl(_get_first_line_not_comment(lines[low + 1 :])),
-        )
-        if start_indentation != lower_bound:
-            skip_lower = True
-
-    while not skip_lower and low - 1 > 0:
-        # The upper bound ignores comments which are not correctly aligned, due to the fact
-        # that there must always be an ast node other than a comment one with a lower indentation
-        # above
-        if re.match(
-            r"^ *#.*", lines[low - 1]
-        ) or start_indentation <= _get_indentation_lvl(lines[low - 1]):
-            low -= 1
-        else:
-            break
-
-    while high + 1 < len(lines):
-        if start_indentation <= _get_indentation_lvl(lines[high + 1]):
-            high += 1
-        else:
-            break
-
-    return low, high
+    return _SourceLines(code).extend_interval(interval)
 
 
 # Searches for the first line not being a comment
@@ -209,18 +270,13 @@ def _get_first_line_not_comment(lines: _t.List[str]):
     for line in lines:
         if not line.strip():
             continue
-        if not re.match(r"^ *#.*", line):
+        if not _COMMENT_LINE.match(line):
             return line
     return ""
 
 
 def _get_indentation_lvl(line: str) -> int:
-    line.replace("\t", "   ")
-    res = re.findall(r"^ *", line)
-    indentation = 0
-    if len(res) > 0:
-        indentation = len(res[0])
-    return indentation
+    return len(line) - len(line.lstrip(" "))
 
 
 # get min and max line from a source tree
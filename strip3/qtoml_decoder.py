@@ -1,5 +1,7 @@
 #! /usr/bin/env python3
 # https://github.com/alethiophile/qtoml/blob/master/qtoml/decoder.py
+# rewritten to scan with regular expressions on an index into the string, so
+# that no token is sliced off the input and no parse state is copied around.
 # mypy: ignore-errors
 # pylint: skip-file
 
@@ -9,554 +11,349 @@ __version__ = "0.3.1"
 
 import re, datetime
 
-from typing import (Container, Tuple, Dict, List, Any, Match, Union, Optional,
-                    Set, IO)
+from typing import Any, Dict, IO, List, Optional, Sequence, Set, Tuple
 
-def load(fo: IO[str]) -> Dict[str, Any]:
+def load(fo: IO[str], table: Sequence[str] = ()) -> Dict[str, Any]:
     """Load TOML data from a file-like object fo, and return it as a dict.
 
+    With a table like ("tool", "name") only that table is decoded, see loads().
     """
     s = fo.read()
     if isinstance(s, bytes):
-        return loads(s.decode("utf-8"))
+        return loads(s.decode("utf-8"), table)
     else:
-        return loads(s)
-
-class ParseState:
-    """A parser state. Holds the entire input string, advances through it as
-    requested. Also tracks line and column for error reporting.
-
-    """
-    def __init__(self, string: str, line: int = 1, col: int = 0) -> None:
-        self._string = string
-        self._index = 0
-        self.line = line
-        self.col = col
-
-    def at_string(self, s: str) -> bool:
-        return self._string[self._index:self._index + len(s)] == s
-
-    def at_end(self) -> bool:
-        return self._index >= len(self._string)
-
-    def len(self) -> int:
-        return len(self._string) - self._index
-
-    def get(self, n: int) -> str:
-        return self._string[self._index:self._index + n]
-
-    def advance_through_class(self, cls: Container[str]) -> str:
-        i = self._index
-        while True:
-            if i < len(self._string) and self._string[i] in cls:
-                i += 1
-            else:
-                break
-        return self.advance(i - self._index)
-
-    def advance_until(self, s: str) -> str:
-        i = self._string.find(s, self._index)
-        if i == -1:
-            i = len(self._string)
-        else:
-            i += len(s)
-        return self.advance(i - self._index)
-
-    def advance(self, n: int) -> str:
-        d = self._string[self._index:self._index + n]
-        lc = d.count('\n')
-        cc = len(d.rpartition("\n")[2])
-        self.line += lc
-        if lc > 0:
-            self.col = cc
-        else:
-            self.col += cc
-        self._index += n
-        return d
-
-    def backtrack(self, n: int) -> None:
-        if self._index <= n:
-            self._index = 0
-            self.line = 1
-            self.col = 0
-            return
-        d = self._string[self._index - n:self._index]
-        lc = d.count('\n')
-        self.line -= lc
-        self._index -= n
-        ls = self._string.rfind('\n', 0, self._index) + 1
-        self.col = self._index - ls
-
-    def __repr__(self) -> str:
-        return ("ParseState({}, line={}, col={})".
-                format(repr(self._string), self.line, self.col))
-
-class TOMLDecodeError(Exception):
-    def __init__(self, msg: str, parse: ParseState) -> None:
-        super().__init__("{} (line {}, column {})".
-                         format(msg, parse.line, parse.col))
-
-def parse_throwaway(p: ParseState) -> Tuple[int, ParseState]:
-    s = ""
-    while True:
-        s += p.advance_through_class(" \t\r\n")
-        if p.at_string("#"):
-            s += p.advance_until("\n")
-        else:
-            break
-    lines = s.count("\n")
-    return lines, p
-
-def class_partition(cls: str, string: str) -> Tuple[str, str]:
-    """Given a set of characters and a string, take the longest prefix made up of
-    the characters in the set, and return a tuple of (prefix, remainder).
-
-    """
-    ns = string.lstrip(cls)
-    lc = len(string) - len(ns)
-    return (string[:lc], string[lc:])
-
-def class_rpartition(cls: str, string: str) -> Tuple[str, str]:
-    """As class_partition, but for rpartition/rstrip"""
-    ns = string.rstrip(cls)
-    lc = len(string) - len(ns)
-    if lc == 0:
-        return (string, '')
-    return (string[:-lc], string[-lc:])
-
+        return loads(s, table)
+
+class TOMLDecodeError(ValueError):
+    def __init__(self, msg: str, src: str = "", pos: int = 0) -> None:
+        line = src.count("\n", 0, pos) + 1
+        col = pos - src.rfind("\n", 0, pos) - 1
+        super().__init__("{} (line {}, column {})".format(msg, line, col))
+        self.msg = msg
+        self.doc = src
+        self.pos = pos
+        self.lineno = line
+        self.colno = col
+
+# whitespace, newlines and comments between the statements (and in arrays)
+blank_re = re.compile(r"(?:[ \t\r\n]+|#[^\n]*)*")
+# the rest of a line after a key/value pair or a table header
+eol_re = re.compile(r"[ \t]*(?:#[^\n]*)?(?:\r?\n|$)")
+ws_re = re.compile(r"[ \t]*")
+equals_re = re.compile(r"[ \t]*=[ \t]*")
+key_re = re.compile(r"[ \t]*(?:([A-Za-z0-9_-]+)|" +
+                    r'"((?:[^"\\\x00-\x08\x0a-\x1f\x7f]|\\.)*)"|' +
+                    r"'([^'\x00-\x08\x0a-\x1f\x7f]*)')[ \t]*")
+
+basic_re = re.compile(r'"([^"\\\x00-\x08\x0a-\x1f\x7f]*)"')  # no escapes
+escaped_re = re.compile(r'"((?:[^"\\\x00-\x08\x0a-\x1f\x7f]|\\.)*)"')
+literal_re = re.compile(r"'([^'\x00-\x08\x0a-\x1f\x7f]*)'")
+ml_basic_re = re.compile(r'"""((?:[^"\\\x00-\x08\x0b\x0c\x0e-\x1f\x7f]|' +
+                         r'\\.|"(?!""))*)("{3,5})', re.S)
+ml_literal_re = re.compile(r"'''((?:[^'\x00-\x08\x0b\x0c\x0e-\x1f\x7f]|" +
+                           r"'(?!''))*)('{3,5})", re.S)
+escape_re = re.compile(r'\\(?:([btnfr"\\])|u([0-9A-Fa-f]{4})|' +
+                       r'U([0-9A-Fa-f]{8})|([ \t]*\r?\n[ \t\r\n]*)|(.?))',
+                       re.S)
 escape_vals: Dict[str, str] = {
     'b': "\b", 't': "\t", 'n': "\n", 'f': "\f", 'r': "\r",
     '"': '"', '\\': '\\'
 }
-control_chars = [chr(i) for i in list(range(0, 9)) + list(range(11, 32)) +
-                 [127]]
-def parse_string(p: ParseState, delim: str = '"', allow_escapes: bool = True,
-                 allow_newlines: bool = False,
-                 whitespace_escape: bool = False) -> Tuple[str, ParseState]:
-    if not p.at_string(delim):
-        raise TOMLDecodeError(f"string doesn't begin with delimiter '{delim}'",
-                              p)
-    p.advance(len(delim))
-    sv = ""
-    while True:
-        sv += p.advance_until(delim)
-        if p.at_end() and not sv.endswith(delim):  # closing quote not found
-            raise TOMLDecodeError("end of file inside string", p)
-        # get all backslashes before the quote
-        if allow_escapes:
-            a, b = class_rpartition("\\", sv[:-len(delim)])
-            if len(b) % 2 == 0:  # if backslash count is even, it's not escaped
-                break
-            # escape only invalidates one character; if we're in a
-            # multi-character string, backtrack to try the rest of the delim
-            # (this catches cases like \"""" to end a string)
-            n_remove = len(delim) - 1
-            if n_remove > 0:
-                p.backtrack(n_remove)
-                sv = sv[:-n_remove]
-        else:
-            break
-        if p.at_end():
-            raise TOMLDecodeError("end of file after escaped delimiter", p)
-    sv = sv[:-len(delim)]
-    if "\n" in sv and not allow_newlines:
-        raise TOMLDecodeError("newline in basic string", p)
-    if any(i in control_chars for i in sv):
-        raise TOMLDecodeError("unescaped control character in string", p)
-    if allow_newlines and sv.startswith("\n"):
-        sv = sv[1:]
-    bs = 0
-    last_subst = ''
-    ws_re = re.compile(r"[ \t]*\n")
-    while allow_escapes:
-        bs = sv.find("\\", bs + len(last_subst))
-        if bs == -1:
-            break
-        escape_end = bs + 2
-        ev = sv[bs + 1]
-        if ev in escape_vals:
-            subst = escape_vals[ev]
-        elif ev == 'u':
-            hexval = sv[bs + 2:bs + 6]
-            if len(hexval) != 4:
-                raise TOMLDecodeError("hexval cutoff in \\u", p)
-            try:
-                iv = int(hexval, base=16)
-                # spec requires we error on Unicode surrogates
-                if iv > 0xd800 and iv <= 0xdfff:
-                    raise TOMLDecodeError(
-                        f"non-scalar unicode escape '\\u{hexval}'", p
-                    )
-                subst = chr(iv)
-            except ValueError as e:
-                raise TOMLDecodeError(f"bad hex escape '\\u{hexval}'", p) from e
-            escape_end += 4
-        elif ev == 'U':
-            hexval = sv[bs + 2:bs + 10]
-            if len(hexval) != 8:
-                raise TOMLDecodeError("hexval cutoff in \\U", p)
-            try:
-                iv = int(hexval, base=16)
-                if iv > 0xd800 and iv <= 0xdfff:
-                    raise TOMLDecodeError(
-                        f"non-scalar unicode escape '\\U{hexval}'", p
-                    )
-                subst = chr(iv)
-            except (ValueError, OverflowError) as e:
-                raise TOMLDecodeError(f"bad hex escape '\\U{hexval}'", p) from e
-            escape_end += 8
-        elif whitespace_escape and ws_re.match(sv, pos=bs + 1):
-            a, b = class_partition(" \t\n", sv[bs + 2:])
-            escape_end += len(a)
-            subst = ''
-        else:
-            raise TOMLDecodeError(f"\\{ev} not a valid escape", p)
-        sv = sv[:bs] + subst + sv[escape_end:]
-        last_subst = subst
-    return sv, p  # .advance(adv_len)
 
-float_re = re.compile(r"[+-]?(inf|nan|(([0-9]|[1-9][0-9_]*[0-9])" +
-                      r"(?P<frac>\.([0-9]|[0-9][0-9_]*[0-9]))?" +
-                      r"(?P<exp>[eE][+-]?([0-9]|[0-9][0-9_]*[0-9]))?))" +
-                      r"(?=([\s,\]}]|$))")
-def parse_float(p: ParseState) -> Tuple[float, ParseState]:
-    o = float_re.match(p._string, pos=p._index)
+number_re = re.compile(r"(?:0x[0-9A-Fa-f](?:_?[0-9A-Fa-f])*|" +
+                       r"0o[0-7](?:_?[0-7])*|0b[01](?:_?[01])*|" +
+                       r"[+-]?(?:0|[1-9](?:_?[0-9])*)" +
+                       r"(?:\.[0-9](?:_?[0-9])*)?" +
+                       r"(?:[eE][+-]?[0-9](?:_?[0-9])*)?|" +
+                       r"[+-]?(?:inf|nan))(?=[ \t\r\n,\]}#]|$)")
+datetime_re = re.compile(r"(\d{4})-(\d\d)-(\d\d)" +
+                         r"(?:[Tt ](\d\d):(\d\d):(\d\d)(?:\.(\d+))?" +
+                         r"([Zz]|[+-]\d\d:\d\d)?)?")
+time_re = re.compile(r"(\d\d):(\d\d):(\d\d)(?:\.(\d+))?")
+
+# any token of a value that is only skipped - brackets are counted
+skip_re = re.compile(r'"""(?:[^"\\]|\\.|"(?!""))*"{3,5}|' +
+                     r"'''(?:[^']|'(?!''))*'{3,5}|" +
+                     r'"(?:[^"\\\n]|\\.)*"|' + r"'[^'\n]*'|" +
+                     r"#[^\n]*|[^\"'#\[\]{}\n]+|\n|([\[{])|([\]}])", re.S)
+
+def unescape(sv: str, src: str, pos: int, multiline: bool = False) -> str:
+    def escaped(o: re.Match) -> str:
+        simple, u4, u8, newline, other = o.groups()
+        if simple:
+            return escape_vals[simple]
+        if u4 or u8:
+            iv = int(u4 or u8, base=16)
+            # spec requires we error on Unicode surrogates
+            if 0xd800 <= iv <= 0xdfff or iv > 0x10ffff:
+                raise TOMLDecodeError(f"non-scalar unicode escape '{o.group(0)}'", src, pos)
+            return chr(iv)
+        if newline is not None and multiline:
+            return ''
+        raise TOMLDecodeError(f"\\{other or newline} not a valid escape", src, pos)
+    return escape_re.sub(escaped, sv)
+
+def parse_string(src: str, pos: int) -> Tuple[str, int]:
+    if src.startswith('"""', pos):
+        o = ml_basic_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError("end of file inside string", src, pos)
+        sv = o.group(1) + o.group(2)[3:]
+        if sv.startswith("\n"):
+            sv = sv[1:]
+        elif sv.startswith("\r\n"):
+            sv = sv[2:]
+        if "\\" in sv:
+            sv = unescape(sv, src, pos, multiline=True)
+        return sv, o.end()
+    if src.startswith("'''", pos):
+        o = ml_literal_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError("end of file inside string", src, pos)
+        sv = o.group(1) + o.group(2)[3:]
+        if sv.startswith("\n"):
+            sv = sv[1:]
+        elif sv.startswith("\r\n"):
+            sv = sv[2:]
+        return sv, o.end()
+    if src.startswith('"', pos):
+        o = basic_re.match(src, pos)
+        if o is not None:
+            return o.group(1), o.end()
+        o = escaped_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError("bad basic string", src, pos)
+        return unescape(o.group(1), src, pos), o.end()
+    o = literal_re.match(src, pos)
     if o is None:
-        raise TOMLDecodeError("tried to parse_float non-float", p)
-    mv = o.group(0)
-    if (not (o.group('frac') or o.group('exp')) and
-        not ('inf' in mv or 'nan' in mv)):
-        raise TOMLDecodeError("tried to parse_float, but should be int", p)
-    p.advance(len(mv))
-    if '__' in mv:
-        raise TOMLDecodeError("double underscore in number", p)
-    sv = mv.replace('_', '')
-    rv = float(sv)
-    return rv, p
-
-int_re = re.compile(r"((0[xob][0-9a-fA-F_]+)|" +
-                    r"([+-]?([0-9]|[1-9][0-9_]*[0-9])))" +
-                    r"(?=[\s,\]}]|$)")
-def parse_int(p: ParseState) -> Tuple[int, ParseState]:
-    o = int_re.match(p._string, pos=p._index)
+        raise TOMLDecodeError("bad literal string", src, pos)
+    return o.group(1), o.end()
+
+def parse_number(src: str, pos: int) -> Tuple[Any, int]:
+    o = datetime_re.match(src, pos)
+    if o is not None:
+        return parse_datetime(o, src, pos), o.end()
+    o = time_re.match(src, pos)
+    if o is not None:
+        hour, minute, sec, frac = o.groups()
+        try:
+            return datetime.time(int(hour), int(minute), int(sec), micro_seconds(frac)), o.end()
+        except ValueError as e:
+            raise TOMLDecodeError(str(e), src, pos) from e
+    o = number_re.match(src, pos)
     if o is None:
-        raise TOMLDecodeError("tried to parse_int non-int", p)
+        raise TOMLDecodeError("can't parse type", src, pos)
     mv = o.group(0)
-    p.advance(len(mv))
-    if '__' in mv or re.match('0[xob]_', mv) or mv.endswith('_'):
-        raise TOMLDecodeError(f"invalid underscores in int '{mv}'", p)
     sv = mv.replace('_', '')
-    base = 10
-    if sv.startswith('0x'):
-        base = 16
-        sv = sv[2:]
-    elif sv.startswith('0b'):
-        base = 2
-        sv = sv[2:]
-    elif sv.startswith('0o'):
-        base = 8
-        sv = sv[2:]
+    if sv[:2] in ("0x", "0o", "0b"):
+        return int(sv[2:], base={"x": 16, "o": 8, "b": 2}[sv[1]]), o.end()
+    if "." in sv or "e" in sv or "E" in sv or "inf" in sv or "nan" in sv:
+        return float(sv), o.end()
+    return int(sv), o.end()
+
+def micro_seconds(frac: Optional[str]) -> int:
+    return int((frac or "0")[:6].ljust(6, "0"))
+
+def parse_datetime(o: re.Match, src: str, pos: int) -> Any:
+    year, month, day, hour, minute, sec, frac, tz = o.groups()
     try:
-        rv = int(sv, base=base)
+        if hour is None:
+            return datetime.date(int(year), int(month), int(day))
+        tzi: Optional[datetime.tzinfo] = None
+        if tz in ("Z", "z"):
+            tzi = datetime.timezone.utc
+        elif tz:
+            td = datetime.timedelta(hours=int(tz[1:3]), minutes=int(tz[4:6]))
+            tzi = datetime.timezone(-td if tz[0] == "-" else td)
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(sec),
+                                 micro_seconds(frac), tzi)
     except ValueError as e:
-        raise TOMLDecodeError(f"invalid base {base} integer '{mv}'", p) from e
-    return rv, p
+        raise TOMLDecodeError(str(e), src, pos) from e
 
-def parse_array(p: ParseState) -> Tuple[List[Any], ParseState]:
-    rv = []
-    if not p.at_string('['):
-        raise TOMLDecodeError("tried to parse_array non-array", p)
-    p.advance(1)
-    n, p = parse_throwaway(p)
+def parse_array(src: str, pos: int) -> Tuple[List[Any], int]:
+    rv: List[Any] = []
+    pos += 1
     while True:
-        if p.at_string(']'):
-            p.advance(1)
-            break
-        v, p = parse_value(p)
+        pos = blank_re.match(src, pos).end()
+        if src.startswith("]", pos):
+            return rv, pos + 1
+        v, pos = parse_value(src, pos)
         rv.append(v)
-        n, p = parse_throwaway(p)
-        if p.at_string(','):
-            p.advance(1)
-            n, p = parse_throwaway(p)
-            continue
-        if p.at_string(']'):
-            p.advance(1)
-            break
+        pos = blank_re.match(src, pos).end()
+        c = src[pos:pos + 1]
+        if c == ",":
+            pos += 1
+        elif c == "]":
+            return rv, pos + 1
         else:
-            raise TOMLDecodeError(f"bad next char {repr(p.get(1))} in array",
-                                  p)
-    return rv, p
+            raise TOMLDecodeError(f"bad next char {c!r} in array", src, pos)
 
-
-date_res = r"(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)"
-time_res = r"(?P<hr>\d\d):(?P<min>\d\d):(?P<sec>\d\d)(\.(?P<msec>\d{3,}))?"
-
-date_re = re.compile(date_res)
-time_re = re.compile(time_res)
-
-datetime_re = re.compile(date_res + r"[T ]" + time_res +
-                         r"(?P<tz>(Z|[+-]\d\d:\d\d))?")
-
-def date_from_string(o: Match) -> datetime.date:
-    year, month, day = [int(o.group(i)) for i in ['year', 'month', 'day']]
-    rv = datetime.date(year, month, day)
-    return rv
-
-def time_from_string(o: Match) -> datetime.time:
-    hour, minute, sec = [int(o.group(i)) for i in ['hr', 'min', 'sec']]
-    msec_str = (o.group('msec') if o.group('msec') else "0")[:6]
-    msec = int(msec_str) * 10 ** (6 - len(msec_str))
-    rv = datetime.time(hour, minute, sec, msec)
-    return rv
-
-def datetime_from_string(o: Match) -> datetime.datetime:
-    date = date_from_string(o)
-    time = time_from_string(o)
-    tz = o.group('tz')
-    tzi: Optional[datetime.timezone]
-    if tz == 'Z':
-        tzi = datetime.timezone.utc
-    elif tz:
-        td = datetime.timedelta(hours=int(tz[1:3]), minutes=int(tz[4:6]))
-        if tz[0] == '-':
-            td = -td
-        tzi = datetime.timezone(td)
-    else:
-        tzi = None
-    rv = datetime.datetime(date.year, date.month, date.day, time.hour,
-                           time.minute, time.second, time.microsecond, tzi)
-    return rv
-
-def parse_datetime(p: ParseState) -> Tuple[Union[datetime.date, datetime.time,
-                                                 datetime.datetime],
-                                           ParseState]:
-    o = datetime_re.match(p._string, pos=p._index)
-    if o:
-        p.advance(o.end() - o.pos)
-        return datetime_from_string(o), p
-    o = time_re.match(p._string, pos=p._index)
-    if o:
-        p.advance(o.end() - o.pos)
-        return time_from_string(o), p
-    o = date_re.match(p._string, pos=p._index)
-    if o:
-        p.advance(o.end() - o.pos)
-        return date_from_string(o), p
-    raise TOMLDecodeError("failed to parse datetime (shouldn't happen)", p)
-
-def is_date_or_time(p: ParseState) -> bool:
-    return (bool(date_re.match(p._string, pos=p._index)) or
-            bool(time_re.match(p._string, pos=p._index)))
-
-def parse_inline_table(p: ParseState) -> Tuple[Dict[str, Any], ParseState]:
-    if not p.at_string('{'):
-        raise TOMLDecodeError("tried to parse_inline_table non-table", p)
+def parse_inline_table(src: str, pos: int) -> Tuple[Dict[str, Any], int]:
     rv: Dict[str, Any] = {}
-    p.advance(1)
-    p.advance_through_class(" \t")
+    pos = ws_re.match(src, pos + 1).end()
+    if src.startswith("}", pos):
+        return rv, pos + 1
     while True:
-        if p.at_string('}'):
-            p.advance(1)
-            break
-        kl, p = parse_keylist(p)
-        p.advance_through_class(" \t")
-        if not p.at_string('='):
-            raise TOMLDecodeError(f"no = after key {kl} in inline", p)
-        p.advance(1)
-        p.advance_through_class(" \t")
-        v, p = parse_value(p)
-        p.advance_through_class(" \t")
-        target = proc_kl(rv, kl[:-1], False, p, set())
-        k = kl[-1]
-        if k in target:
-            raise TOMLDecodeError(f"duplicated key '{k}' in inline", p)
-        target[k] = v
-        if p.at_string(','):
-            p.advance(1)
-            p.advance_through_class(" \t")
-            continue
-        if p.at_string('}'):
-            p.advance(1)
-            break
+        kl, pos = parse_keylist(src, pos)
+        o = equals_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError(f"no = after key {kl} in inline", src, pos)
+        v, pos = parse_value(src, o.end())
+        set_key(rv, kl, v, src, pos, set())
+        pos = ws_re.match(src, pos).end()
+        c = src[pos:pos + 1]
+        if c == ",":
+            pos = ws_re.match(src, pos + 1).end()
+        elif c == "}":
+            return rv, pos + 1
         else:
-            raise TOMLDecodeError(f"bad next char {repr(p.get(1))}" +
-                                  " in inline table", p)
-    return rv, p
-
-def parse_dispatch_string(p: ParseState, multiline_allowed:
-                          bool = True) -> Tuple[str, ParseState]:
-    if p.at_string('"""'):
-        if not multiline_allowed:
-            raise TOMLDecodeError("multiline string where not allowed", p)
-        val, p = parse_string(p, delim='"""', allow_escapes=True,
-                              allow_newlines=True, whitespace_escape=True)
-    elif p.at_string('"'):
-        val, p = parse_string(p, delim='"', allow_escapes=True,
-                              allow_newlines=False, whitespace_escape=False)
-    elif p.at_string("'''"):
-        if not multiline_allowed:
-            raise TOMLDecodeError("multiline string where not allowed", p)
-        val, p = parse_string(p, delim="'''", allow_escapes=False,
-                              allow_newlines=True, whitespace_escape=False)
-    elif p.at_string("'"):
-        val, p = parse_string(p, delim="'", allow_escapes=False,
-                              allow_newlines=False, whitespace_escape=False)
-    return val, p
-
-def parse_value(p: ParseState) -> Tuple[Any, ParseState]:
-    val: Any
-    if p.get(1) in ["'", '"']:
-        val, p = parse_dispatch_string(p)
-    elif p.at_string('['):
-        val, p = parse_array(p)
-    elif p.at_string('{'):
-        val, p = parse_inline_table(p)
-    elif p.at_string('true'):
-        val = True
-        p.advance(4)
-    elif p.at_string('false'):
-        val = False
-        p.advance(5)
-    elif int_re.match(p._string, pos=p._index):
-        val, p = parse_int(p)
-    elif float_re.match(p._string, pos=p._index):
-        val, p = parse_float(p)
-    elif is_date_or_time(p):
-        val, p = parse_datetime(p)
-    else:
-        raise TOMLDecodeError("can't parse type", p)
-    return val, p
-
-# characters allowed in unquoted keys
-key_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-def parse_key(p: ParseState) -> Tuple[str, ParseState]:
-    ic = p.get(1)
-    if ic in ['"', "'"]:
-        k, p = parse_dispatch_string(p, multiline_allowed=False)
-    elif ic in key_chars:
-        k = p.advance_through_class(key_chars)
-    else:
-        raise TOMLDecodeError(f"'{p.get(1)}' cannot begin key", p)
-    return k, p
-
-def parse_keylist(p: ParseState) -> Tuple[List[str], ParseState]:
+            raise TOMLDecodeError(f"bad next char {c!r} in inline table", src, pos)
+
+def parse_value(src: str, pos: int) -> Tuple[Any, int]:
+    c = src[pos:pos + 1]
+    if c == '"' or c == "'":
+        return parse_string(src, pos)
+    if c == "[":
+        return parse_array(src, pos)
+    if c == "{":
+        return parse_inline_table(src, pos)
+    if c == "t" and src.startswith("true", pos):
+        return True, pos + 4
+    if c == "f" and src.startswith("false", pos):
+        return False, pos + 5
+    return parse_number(src, pos)
+
+def skip_value(src: str, pos: int) -> int:
+    """ the end of the value without decoding it (for the tables not asked for) """
+    depth = 0
+    while pos < len(src):
+        o = skip_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError("bad value", src, pos)
+        if o.group(1):
+            depth += 1
+        elif o.group(2):
+            depth -= 1
+        elif depth <= 0 and (src[pos] == "\n" or src[pos] == "#"):
+            return pos
+        pos = o.end()
+    return pos
+
+def parse_keylist(src: str, pos: int) -> Tuple[List[str], int]:
     rv: List[str] = []
     while True:
-        k, p = parse_key(p)
-        p.advance_through_class(" \t")
-        rv.append(k)
-        if p.at_string('.'):
-            p.advance(1)
-            p.advance_through_class(" \t")
+        o = key_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError(f"{src[pos:pos + 1]!r} cannot begin key", src, pos)
+        bare, basic, literal = o.groups()
+        if bare is not None:
+            rv.append(bare)
+        elif basic is not None:
+            rv.append(unescape(basic, src, pos) if "\\" in basic else basic)
         else:
-            break
-    return rv, p
-
-def parse_pair(p: ParseState) -> Tuple[Tuple[Optional[List[str]], Any], ParseState]:
-    if p.at_end():
-        return (None, None), p
-    kl, p = parse_keylist(p)
-    p.advance_through_class(" \t")
-    if not p.at_string('='):
-        raise TOMLDecodeError(f"no = following key '\"{kl}\"'", p)
-    p.advance(1)
-    p.advance_through_class(" \t")
-    v, p = parse_value(p)
-    return (kl, v), p
-
-def parse_tablespec(p: ParseState) -> Tuple[List[str], ParseState]:
-    if not p.at_string('['):
-        raise TOMLDecodeError("tried parse_tablespec on non-tablespec", p)
-    p.advance(1)
-    tarray = False
-    if p.at_string('['):
-        p.advance(1)
-        tarray = True
-    p.advance_through_class(" \t")
-    rv, p = parse_keylist(p)
-    if not p.at_string(']'):
-        raise TOMLDecodeError(f"Bad char {repr(p.get(1))} in tablespec",
-                              p)
-    p.advance(1)
-    if tarray:
-        if not p.at_string(']'):
-            raise TOMLDecodeError(f"Didn't close tarray properly", p)
-        p.advance(1)
-    return rv, p
-
-def proc_kl(rv: Dict[str, Any], kl: List[str], tarray: bool, p: ParseState,
-            toplevel_arrays: Set[int]) -> Dict[str, Any]:
-    """Handle a table spec keylist, modifying rv in place; returns target"""
+            rv.append(literal)
+        pos = o.end()
+        if not src.startswith(".", pos):
+            return rv, pos
+        pos += 1
+
+def set_key(rv: Dict[str, Any], kl: List[str], v: Any, src: str, pos: int,
+            static: Set[int]) -> None:
+    """ a key/value pair - a dotted key creates the tables in between """
     c = rv
-    if len(kl) == 0:
-        return c
-    # all entries except last must be dicts
-    for i in kl[:-1]:
-        if i in c:
-            if type(c[i]) not in [dict, list]:
-                raise TOMLDecodeError(f"repeated key in keylist {repr(kl)}", p)
-        else:
-            c[i] = {}
-        if type(c[i]) == list and id(c[i]) in toplevel_arrays:
-            raise TOMLDecodeError("appended to statically defined " +
-                                  f"array '{i}'", p)
-        c = c[i] if type(c[i]) == dict else c[i][-1]
+    for k in kl[:-1]:
+        if k not in c:
+            c[k] = {}
+        elif type(c[k]) != dict or id(c[k]) in static:
+            raise TOMLDecodeError(f"repeated key in keylist {kl!r}", src, pos)
+        c = c[k]
+    k = kl[-1]
+    if k in c:
+        raise TOMLDecodeError(f"Key '{k}' is repeated", src, pos)
+    c[k] = v
+    if type(v) in (list, dict):
+        static.add(id(v))
+
+def open_table(rv: Dict[str, Any], kl: List[str], tarray: bool, src: str, pos: int,
+               static: Set[int], defined: Set[int]) -> Dict[str, Any]:
+    """ a [table] or [[table]] header - returns the target for the following pairs """
+    c = rv
+    for k in kl[:-1]:
+        if k not in c:
+            c[k] = {}
+        elif id(c[k]) in static:
+            raise TOMLDecodeError(f"appended to statically defined array '{k}'", src, pos)
+        elif type(c[k]) not in (dict, list):
+            raise TOMLDecodeError(f"repeated key in keylist {kl!r}", src, pos)
+        c = c[k] if type(c[k]) == dict else c[k][-1]
     fk = kl[-1]
     if tarray:
-        if fk in c:
-            if type(c[fk]) != list:
-                raise TOMLDecodeError(f"repeated key in keylist {repr(kl)}", p)
-        else:
+        if fk not in c:
             c[fk] = []
-        if id(c[fk]) in toplevel_arrays:
-            raise TOMLDecodeError("appended to statically defined " +
-                                  f"array '{fk}'", p)
+        elif type(c[fk]) != list:
+            raise TOMLDecodeError(f"repeated key in keylist {kl!r}", src, pos)
+        elif id(c[fk]) in static:
+            raise TOMLDecodeError(f"appended to statically defined array '{fk}'", src, pos)
         c[fk].append({})
         return c[fk][-1]
-    else:
-        if fk in c:
-            if type(c[fk]) != dict:
-                raise TOMLDecodeError(f"repeated key in keylist {repr(kl)}", p)
-        else:
-            c[fk] = {}
-        return c[fk]
-
-def loads(string: str) -> Dict[str, Any]:
-    """Load TOML data from the string passed in, and return it as a dict."""
+    if fk not in c:
+        c[fk] = {}
+    elif type(c[fk]) != dict or id(c[fk]) in static:
+        raise TOMLDecodeError(f"repeated key in keylist {kl!r}", src, pos)
+    if id(c[fk]) in defined:
+        raise TOMLDecodeError(f"duplicated table {kl}", src, pos)
+    defined.add(id(c[fk]))
+    return c[fk]
+
+def wanted(kl: Sequence[str], table: Sequence[str]) -> bool:
+    """ inside the table (or on the way to it) """
+    n = min(len(kl), len(table))
+    return tuple(kl[:n]) == tuple(table[:n])
+
+def loads(string: str, table: Sequence[str] = ()) -> Dict[str, Any]:
+    """Load TOML data from the string passed in, and return it as a dict.
+
+    With a table like ("tool", "name") the values of all other tables are only
+    skipped (and not checked), the result has just the path to that table.
+    """
+    src = string
     rv: Dict[str, Any] = {}
     cur_target = rv
-    p = ParseState(string)
-    first = True
-    n = 0
+    cur_table: List[str] = []
+    skipping = False
     # this tracks tables we've already seen just so we can error out on
     # duplicates as spec requires
-    toplevel_targets: Set[int] = set()
-    toplevel_arrays: Set[int] = set()
-    kl: Optional[List[str]]
-    while not p.at_end():
-        n2, p = parse_throwaway(p)
-        n += n2
-        if not first:
-            if n == 0:
-                raise TOMLDecodeError("Didn't find expected newline", p)
-        else:
-            first = False
-        if p.at_string('['):
-            tarray = p.get(2) == '[['
-            kl, p = parse_tablespec(p)
-            cur_target = proc_kl(rv, kl, tarray, p, toplevel_arrays)
-            if id(cur_target) in toplevel_targets:
-                raise TOMLDecodeError(f"duplicated table {kl}", p)
-            toplevel_targets.add(id(cur_target))
+    static: Set[int] = set()
+    defined: Set[int] = set()
+    pos = 0
+    end = len(src)
+    while True:
+        pos = blank_re.match(src, pos).end()
+        if pos >= end:
+            break
+        if src[pos] == "[":
+            tarray = src.startswith("[[", pos)
+            kl, pos = parse_keylist(src, pos + (2 if tarray else 1))
+            if not src.startswith("]]" if tarray else "]", pos):
+                raise TOMLDecodeError(f"Bad char {src[pos:pos + 1]!r} in tablespec", src, pos)
+            pos += 2 if tarray else 1
+            cur_table = kl
+            skipping = bool(table) and not wanted(kl, table)
+            if not skipping:
+                cur_target = open_table(rv, kl, tarray, src, pos, static, defined)
         else:
-            (kl, v), p = parse_pair(p)
-            if kl is not None:
-                if type(v) == list:
-                    toplevel_arrays.add(id(v))
-                target = proc_kl(cur_target, kl[:-1], False, p, set())
-                k = kl[-1]
-                if k in target:
-                    raise TOMLDecodeError(f"Key '{k}' is repeated", p)
-                target[k] = v
-        n, p = parse_throwaway(p)
+            kl, pos = parse_keylist(src, pos)
+            o = equals_re.match(src, pos)
+            if o is None:
+                raise TOMLDecodeError(f"no = following key '\"{kl}\"'", src, pos)
+            pos = o.end()
+            if skipping or (table and not wanted(cur_table + kl, table)):
+                pos = skip_value(src, pos)
+            else:
+                v, pos = parse_value(src, pos)
+                set_key(cur_target, kl, v, src, pos, static)
+        o = eol_re.match(src, pos)
+        if o is None:
+            raise TOMLDecodeError("Didn't find expected newline", src, pos)
+        pos = o.end()
     return rv
@@ -8,24 +8,16 @@ __copyright__ = "(C) 2025 Guido Draheim, licensed under MIT License"
 __author__ = "Guido U. Draheim"
 __version__ = "1.3.1287"
 
-from typing import Set, List, Dict, Optional, Union, Tuple, cast, NamedTuple, TypeVar, Deque, Iterable, TYPE_CHECKING
+from typing import Set, List, Dict, Optional, Union, Tuple, cast, NamedTuple, TypeVar, Deque, Iterable, Iterator, Generator, Callable, Protocol, BinaryIO, TextIO, TYPE_CHECKING
 import sys
 import re
 import os
 import os.path as fs
-import configparser
 import logging
+import threading
+import time
 from collections import deque, OrderedDict
-if sys.version_info >= (3,11,0):
-    import tomllib
-else:  # pragma: nocover
-    try:
-        import tomli as tomllib # type: ignore[no-redef,import-untyped]
-    except ImportError:
-        try:
-            import qtoml_decoder as tomllib # type: ignore[no-redef,import-untyped]
-        except ImportError:
-            tomllib = None # type: ignore[assignment]
+from types import GeneratorType
 DEBUG_TOML = logging.DEBUG
 DEBUG_TYPING = logging.DEBUG
 DEBUG_COPY = logging.INFO
@@ -47,13 +39,17 @@ if sys.version_info < (3,9,0): # pragma: nocover
 import ast
 if TYPE_CHECKING:
     from ast import parse, unparse
+    from optparse import OptionParser, Values # pylint: disable=deprecated-module
+    import socket
+    from typing import ParamSpec
+    TypeParams = ParamSpec("TypeParams") # pylint: disable=invalid-name
 try:
-    from ast_comments import parse, unparse, Comment # type: ignore[no-redef,import-untyped] # pylint: disable=wrong-import-position
+    from ast_comments import parse, unparse, enrich, Comment # type: ignore[no-redef,import-untyped] # pylint: disable=wrong-import-position
 except ImportError:
     # required for unittest.py
     sys.path.append(os.path.abspath(os.path.dirname(__file__)))
     try:
-        from ast_comments import parse, unparse, Comment # type: ignore[no-redef,import-untyped] # pylint: disable=wrong-import-position
+        from ast_comments import parse, unparse, enrich, Comment # type: ignore[no-redef,import-untyped] # pylint: disable=wrong-import-position
     except ImportError:
         class Comment(ast.Expr): # type: ignore[no-redef]
             pass
@@ -61,6 +57,7 @@ except ImportError:
 from ast import TypeIgnore
 
 TypeAST = TypeVar("TypeAST", bound=ast.AST) # pylint: disable=invalid-name
+TypeResult = TypeVar("TypeResult") # pylint: disable=invalid-name
 def copy_location(new_node: TypeAST, old_node: ast.AST) -> TypeAST:
     """ similar to ast.copy_location """
     if hasattr(old_node, "lineno") and hasattr(old_node, "end_lineno"):
@@ -68,6 +65,15 @@ def copy_location(new_node: TypeAST, old_node: ast.AST) -> TypeAST:
         setattr(new_node, "end_lineno", old_node.end_lineno)
     return new_node
 
+class LazyDump:
+    """ deferred ast.dump() for logging - the text is only built when the message is emitted """
+    __slots__ = ("node",)
+    def __init__(self, node: ast.AST) -> None:
+        self.node = node
+    def __str__(self) -> str:
+        return ast.dump(self.node)
+    __repr__ = __str__
+
 class TransformerSyntaxError(SyntaxError):
     pass
 
@@ -165,6 +171,14 @@ class Want:
     run_python = os.environ.get("PYTHON3_RUN_PYTHON", NIX)
     no_comments = to_int(os.environ.get("PYTHON3_NO_COMMENTS", NIX))
     no_unparser = to_int(os.environ.get("PYTHON3_NO_UNPARSER", NIX))
+    sequential_walks = to_int(os.environ.get("PYTHON3_SEQUENTIAL_WALKS", NIX))
+    check_fused_walks = to_int(os.environ.get("PYTHON3_CHECK_FUSED_WALKS", NIX))
+    syntax_census = to_int(os.environ.get("PYTHON3_SYNTAX_CENSUS", NIX), 1)
+    skip_constants = to_int(os.environ.get("PYTHON3_SKIP_CONSTANTS", NIX), 1)
+    cache_dir = os.environ.get("PYTHON3_CACHE_DIR", NIX)
+    cache_size = to_int(os.environ.get("PYTHON3_CACHE_SIZE", NIX), 65536)
+    cache_config = to_int(os.environ.get("PYTHON3_CACHE_CONFIG", NIX), 1) # 2 shows hit/miss
+    timings = to_int(os.environ.get("PYTHON3_TIMINGS", NIX))
 
 want = Want()
 
@@ -180,93 +194,273 @@ def ast_unparse(tree: ast.AST) -> str:
     else:
         return unparse(tree)
 
-from optparse import OptionParser # pylint: disable=deprecated-module
+class StreamUnparser:
+    """ mixin for the unparser classes - the text of each top-level statement is given to the output when it is complete """
+    _source: List[str]
+    _indent: int
+    _precedences: Dict[ast.AST, int]
+    written = False
+    def stream(self, tree: ast.AST, output: Callable[[str], object]) -> None:
+        self.output = output
+        self._source = []
+        self.traverse(tree) # type: ignore[attr-defined] # pylint: disable=no-member
+        self.flush()
+    def flush(self) -> None:
+        if self._source:
+            self.output("".join(self._source))
+            self._source = []
+            self.written = True
+            self._precedences.clear() # not needed after the statement
+    def maybe_newline(self) -> None:
+        if self._source or self.written:
+            self.write("\n") # type: ignore[attr-defined] # pylint: disable=no-member
+    def fill(self, text: str = NIX) -> None:
+        if not self._indent: # a top-level statement (or its else/except clause) is starting
+            self.flush()
+        super().fill(text) # type: ignore[misc] # pylint: disable=no-member
+
+stream_unparsers: Dict[type, type] = {}
+
+def ast_unparse_stream(tree: ast.AST, output: Callable[[str], object]) -> None:
+    """ like ast_unparse but the text is given to output() in chunks, one for each top-level statement """
+    unparser = cast(type, ast._Unparser if want.no_unparser else getattr(sys.modules[unparse.__module__], "_Unparser", ast._Unparser)) # type: ignore[attr-defined] # pylint: disable=protected-access
+    if unparser not in stream_unparsers:
+        stream_unparsers[unparser] = type("StreamUnparser", (StreamUnparser, unparser), {})
+    stream_unparsers[unparser]().stream(tree, output)
+
+class UnparseStream:
+    """ the output of ast_unparse_stream - with run_python the shebang is replaced (or added), with newline
+        a nonempty text ends with a newline on close(). Only the current chunk is held in memory. """
+    def __init__(self, write: Callable[[str], object], run_python: str = NIX, newline: bool = False) -> None:
+        self.output = write
+        self.shebang = NIX
+        if run_python:
+            running = run_python if "/" in run_python else F"/usr/bin/env {run_python}"
+            self.shebang = F"#! {running}\n"
+        self.newline = newline
+        self.started = False
+        self.skipline = False
+        self.ending = NIX
+        self.size = 0
+    def write(self, chunk: str) -> None:
+        if not chunk:
+            return
+        if not self.started:
+            self.started = True
+            if self.shebang:
+                self.put(self.shebang)
+                self.skipline = chunk.startswith("#!")
+        if self.skipline:
+            if "\n" not in chunk:
+                return
+            _, chunk = chunk.split("\n", 1)
+            self.skipline = False
+        if chunk:
+            self.put(chunk)
+    def put(self, text: str) -> None:
+        self.output(text)
+        self.size += len(text)
+        self.ending = text[-1]
+    def unparse(self, tree: ast.AST) -> int:
+        ast_unparse_stream(tree, self.write)
+        return self.close()
+    def close(self) -> int:
+        if not self.started and self.shebang:
+            self.started = True
+            self.put(self.shebang)
+        if self.newline and self.size and self.ending != "\n":
+            self.put("\n")
+        return self.size
+
+def ast_unparse_text(tree: ast.AST, run_python: str = NIX) -> str:
+    """ the text of ast_unparse with the shebang for run_python """
+    chunks: List[str] = []
+    UnparseStream(chunks.append, run_python).unparse(tree)
+    return NIX.join(chunks)
+
+def ast_enrich(text: str, tree: ast.Module) -> ast.Module:
+    """ attach the comments to the tree from ast.parse - the second half of ast_comments.parse """
+    enrich(text, tree)
+    return tree
+
+class StageTimings(threading.local):
+    """ for --timings of the current file - each thread has its own list of stages """
+    def __init__(self) -> None:
+        threading.local.__init__(self)
+        self.stages: List[Tuple[str, float, int]] = []
+
+stage_timings = StageTimings()
+
+def timed(stage: str, func: "Callable[TypeParams, TypeResult]", *args: "TypeParams.args", **kwargs: "TypeParams.kwargs") -> TypeResult:
+    """ run one stage of the pipeline - with --timings the wall time and the nodes of the result are recorded """
+    if not want.timings:
+        return func(*args, **kwargs)
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    took = time.perf_counter() - started
+    tree = result if isinstance(result, ast.AST) else getattr(result, "tree", None)
+    nodes = sum(1 for _ in ast.walk(tree)) if isinstance(tree, ast.AST) else 0
+    stage_timings.stages.append((stage, took, nodes))
+    return result
+
+class TreeVisitor(Protocol):
+    """ a walk of the pipeline - a NodeVisitor, a BlockTransformer or a DefineIfPython2/3 """
+    def visit(self, node: TypeAST) -> object: ...
+
+def visit_timed(transformer: TreeVisitor, tree: TypeAST) -> TypeAST:
+    """ transformer.visit(tree) as a --timings stage named after the transformer - returns the (transformed) tree """
+    if not want.timings:
+        return cast(TypeAST, transformer.visit(tree))
+    if isinstance(transformer, FusedTransformer):
+        stage = "+".join(type(fused).__name__ for fused in transformer.transformers) or type(transformer).__name__
+    else:
+        stage = type(transformer).__name__
+    return cast(TypeAST, timed(stage, transformer.visit, tree))
+
+class BoilerplateTemplates:
+    """ each boilerplate snippet is parsed once per process - an insertion gets a fresh copy of the nodes """
+    def __init__(self) -> None:
+        self.templates: Dict[Tuple[str, int], bytes] = {}
+    def body(self, code: str) -> List[ast.stmt]:
+        import pickle # pylint: disable=import-outside-toplevel
+        key = (code, want.no_comments)
+        template = self.templates.get(key)
+        if template is None:
+            template = pickle.dumps(ast_parse(code).body, pickle.HIGHEST_PROTOCOL)
+            self.templates[key] = template
+        return cast(List[ast.stmt], pickle.loads(template)) # much faster than copy.deepcopy
+    def expr(self, code: str) -> ast.expr:
+        stmt = self.body(code)[0]
+        assert isinstance(stmt, ast.Expr)
+        return stmt.value
+
+boilerplate = BoilerplateTemplates()
+
+CmdlineOption = Tuple[Tuple[str, ...], Dict[str, object]]
+def option(*flags: str, **attrs: object) -> CmdlineOption:
+    return flags, attrs
+
+# the commandline options (the OptionParser is only built when needed - optparse is slow to load)
+OPTIONS: Tuple[CmdlineOption, ...] = (
+    option("-v", "--verbose", action="count", default=0, help="more logging"),
+    option("-^", "--quiet", action="count", default=0, help="less logging"),
+    option("-?", "--version", action="count", default=0, help="show version info"),
+    option("--no-define-range", action="count", default=00, help="3.0 define range()"),
+    option("--no-define-basestring", action="count", default=0, help="3.0 isinstance(str)"),
+    option("--no-define-callable", "--noc", action="count", default=0, help="3.2 callable(x)"),
+    option("--no-define-print-function", "--nop", action="count", default=0, help="3.0 print() function"),
+    option("--no-define-float-division", "--nod", action="count", default=0, help="3.0 float division"),
+    option("--no-define-absolute-import", action="count", default=0, help="3.0 absolute import"),
+    option("--no-datetime-fromisoformat", action="count", default=0, help="3.7 datetime.fromisoformat"),
+    option("--no-subprocess-run", action="count", default=0, help="3.5 subprocess.run"),
+    option("--no-time-monotonic", action="count", default=0, help="3.3 time.monotonic"),
+    option("--no-time-monotonic-ns", action="count", default=0, help="3.7 time.monotonic_ns"),
+    option("--no-import-pathlib2", action="count", default=0, help="3.3 pathlib to python2 pathlib2"),
+    option("--no-import-backports-zoneinfo", action="count", default=0, help="3.9 zoneinfo from backports"),
+    option("--no-import-toml", action="count", default=0, help="3.11 tomllib to external toml"),
+    option("--no-replace-fstring", action="count", default=0, help="3.6 f-strings"),
+    option("--no-replace-namedtuple-class", action="count", default=0, help="3.6 NamedTuple class"),
+    option("--no-replace-typeddict-class", action="count", default=0, help="3.8 TypeDict class"),
+    option("--no-replace-typeddict-pyi", action="count", default=0, help="3.8 TypeDict class (in pyi)"),
+    option("--no-replace-walrus-operator", action="count", default=0, help="3.8 walrus-operator"),
+    option("--no-replace-annotated-typing", action="count", default=0, help="3.9 Annotated[int, x] (in pyi)"),
+    option("--no-replace-builtin-typing", action="count", default=0, help="3.9 list[int] (in pyi)"),
+    option("--no-replace-union-typing", action="count", default=0, help="3.10 int|str (in pyi)"),
+    option("--no-replace-self-typing", action="count", default=0, help="3.11 Self (in pyi)"),
+    option("--no-remove-keywordonly", action="count", default=0, help="3.0 keywordonly parameters"),
+    option("--no-remove-positionalonly", action="count", default=0, help="3.8 positionalonly parameters"),
+    option("--no-remove-positional-pyi", action="count", default=0, help="3.8 positionalonly in *.pyi"),
+    option("--define-range", action="count", default=0, help="3.0 define range() to xrange() iterator"),
+    option("--define-basestring", action="count", default=0, help="3.0 isinstance(str) is basestring python2"),
+    option("--define-callable", action="count", default=0, help="3.2 callable(x) as in python2"),
+    option("--define-print-function", action="count", default=0, help="3.0 print() or from __future__"),
+    option("--define-float-division", action="count", default=0, help="3.0 float division or from __future__"),
+    option("--define-absolute-import", action="count", default=0, help="3.0 absolute import or from __future__"),
+    option("--datetime-fromisoformat", action="count", default=0, help="3.7 datetime.fromisoformat or boilerplate"),
+    option("--subprocess-run", action="count", default=0, help="3.5 subprocess.run or use boilerplate"),
+    option("--time-monotonic", action="count", default=0, help="3.3 time.monotonic or use time.time"),
+    option("--time-monotonic-ns", action="count", default=0, help="3.7 time.monotonic_ns or use time.time"),
+    option("--import-pathlib2", action="count", default=0, help="3.3 import pathlib2 as pathlib"),
+    option("--import-backports-zoneinfo", action="count", default=0, help="3.9 import zoneinfo from backports"),
+    option("--import-toml", action="count", default=0, help="3.11 import toml as tomllib"),
+    option("--replace-fstring", action="count", default=0, help="3.6 f-strings to string.format"),
+    option("--replace-namedtuple-class", action="count", default=0, help="3.6 NamedTuple to collections.namedtuple"),
+    option("--replace-typeddict-class", action="count", default=0, help="3.8 TypedDict to builtin dict"),
+    option("--replace-typeddict-pyi", action="count", default=0, help="3.8 TypedDict to builtin dict in *.pyi"),
+    option("--replace-walrus-operator", action="count", default=0, help="3.8 walrus 'if x := ():' to 'if x:'"),
+    option("--replace-annotated-typing", action="count", default=0, help="3.9 Annotated[int, x] converted to int"),
+    option("--replace-builtin-typing", action="count", default=0, help="3.9 list[int] converted to List[int]"),
+    option("--replace-union-typing", action="count", default=0, help="3.10 int|str converted to Union[int,str]"),
+    option("--replace-self-typing", action="count", default=0, help="3.11 Self converted to SelfClass TypeVar"),
+    option("--remove-typehints", action="count", default=0, help="3.5 function annotations and cast()"),
+    option("--remove-keywordonly", action="count", default=0, help="3.0 keywordonly parameters"),
+    option("--remove-positionalonly", action="count", default=0, help="3.8 positionalonly parameters"),
+    option("--remove-positional-pyi", action="count", default=0, help="3.8 positional parameters in *.pyi"),
+    option("--remove-var-typehints", action="count", default=0, help="only 3.6 variable annotations (typehints)"),
+    option("-u", "--upgrade", action="count", default=0, help="allow upgrade transformers:"),
+    option("--fstring-from-locals-format", action="count", default=0, help="replace idiom '{name}'.format(**locals())"),
+    option("--fstring-from-var-locals-format", action="count", default=0, help="and for x='{name}'; x.format(**locals())"),
+    option("--no-comments", action="count", default=0, help="do not use ast_comments to parse"),
+    option("--bare", action="count", default=0, help="do not use ast_comments (parse/unparse)"),
+    option("--sequential-walks", action="count", default=0, help="run each transformer in its own tree walk"),
+    option("--check-fused-walks", action="count", default=0, help="compare fused walks with sequential walks"),
+    option("--show", action="count", default=0, help="show transformer settings (from above)"),
+    option("--pretty", action="count", default=0, help="no transformers (based on python-version)"),
+    option("--pyi-version", metavar="3.6", default=NIX, help="set python version for py-includes"),
+    option("--python-version", metavar="2.7", default=NIX, help="set python features by version"),
+    option("--run-python", metavar="exe", default=NIX, help="replace shebang with #! /usr/bin/env exe"),
+    option("-O", "--old-python", action="count", default=0, help="replace shebang with /bin/env python"),
+    option("-V", "--dump", action="count", default=0, help="show ast tree before (and after) changes"),
+    option("-0", "--nowrite", action="store_true", default=False, help="suppress writing the transformed file.py"),
+    option("-1", "--inplace", action="count", default=0, help="file.py gets overwritten (+ file.pyi)"),
+    option("-2", "--append2", action="count", default=0, help="file.py into file_2.py + file_2.pyi"),
+    option("-3", "--remove3", action="count", default=0, help="file3.py into file.py + file.pyi"),
+    option("-6", "--py36", action="count", default=0, help="alias --no-make-pyi --python-version=3.6"),
+    option("-7", "--pyi37", action="count", default=0, help="alias --pyi-version=3.7"),
+    option("-9", "--py39", action="count", default=0, help="alias --no-make-pyi --python-version=3.9"),
+    option("-Y", "--make-stubs", "--stubs", action="count", default=0, help="generate file-stubs/__init__.pyi for mypy"),
+    option("-y", "--make-pyi", "--pyi", action="count", default=0, help="generate file.pyi includes as well"),
+    option("-n", "--no-make-pyi", "--no-pyi", action="count", default=0, help="do not generate any pyi includes"),
+    option("-o", "--outfile", metavar="FILE", default=NIX, help="explicit instead of file3_2.py"),
+    option("-r", "--recursive", metavar="DIR", action="append", default=None, help="transform the files below DIR"),
+    option("--include", metavar="PATTERNS", default=NIX, help="for --recursive (*.py or with -3 *3.py)"),
+    option("--exclude", metavar="PATTERNS", default=".*/,__pycache__/", help="for --recursive (%default)"),
+    option("--outdir", metavar="DIR", default=NIX, help="write outputs there mirroring the input tree"),
+    option("--package", action="count", default=0, help="resolve pyi imports across --recursive modules, write a *-stubs package"),
+    option("-j", "--jobs", metavar="N", type="int", default=0, help="transform files in N parallel processes"),
+    option("--cache", action="count", default=0, help="reuse results from $XDG_CACHE_HOME/strip-python3"),
+    option("--cache-dir", metavar="DIR", default=NIX, help="reuse results from a cache directory"),
+    option("--cache-size", metavar="KB", type="int", default=0, help="evict old cache entries above (65536 KB)"),
+    option("--cache-stats", action="count", default=0, help="show cache hits and misses at the end"),
+    option("--incremental", action="count", default=0, help="skip -1/-2/-3 outputs that are up to date"),
+    option("--manifest", metavar="FILE", default=NIX, help="for --incremental (.strip-python3.json)"),
+    option("--serve", action="count", default=0, help="answer json requests on stdin or the --socket"),
+    option("--stream", action="count", default=0, help="NUL separated path+source records on stdin"),
+    option("--socket", metavar="PATH", default=NIX, help="use the --serve process listening there"),
+    option("--watch", action="count", default=0, help="keep running and transform changed files again"),
+    option("--timings", action="count", default=0, help="show the time and nodes for each stage and file"),
+    option("--timings-json", metavar="FILE", default=NIX, help="write the --timings as json (- for stdout)"),
+    option("--profile", metavar="FILE", default=NIX, help="run in cProfile and write out.pstats"),
+)
+
+def cmdline_parser() -> "OptionParser":
+    """ the commandline options - also used for the settings of a StripSession """
+    from optparse import OptionParser # pylint: disable=deprecated-module,import-outside-toplevel,redefined-outer-name
+    cmdline = OptionParser("%prog [options] file3.py", description=__doc__.strip(), epilog=": -o - : default is to print the type-stripped and back-transformed py code")
+    cmdline.formatter.max_help_position = 37
+    for flags, attrs in OPTIONS:
+        cmdline.add_option(*flags, **attrs) # type: ignore[call-overload]
+    return cmdline
 
 def main() -> int:
     # global want
     # defs = read_defaults("pyproject.toml", "setup.cfg")
-    cmdline = OptionParser("%prog [options] file3.py", description=__doc__.strip(), epilog=": -o - : default is to print the type-stripped and back-transformed py code")
-    cmdline.formatter.max_help_position = 37
-    cmdline.add_option("-v", "--verbose", action="count", default=0, help="more logging")
-    cmdline.add_option("-^", "--quiet", action="count", default=0, help="less logging")
-    cmdline.add_option("-?", "--version", action="count", default=0, help="show version info")
-    cmdline.add_option("--no-define-range", action="count", default=00, help="3.0 define range()")
-    cmdline.add_option("--no-define-basestring", action="count", default=0, help="3.0 isinstance(str)")
-    cmdline.add_option("--no-define-callable", "--noc", action="count", default=0, help="3.2 callable(x)")
-    cmdline.add_option("--no-define-print-function", "--nop", action="count", default=0, help="3.0 print() function")
-    cmdline.add_option("--no-define-float-division", "--nod", action="count", default=0, help="3.0 float division")
-    cmdline.add_option("--no-define-absolute-import", action="count", default=0, help="3.0 absolute import")
-    cmdline.add_option("--no-datetime-fromisoformat", action="count", default=0, help="3.7 datetime.fromisoformat")
-    cmdline.add_option("--no-subprocess-run", action="count", default=0, help="3.5 subprocess.run")
-    cmdline.add_option("--no-time-monotonic", action="count", default=0, help="3.3 time.monotonic")
-    cmdline.add_option("--no-time-monotonic-ns", action="count", default=0, help="3.7 time.monotonic_ns")
-    cmdline.add_option("--no-import-pathlib2", action="count", default=0, help="3.3 pathlib to python2 pathlib2")
-    cmdline.add_option("--no-import-backports-zoneinfo", action="count", default=0, help="3.9 zoneinfo from backports")
-    cmdline.add_option("--no-import-toml", action="count", default=0, help="3.11 tomllib to external toml")
-    cmdline.add_option("--no-replace-fstring", action="count", default=0, help="3.6 f-strings")
-    cmdline.add_option("--no-replace-namedtuple-class", action="count", default=0, help="3.6 NamedTuple class")
-    cmdline.add_option("--no-replace-typeddict-class", action="count", default=0, help="3.8 TypeDict class")
-    cmdline.add_option("--no-replace-typeddict-pyi", action="count", default=0, help="3.8 TypeDict class (in pyi)")
-    cmdline.add_option("--no-replace-walrus-operator", action="count", default=0, help="3.8 walrus-operator")
-    cmdline.add_option("--no-replace-annotated-typing", action="count", default=0, help="3.9 Annotated[int, x] (in pyi)")
-    cmdline.add_option("--no-replace-builtin-typing", action="count", default=0, help="3.9 list[int] (in pyi)")
-    cmdline.add_option("--no-replace-union-typing", action="count", default=0, help="3.10 int|str (in pyi)")
-    cmdline.add_option("--no-replace-self-typing", action="count", default=0, help="3.11 Self (in pyi)")
-    cmdline.add_option("--no-remove-keywordonly", action="count", default=0, help="3.0 keywordonly parameters")
-    cmdline.add_option("--no-remove-positionalonly", action="count", default=0, help="3.8 positionalonly parameters")
-    cmdline.add_option("--no-remove-positional-pyi", action="count", default=0, help="3.8 positionalonly in *.pyi")
-    cmdline.add_option("--define-range", action="count", default=0, help="3.0 define range() to xrange() iterator")
-    cmdline.add_option("--define-basestring", action="count", default=0, help="3.0 isinstance(str) is basestring python2")
-    cmdline.add_option("--define-callable", action="count", default=0, help="3.2 callable(x) as in python2")
-    cmdline.add_option("--define-print-function", action="count", default=0, help="3.0 print() or from __future__")
-    cmdline.add_option("--define-float-division", action="count", default=0, help="3.0 float division or from __future__")
-    cmdline.add_option("--define-absolute-import", action="count", default=0, help="3.0 absolute import or from __future__")
-    cmdline.add_option("--datetime-fromisoformat", action="count", default=0, help="3.7 datetime.fromisoformat or boilerplate")
-    cmdline.add_option("--subprocess-run", action="count", default=0, help="3.5 subprocess.run or use boilerplate")
-    cmdline.add_option("--time-monotonic", action="count", default=0, help="3.3 time.monotonic or use time.time")
-    cmdline.add_option("--time-monotonic-ns", action="count", default=0, help="3.7 time.monotonic_ns or use time.time")
-    cmdline.add_option("--import-pathlib2", action="count", default=0, help="3.3 import pathlib2 as pathlib")
-    cmdline.add_option("--import-backports-zoneinfo", action="count", default=0, help="3.9 import zoneinfo from backports")
-    cmdline.add_option("--import-toml", action="count", default=0, help="3.11 import toml as tomllib")
-    cmdline.add_option("--replace-fstring", action="count", default=0, help="3.6 f-strings to string.format")
-    cmdline.add_option("--replace-namedtuple-class", action="count", default=0, help="3.6 NamedTuple to collections.namedtuple")
-    cmdline.add_option("--replace-typeddict-class", action="count", default=0, help="3.8 TypedDict to builtin dict")
-    cmdline.add_option("--replace-typeddict-pyi", action="count", default=0, help="3.8 TypedDict to builtin dict in *.pyi")
-    cmdline.add_option("--replace-walrus-operator", action="count", default=0, help="3.8 walrus 'if x := ():' to 'if x:'")
-    cmdline.add_option("--replace-annotated-typing", action="count", default=0, help="3.9 Annotated[int, x] converted to int")
-    cmdline.add_option("--replace-builtin-typing", action="count", default=0, help="3.9 list[int] converted to List[int]")
-    cmdline.add_option("--replace-union-typing", action="count", default=0, help="3.10 int|str converted to Union[int,str]")
-    cmdline.add_option("--replace-self-typing", action="count", default=0, help="3.11 Self converted to SelfClass TypeVar")
-    cmdline.add_option("--remove-typehints", action="count", default=0, help="3.5 function annotations and cast()")
-    cmdline.add_option("--remove-keywordonly", action="count", default=0, help="3.0 keywordonly parameters")
-    cmdline.add_option("--remove-positionalonly", action="count", default=0, help="3.8 positionalonly parameters")
-    cmdline.add_option("--remove-positional-pyi", action="count", default=0, help="3.8 positional parameters in *.pyi")
-    cmdline.add_option("--remove-var-typehints", action="count", default=0, help="only 3.6 variable annotations (typehints)")
-    cmdline.add_option("-u", "--upgrade", action="count", default=0, help="allow upgrade transformers:")
-    cmdline.add_option("--fstring-from-locals-format", action="count", default=0, help="replace idiom '{name}'.format(**locals())")
-    cmdline.add_option("--fstring-from-var-locals-format", action="count", default=0, help="and for x='{name}'; x.format(**locals())")
-    cmdline.add_option("--no-comments", action="count", default=0, help="do not use ast_comments to parse")
-    cmdline.add_option("--bare", action="count", default=0, help="do not use ast_comments (parse/unparse)")
-    cmdline.add_option("--show", action="count", default=0, help="show transformer settings (from above)")
-    cmdline.add_option("--pretty", action="count", default=0, help="no transformers (based on python-version)")
-    cmdline.add_option("--pyi-version", metavar="3.6", default=NIX, help="set python version for py-includes")
-    cmdline.add_option("--python-version", metavar="2.7", default=NIX, help="set python features by version")
-    cmdline.add_option("--run-python", metavar="exe", default=NIX, help="replace shebang with #! /usr/bin/env exe")
-    cmdline.add_option("-O", "--old-python", action="count", default=0, help="replace shebang with /bin/env python")
-    cmdline.add_option("-V", "--dump", action="count", default=0, help="show ast tree before (and after) changes")
-    cmdline.add_option("-0", "--nowrite", action="store_true", default=False, help="suppress writing the transformed file.py")
-    cmdline.add_option("-1", "--inplace", action="count", default=0, help="file.py gets overwritten (+ file.pyi)")
-    cmdline.add_option("-2", "--append2", action="count", default=0, help="file.py into file_2.py + file_2.pyi")
-    cmdline.add_option("-3", "--remove3", action="count", default=0, help="file3.py into file.py + file.pyi")
-    cmdline.add_option("-6", "--py36", action="count", default=0, help="alias --no-make-pyi --python-version=3.6")
-    cmdline.add_option("-7", "--pyi37", action="count", default=0, help="alias --pyi-version=3.7")
-    cmdline.add_option("-9", "--py39", action="count", default=0, help="alias --no-make-pyi --python-version=3.9")
-    cmdline.add_option("-Y", "--make-stubs", "--stubs", action="count", default=0, help="generate file-stubs/__init__.pyi for mypy")
-    cmdline.add_option("-y", "--make-pyi", "--pyi", action="count", default=0, help="generate file.pyi includes as well")
-    cmdline.add_option("-n", "--no-make-pyi", "--no-pyi", action="count", default=0, help="do not generate any pyi includes")
-    cmdline.add_option("-o", "--outfile", metavar="FILE", default=NIX, help="explicit instead of file3_2.py")
-    cmdline_set_defaults_from(cmdline, want.toolsection, want.pyproject_toml, want.setup_cfg)
+    cmdline = cmdline_parser()
     opt, cmdline_args = cmdline.parse_args()
+    if not opt.version or cmdline_args or opt.recursive or opt.serve or opt.stream or opt.watch:
+        # the config files are only read when there is something to transform
+        cmdline_set_defaults_from(cmdline, want.toolsection, want.pyproject_toml, want.setup_cfg)
+        opt, cmdline_args = cmdline.parse_args()
     logging.basicConfig(level = max(0, NOTE - 5 * opt.verbose + 10 * opt.quiet))
     if opt.version:
         print(F"version: {__version__}")
@@ -274,6 +468,50 @@ def main() -> int:
         if opt.version > 1:
             print(F"copyright: {__copyright__}")
             print("module: "+ os.path.basename(__file__))
+    py_version, no_make_pyi = cmdline_want(opt, want)
+    eachfile = EACH_REMOVE3 if opt.remove3 else 0
+    eachfile |= EACH_APPEND2 if opt.append2 else 0
+    eachfile |= EACH_INPLACE if opt.inplace else 0
+    make_pyi = opt.make_pyi or opt.append2 or opt.remove3 or opt.inplace
+    if opt.serve:
+        if cmdline_args or opt.recursive:
+            logg.error("--serve takes its files from the requests, not from the command line")
+            return 1
+        return serve(opt.socket)
+    if opt.stream:
+        return stream_records(sys.stdin.buffer, sys.stdout.buffer, minversion=py_version, run_python=want.run_python,
+                              typehints=bool((make_pyi or opt.make_stubs) and not no_make_pyi))
+    basedirs: Dict[str, str] = {}
+    if opt.recursive:
+        include = path_patterns(opt.include or ("*3.py" if opt.remove3 else "*.py"))
+        exclude = path_patterns(opt.exclude)
+        for topdir in opt.recursive:
+            if not fs.isdir(topdir):
+                logg.error("--recursive %s: not a directory", topdir)
+                return 1
+            for found in scandir_files(topdir, include, exclude):
+                cmdline_args.append(found)
+                basedirs[found] = topdir
+        logg.info("found %s files in %s", len(basedirs), " ".join(opt.recursive))
+    symbols: Optional[PackageSymbols] = None
+    if opt.package and not opt.recursive:
+        logg.error("--package needs the --recursive topdir of the package")
+    elif opt.package:
+        symbols = PackageSymbols()
+        for found, topdir in basedirs.items():
+            symbols.add(found, topdir, eachfile, opt.outdir)
+        logg.info("found %s modules for the package", len(symbols.modules))
+    def transform(args: List[str]) -> int:
+        return transformfiles(args, eachfile=eachfile, outfile=opt.outfile, nowrite=opt.nowrite, outdir=opt.outdir, basedirs=basedirs, symbols=symbols,
+            pyi = "i" if make_pyi and not no_make_pyi else NIX, stubs = "*-stubs/__init__.pyi" if (opt.make_stubs or symbols is not None) and not no_make_pyi else NIX,
+            minversion=py_version, run_python=want.run_python, jobs=opt.jobs, cache_stats=bool(opt.cache_stats),
+            manifest=(opt.manifest or MANIFEST) if opt.incremental else NIX, connect=opt.socket, timings_json=opt.timings_json)
+    def run(args: List[str]) -> int:
+        return watchfiles(args, transform) if opt.watch else transform(args)
+    return profiled(opt.profile, run)(cmdline_args) if opt.profile else run(cmdline_args)
+
+def cmdline_want(opt: "Values", want: Want) -> Tuple[Tuple[int, int], int]: # pylint: disable=redefined-outer-name
+    """ apply the commandline options to the 'want' settings, returns the target python version and no_make_pyi """
     if opt.run_python:
         want.run_python = opt.run_python
     elif opt.old_python:
@@ -395,6 +633,18 @@ def main() -> int:
     if opt.bare:
         want.no_comments = opt.bare
         want.no_unparser = opt.bare
+    if opt.sequential_walks:
+        want.sequential_walks = opt.sequential_walks
+    if opt.check_fused_walks:
+        want.check_fused_walks = opt.check_fused_walks
+    if opt.cache_dir:
+        want.cache_dir = opt.cache_dir
+    elif opt.cache:
+        want.cache_dir = cache_dir_default()
+    if opt.cache_size:
+        want.cache_size = opt.cache_size
+    if opt.timings or opt.timings_json:
+        want.timings = max(1, opt.timings)
     if opt.show:
         logg.log(NOTE, "%s = %s", "python-version-int", py_version)
         logg.log(NOTE, "%s = %s", "pyi-version-int", pyi_version)
@@ -412,15 +662,110 @@ def main() -> int:
         logg.log(NOTE, "%s = %s", "remove-typehints", want.remove_typehints)
     if opt.dump:
         want.show_dump = int(opt.dump)
-    eachfile = EACH_REMOVE3 if opt.remove3 else 0
-    eachfile |= EACH_APPEND2 if opt.append2 else 0
-    eachfile |= EACH_INPLACE if opt.inplace else 0
-    make_pyi = opt.make_pyi or opt.append2 or opt.remove3 or opt.inplace
-    return transformfiles(cmdline_args, eachfile=eachfile, outfile=opt.outfile, nowrite=opt.nowrite,
-        pyi = "i" if make_pyi and not no_make_pyi else NIX, stubs = "*-stubs/__init__.pyi" if opt.make_stubs and not no_make_pyi else NIX,
-        minversion=py_version, run_python=want.run_python)
+    return py_version, no_make_pyi
+
+ConfigSection = Dict[str, object]
+config_snapshots: Dict[Tuple[str, str], Tuple[Tuple[int, int], Optional[ConfigSection]]] = {}
+
+def config_section(configfile: str, toolsection: str) -> Optional[ConfigSection]:
+    """ the parsed [tool.section] of a pyproject.toml or the [section] of a setup.cfg (None if there is none).
+        The snapshot is reused as long as the file has the same mtime and size. """
+    try:
+        st = os.stat(configfile)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    snapshot = config_snapshots.get((configfile, toolsection))
+    if snapshot is not None and snapshot[0] == stamp:
+        return snapshot[1]
+    cache = ConfigCache(want.cache_dir or cache_dir_default()) if want.cache_config else None
+    if cache is not None:
+        cached = cache.load(configfile, toolsection, stamp)
+        if cached is not None:
+            config_snapshots[(configfile, toolsection)] = (stamp, cached[0])
+            return cached[0]
+    section: Optional[ConfigSection] = None
+    if configfile.endswith(".toml"):
+        toml_load = toml_loader(("tool", toolsection))
+        if toml_load is not None:
+            with open(configfile, "rb") as f:
+                conf = toml_load(f)
+            tool = conf.get("tool")
+            if isinstance(tool, dict) and isinstance(tool.get(toolsection), dict):
+                section = tool[toolsection]
+            else:
+                logg.log(DEBUG_TOML, "have sections %s", list(tool.keys()) if isinstance(tool, dict) else [])
+    elif configfile.endswith(".cfg"):
+        import configparser # pylint: disable=import-outside-toplevel
+        confs = configparser.ConfigParser()
+        confs.read(configfile)
+        if toolsection in confs:
+            section = dict(confs[toolsection])
+    config_snapshots[(configfile, toolsection)] = (stamp, section)
+    if cache is not None:
+        cache.save(configfile, toolsection, stamp, section)
+    return section
+
+class ConfigCache:
+    """ the parsed config sections on disk - an entry is only used while the file has the same (size, mtime_ns) """
+    subdir = "config" # not one of the key[:2] subdirs of the TransformCache
+    def __init__(self, cachedir: str) -> None:
+        self.cachedir = fs.join(cachedir, self.subdir)
+    def path(self, configfile: str, toolsection: str) -> str:
+        import hashlib # pylint: disable=import-outside-toplevel
+        key = hashlib.sha256(repr((__version__, fs.abspath(configfile), toolsection)).encode("utf-8")).hexdigest()
+        return fs.join(self.cachedir, key + ".json")
+    def load(self, configfile: str, toolsection: str, stamp: Tuple[int, int]) -> Optional[Tuple[Optional[ConfigSection]]]:
+        """ the cached section (wrapped in a tuple as the section itself may be None) """
+        import json # pylint: disable=import-outside-toplevel
+        path = self.path(configfile, toolsection)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["size"] == stamp[1] and entry["mtime_ns"] == stamp[0]:
+                self.debug("hit", configfile)
+                return (entry["section"],)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logg.debug("config cache %s: %s", path, e)
+        self.debug("miss", configfile)
+        return None
+    def save(self, configfile: str, toolsection: str, stamp: Tuple[int, int], section: Optional[ConfigSection]) -> None:
+        import json # pylint: disable=import-outside-toplevel
+        path = self.path(configfile, toolsection)
+        temp = F"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cachedir, exist_ok=True)
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump({"size": stamp[1], "mtime_ns": stamp[0], "section": section}, f)
+            os.replace(temp, path)
+        except (OSError, TypeError, ValueError) as e: # toml dates are not json
+            logg.debug("can not write config cache %s: %s", path, e)
+            if fs.exists(temp):
+                os.remove(temp)
+    def debug(self, found: str, configfile: str) -> None:
+        # the config is read before the logging is set up, so PYTHON3_CACHE_CONFIG=2 uses the warning level
+        logg.log(logging.WARNING if want.cache_config > 1 else logging.DEBUG, "config cache %s: %s", found, configfile)
+
+def toml_loader(table: Tuple[str, ...] = ()) -> Optional[Callable[[BinaryIO], ConfigSection]]:
+    """ the load() of tomllib (or one of its backports) - only imported when a pyproject.toml is read.
+        The bundled qtoml_decoder does only decode the given table, skipping the others. """
+    # pylint: disable=import-outside-toplevel
+    if sys.version_info >= (3,11,0):
+        import tomllib
+        return tomllib.load
+    try: # pragma: nocover
+        import tomli # type: ignore[import-untyped,import-not-found,unused-ignore]
+        return cast(Callable[[BinaryIO], ConfigSection], tomli.load)
+    except ImportError: # pragma: nocover
+        try:
+            import qtoml_decoder # type: ignore[import-untyped,import-not-found,unused-ignore]
+            return lambda f: cast(ConfigSection, qtoml_decoder.load(f, table)) # type: ignore[arg-type] # it does also read bytes
+        except ImportError:
+            return None
 
-def cmdline_set_defaults_from(cmdline: OptionParser, toolsection: str, *files: str) -> Dict[str, Union[str, int]]:
+def cmdline_set_defaults_from(cmdline: "OptionParser", toolsection: str, *files: str) -> Dict[str, Union[str, int]]:
     defnames: Dict[str, str] = OrderedDict()
     defaults: Dict[str, Union[str, int]] = {}
     for opt in cmdline.option_list:
@@ -433,63 +778,58 @@ def cmdline_set_defaults_from(cmdline: OptionParser, toolsection: str, *files: s
     settings: Dict[str, Union[str, int]] = {}
     for configfile in files:
         if fs.isfile(configfile):
-            if configfile.endswith(".toml") and tomllib:
+            if configfile.endswith(".toml"):
                 logg.log(DEBUG_TOML, "found toml configfile %s", configfile)
-                with open(configfile, "rb") as f:
-                    conf = tomllib.load(f)
-                    section1: Dict[str, Union[str, int, bool]] = {}
-                    if "tool" in conf and toolsection in conf["tool"]:
-                        section1 = conf["tool"][toolsection]
-                    else:
-                        logg.log(DEBUG_TOML, "have sections %s", list(section1.keys()))
-                    if section1:
-                        logg.log(DEBUG_TOML, "have section1 data:\n%s", section1)
-                        for setting in sorted(section1):
-                            if setting in defnames:
-                                destname = defnames[setting]
-                                oldvalue = defaults[setting]
-                                setvalue = section1[setting]
-                                assert destname is not None
-                                if isinstance(oldvalue, int):
-                                    if isinstance(setvalue, (int, float, bool)):
-                                        settings[destname] = int(setvalue)
-                                    else:
-                                        if setvalue not in str_to_int_0+str_to_int_1+str_to_int_2:
-                                            logg.error("%s[%s]: expecting int but found %s", configfile, setting, type(setvalue))
-                                        settings[destname] = to_int(setvalue)
+                section1 = cast(Dict[str, Union[str, int, bool]], config_section(configfile, toolsection) or {})
+                if section1:
+                    logg.log(DEBUG_TOML, "have section1 data:\n%s", section1)
+                    for setting in sorted(section1):
+                        if setting in defnames:
+                            destname = defnames[setting]
+                            oldvalue = defaults[setting]
+                            setvalue = section1[setting]
+                            assert destname is not None
+                            if isinstance(oldvalue, int):
+                                if isinstance(setvalue, (int, float, bool)):
+                                    settings[destname] = int(setvalue)
                                 else:
-                                    if not isinstance(oldvalue, str):
-                                        logg.warning("%s[%s]: expecting str but found %s", configfile, setting, type(setvalue))
-                                    settings[destname] = str(setvalue)
+                                    if setvalue not in str_to_int_0+str_to_int_1+str_to_int_2:
+                                        logg.error("%s[%s]: expecting int but found %s", configfile, setting, type(setvalue))
+                                    settings[destname] = to_int(setvalue)
                             else:
-                                logg.error("%s[%s]: unknown setting found", configfile, setting)
-                                logg.debug("%s: known options are %s", configfile, ", ".join(settings.keys()))
+                                if not isinstance(oldvalue, str):
+                                    logg.warning("%s[%s]: expecting str but found %s", configfile, setting, type(setvalue))
+                                if isinstance(setvalue, list): # include/exclude patterns
+                                    settings[destname] = ",".join(str(item) for item in setvalue)
+                                else:
+                                    settings[destname] = str(setvalue)
+                        else:
+                            logg.error("%s[%s]: unknown setting found", configfile, setting)
+                            logg.debug("%s: known options are %s", configfile, ", ".join(settings.keys()))
             elif configfile.endswith(".cfg"):
                 logg.log(DEBUG_TOML, "found ini configfile %s", configfile)
-                confs = configparser.ConfigParser()
-                confs.read(configfile)
-                if toolsection in confs:
-                    section2 = confs[toolsection]
+                section2 = cast(Optional[Dict[str, str]], config_section(configfile, toolsection))
+                if section2 is not None:
                     logg.log(DEBUG_TOML, "have section2 data:\n%s", section2)
-                    for option in sorted(section2):
+                    for setting in sorted(section2):
                         if OK:
-                            if option in defaults:
-                                destname = defnames[option]
-                                oldvalue = defaults[option]
-                                setvalue = section2[option]
+                            if setting in defaults:
+                                destname = defnames[setting]
+                                oldvalue = defaults[setting]
+                                setvalue = section2[setting]
                                 if isinstance(oldvalue, int):
                                     if setvalue.isdigit():
                                         settings[destname] = int(setvalue)
                                     else:
                                         if setvalue not in str_to_int_0+str_to_int_1+str_to_int_2:
-                                            logg.error("%s[%s]: expecting int but found %s", configfile, option, setvalue)
+                                            logg.error("%s[%s]: expecting int but found %s", configfile, setting, setvalue)
                                         settings[destname] = to_int(setvalue)
                                 else:
                                     if not isinstance(oldvalue, str):
                                         logg.warning("%s[%s]: expecting str but found %s", configfile, setting, type(setvalue))
                                     settings[destname] = str(setvalue)
                             else:
-                                logg.error("%s[%s]: unknown setting found", configfile, option)
+                                logg.error("%s[%s]: unknown setting found", configfile, setting)
                                 logg.debug("%s: known options are %s", configfile, ", ".join(settings.keys()))
             else:
                 logg.warning("unknown configfile type found = %s", configfile)
@@ -522,8 +862,253 @@ def text4(content: str) -> str:
 
 # ........................................................................................................
 
+# the fields that never hold a child node - the child fields of each node type are computed once.
+# The expression context (ast.Load/Store/Del) is not visited, so an ast.Name is a leaf.
+SCALAR_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "Constant": ("value", "kind"), "Name": ("id",), "Attribute": ("attr",), "arg": ("arg", "type_comment"),
+    "keyword": ("arg",), "alias": ("name", "asname"), "ImportFrom": ("module", "level"),
+    "FunctionDef": ("name", "type_comment"), "AsyncFunctionDef": ("name", "type_comment"), "ClassDef": ("name",),
+    "Assign": ("type_comment",), "For": ("type_comment",), "AsyncFor": ("type_comment",), "With": ("type_comment",),
+    "AsyncWith": ("type_comment",), "AnnAssign": ("simple",), "FormattedValue": ("conversion",),
+    "comprehension": ("is_async",), "Global": ("names",), "Nonlocal": ("names",), "Comment": ("value", "inline"),
+}
+node_fields_cache: Dict[type, Tuple[str, ...]] = {}
+
+def node_fields(nodetype: type) -> Tuple[str, ...]:
+    """ the _fields of a node type that may hold a child node or a list of them """
+    fields = node_fields_cache.get(nodetype)
+    if fields is None:
+        scalars = SCALAR_FIELDS.get(nodetype.__name__, ())
+        fields = tuple(field for field in getattr(nodetype, "_fields", ()) if field not in scalars and field != "ctx")
+        node_fields_cache[nodetype] = fields
+    return fields
+
+# the literals that may consist of constants only - a data table is not descended by the walks
+CONSTANT_LITERALS = frozenset([ast.List, ast.Tuple, ast.Set, ast.Dict, ast.UnaryOp])
+
+def constant_only(node: ast.AST) -> bool:
+    """ whether the node is a list/tuple/set/dict of constants (or of such literals). The result is
+        kept in the node and in each nested literal, so that the next walk can check it in O(1) """
+    if node.__class__ not in CONSTANT_LITERALS:
+        return node.__class__ is ast.Constant
+    known: Optional[bool] = getattr(node, "constant_only", None)
+    if known is not None:
+        return known
+    literals: List[ast.AST] = [] # the nested literals come after the literal containing them
+    parents: List[int] = []
+    other: List[bool] = [] # has a part that is not a constant
+    stack: List[Tuple[ast.AST, int]] = [(node, -1)]
+    while stack:
+        item, parent = stack.pop()
+        itemtype = item.__class__
+        if itemtype in CONSTANT_LITERALS and getattr(item, "constant_only", None) is None:
+            index = len(literals)
+            literals.append(item)
+            parents.append(parent)
+            other.append(False)
+            if itemtype is ast.Dict:
+                keys, values = cast(ast.Dict, item).keys, cast(ast.Dict, item).values
+                stack.extend([(elem, index) for elem in keys if elem.__class__ is not ast.Constant]) # type: ignore[misc] # None is {**other}
+                stack.extend([(elem, index) for elem in values if elem.__class__ is not ast.Constant])
+            elif itemtype is ast.UnaryOp:
+                operand = cast(ast.UnaryOp, item).operand
+                if operand.__class__ is not ast.Constant:
+                    stack.append((operand, index))
+            else:
+                elts = cast(Union[ast.List, ast.Tuple, ast.Set], item).elts
+                stack.extend([(elem, index) for elem in elts if elem.__class__ is not ast.Constant])
+        elif not getattr(item, "constant_only", False):
+            other[parent] = True
+    for index in range(len(literals) - 1, -1, -1):
+        if other[index] and parents[index] >= 0:
+            other[parents[index]] = True
+        literals[index].constant_only = not other[index] # type: ignore[attr-defined]
+    return not other[0]
+
+def walk_nodes(tree: ast.AST) -> Iterator[ast.AST]:
+    """ like ast.walk (in another order) over the node_fields() - without the expression contexts
+        and without the inside of constant_only() literals """
+    stack: List[ast.AST] = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.__class__ in CONSTANT_LITERALS and want.skip_constants and constant_only(node):
+            continue
+        for field in node_fields(node.__class__):
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, ast.AST))
+            elif isinstance(value, ast.AST):
+                stack.append(value)
+
+Walk = Generator[object, object, TypeResult] # yields the walks of the subtrees and is sent their results
+
+def run_walk(walk: Walk[TypeResult]) -> TypeResult:
+    """ run a walk without recursion - a walk is a generator that yields the walk of a subtree instead
+        of calling it. The walks are kept on an explicit stack and the result of the yielded walk
+        is sent back, so the depth of the tree is not limited by the python recursion limit. """
+    stack: List[Walk[object]] = [walk]
+    result: object = None
+    while True:
+        try:
+            subwalk = stack[-1].send(result)
+        except StopIteration as done:
+            stack.pop()
+            if not stack:
+                return cast(TypeResult, done.value)
+            result = done.value
+            continue
+        stack.append(cast(Walk[object], subwalk))
+        result = None
+
+class DispatchVisitor(ast.NodeVisitor):
+    """ ast.NodeVisitor with a dispatch table of node type to visit_ method for each class, instead
+        of building the method name and a getattr() for each node. The generic_visit() only looks
+        at the node_fields() of a node type, and it descends into the children by run_walk(). The
+        constant_only() literals are not descended when there is no visit_ method for their nodes. """
+    dispatch_table: Dict[type, Optional[Callable[["DispatchVisitor", ast.AST], object]]] = {}
+    skip_constants = True
+    def __init_subclass__(cls, **kwargs: object) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.dispatch_table = {}
+        cls.skip_constants = not any(cls.dispatch(nodetype) for nodetype in CONSTANT_LITERALS | {ast.Constant})
+    def descends(self, node: ast.AST) -> bool:
+        """ whether the walk needs to look at the children of a node without a visit_ method """
+        nodetype = node.__class__
+        if nodetype in CONSTANT_LITERALS and self.skip_constants and want.skip_constants:
+            return not constant_only(node)
+        return bool(node_fields(nodetype))
+    @classmethod
+    def dispatch(cls, nodetype: type) -> Optional[Callable[["DispatchVisitor", ast.AST], object]]:
+        """ the visit_ function for the node type (or None for generic_visit) """
+        method = getattr(cls, "visit_" + nodetype.__name__, None)
+        if method is getattr(ast.NodeVisitor, "visit_Constant", NIX):
+            method = None # only the deprecation helper for ast.Num and ast.Str
+        cls.dispatch_table[nodetype] = method
+        return method
+    def visit(self, node: ast.AST) -> object:
+        nodetype = node.__class__
+        try:
+            method = self.dispatch_table[nodetype]
+        except KeyError:
+            method = self.dispatch(nodetype)
+        if method is None:
+            return self.generic_visit(node)
+        return method(self, node)
+    def generic_visit(self, node: ast.AST) -> object:
+        return run_walk(self.generic_walk(node))
+    def generic_walk(self, node: ast.AST) -> Walk[Optional[ast.AST]]:
+        for field in node_fields(node.__class__):
+            value = getattr(node, field, None)
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, ast.AST):
+                    try:
+                        method = self.dispatch_table[item.__class__]
+                    except KeyError:
+                        method = self.dispatch(item.__class__)
+                    if method is not None:
+                        method(self, item)
+                    elif self.descends(item):
+                        yield self.generic_walk(item)
+        return None
+
+class DispatchTransformer(DispatchVisitor, ast.NodeTransformer):
+    """ ast.NodeTransformer with the dispatch table of a DispatchVisitor. When a visit_ method in the
+        walk calls generic_visit() on the node that it returns then the children are descended by the
+        walk after the method has returned (as in a FusedTransformer), any other generic_visit() of
+        the method is run when it has returned. So the tree depth is not limited by recursion. """
+    deferred: Optional[List[ast.AST]] = None
+    def visit(self, node: TypeAST) -> TypeAST:
+        return cast(TypeAST, DispatchVisitor.visit(self, node)) # the walk of a tree returns the tree
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        if self.deferred is not None:
+            self.deferred.append(node)
+            return node
+        return run_walk(self.generic_walk(node))
+    def call_handler(self, method: Callable[["DispatchVisitor", ast.AST], object], node: ast.AST) -> Tuple[object, List[ast.AST]]:
+        """ the result of the visit_ method and the returned nodes to be descended by the walk """
+        self.deferred = []
+        try:
+            result = method(self, node)
+        finally:
+            deferred, self.deferred = self.deferred, None
+        if not deferred:
+            return result, deferred
+        returned = result if isinstance(result, list) else [result]
+        descend: List[ast.AST] = []
+        for item in deferred:
+            if any(item is elem for elem in returned):
+                descend.append(item)
+            else:
+                run_walk(self.generic_walk(item))
+        return result, descend
+    def generic_walk(self, node: ast.AST) -> Walk[ast.AST]:
+        """ same as ast.NodeTransformer.generic_visit - a child without a visit_ method stays the same node """
+        for field in node_fields(node.__class__):
+            old_value = getattr(node, field, None)
+            if isinstance(old_value, list):
+                new_values: List[object] = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        try:
+                            method = self.dispatch_table[value.__class__]
+                        except KeyError:
+                            method = self.dispatch(value.__class__)
+                        if method is None:
+                            if self.descends(value):
+                                yield self.generic_walk(value)
+                        else:
+                            value, descend = self.call_handler(method, value)
+                            for item in descend:
+                                yield self.generic_walk(item)
+                            if value is None:
+                                continue
+                            elif not isinstance(value, ast.AST):
+                                new_values.extend(cast(Iterable[object], value))
+                                continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, ast.AST):
+                try:
+                    method = self.dispatch_table[old_value.__class__]
+                except KeyError:
+                    method = self.dispatch(old_value.__class__)
+                if method is None:
+                    if self.descends(old_value):
+                        yield self.generic_walk(old_value)
+                    continue
+                new_node, descend = self.call_handler(method, old_value)
+                for item in descend:
+                    yield self.generic_walk(item)
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+        return node
+
+block_fields_cache: Dict[type, Tuple[str, ...]] = {}
+
+def block_fields(nodetype: type) -> Tuple[str, ...]:
+    """ the statement list fields of a node type (body, handlers, orelse, finalbody) """
+    fields = block_fields_cache.get(nodetype)
+    if fields is None:
+        nodefields = getattr(nodetype, "_fields", ())
+        fields = tuple(part for part in ["body", "handlers", "orelse", "finalbody"] if part in nodefields)
+        block_fields_cache[nodetype] = fields
+    return fields
+
 class BlockTransformer:
     """ only runs visitor on body-elements, storing the latest block head in an attribute """
+    dispatch_table: Dict[type, Callable[["BlockTransformer", ast.stmt, Deque[ast.AST]], Iterable[ast.stmt]]] = {}
+    def __init_subclass__(cls, **kwargs: object) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.dispatch_table = {}
+    @classmethod
+    def dispatch2(cls, nodetype: type) -> Callable[["BlockTransformer", ast.stmt, Deque[ast.AST]], Iterable[ast.stmt]]:
+        """ the visit2_ function for the statement type (or generic_visit2) """
+        method: Callable[["BlockTransformer", ast.stmt, Deque[ast.AST]], Iterable[ast.stmt]] = getattr(cls, "visit2_" + nodetype.__name__, cls.generic_visit2)
+        cls.dispatch_table[nodetype] = method
+        return method
     def visit(self, node: TypeAST) -> TypeAST:
         """Visit a node."""
         nodes = self.generic_visit2(node, deque())
@@ -538,16 +1123,18 @@ class BlockTransformer:
     def done_body(self, body: List[ast.stmt], block: Deque[ast.AST], part: str = NIX) -> List[ast.stmt]: # pylint: disable=unused-argument
         return body
     def generic_visit2(self, node: TypeAST, block: Deque[ast.AST]) -> Iterable[TypeAST]:
-        stmtlist_attributes = ["body", "handlers", "orelse", "finalbody"]
-        for part in stmtlist_attributes:
+        for part in block_fields(node.__class__):
             if hasattr(node, part):
                 stmtlist: List[ast.stmt] = cast(List[ast.stmt], getattr(node, part))
                 body: List[ast.stmt] = []
                 block.appendleft(node)
                 for stmt in self.next_body(stmtlist, block, part):
-                    method = 'visit2_' + stmt.__class__.__name__
-                    visitor = getattr(self, method, self.generic_visit2)
-                    result = visitor(stmt, block)
+                    nodetype = stmt.__class__
+                    try:
+                        visitor = self.dispatch_table[nodetype]
+                    except KeyError:
+                        visitor = self.dispatch2(nodetype)
+                    result = visitor(self, stmt, block)
                     for elem in result:
                         body.append(copy_location(elem, stmt))
                 setattr(node, part, self.done_body(body, block, part))
@@ -556,10 +1143,11 @@ class BlockTransformer:
         return [node]
 
 class WalrusTransformer(BlockTransformer):
+    triggers = ("NamedExpr",)
     def visit2_If(self, node: ast.If, block: Deque[ast.AST]) -> Iterable[ast.stmt]:  # pylint: disable=invalid-name,unused-argument
         if isinstance(node.test, ast.NamedExpr):
             test: ast.NamedExpr = node.test
-            logg.log(DEBUG_TYPING, "ifwalrus-test: %s", ast.dump(test))
+            logg.log(DEBUG_TYPING, "ifwalrus-test: %s", LazyDump(test))
             assign = ast.Assign([test.target], test.value)
             assign = copy_location(assign, node)
             newtest = ast.Name(test.target.id)
@@ -570,7 +1158,7 @@ class WalrusTransformer(BlockTransformer):
             test2: Union[ast.Compare, ast.BinOp] = node.test
             if isinstance(test2.left, ast.NamedExpr):
                 test = test2.left
-                logg.log(DEBUG_TYPING, "ifwalrus-left: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "ifwalrus-left: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -579,7 +1167,7 @@ class WalrusTransformer(BlockTransformer):
                 return [assign, node]
             elif isinstance(test2, ast.BinOp) and isinstance(test2.right, ast.NamedExpr):
                 test = test2.right
-                logg.log(DEBUG_TYPING, "ifwalrus-right: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "ifwalrus-right: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -588,7 +1176,7 @@ class WalrusTransformer(BlockTransformer):
                 return [assign, node]
             elif isinstance(test2, ast.Compare) and isinstance(test2.comparators[0], ast.NamedExpr):
                 test = test2.comparators[0]
-                logg.log(DEBUG_TYPING, "ifwalrus-compared: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "ifwalrus-compared: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -596,17 +1184,18 @@ class WalrusTransformer(BlockTransformer):
                 test2.comparators[0] = newtest
                 return [assign, node]
             else:
-                logg.log(DEBUG_TYPING, "ifwalrus?: %s", ast.dump(test2))
+                logg.log(DEBUG_TYPING, "ifwalrus?: %s", LazyDump(test2))
                 return [node]
         else:
-            logg.log(DEBUG_TYPING, "ifwalrus-if?: %s", ast.dump(node))
+            logg.log(DEBUG_TYPING, "ifwalrus-if?: %s", LazyDump(node))
             return [node]
 
 class WhileWalrusTransformer(BlockTransformer):
+    triggers = ("NamedExpr",)
     def visit2_While(self, node: ast.If, block: Deque[ast.AST]) -> Iterable[ast.stmt]:  # pylint: disable=invalid-name,unused-argument
         if isinstance(node.test, ast.NamedExpr):
             test: ast.NamedExpr = node.test
-            logg.log(DEBUG_TYPING, "whwalrus-test: %s", ast.dump(test))
+            logg.log(DEBUG_TYPING, "whwalrus-test: %s", LazyDump(test))
             assign = ast.Assign([test.target], test.value)
             assign = copy_location(assign, node)
             newtest = ast.Name(test.target.id)
@@ -626,7 +1215,7 @@ class WhileWalrusTransformer(BlockTransformer):
             test2: Union[ast.Compare, ast.BinOp] = node.test
             if isinstance(test2.left, ast.NamedExpr):
                 test = test2.left
-                logg.log(DEBUG_TYPING, "whwalrus-left: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "whwalrus-left: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -645,7 +1234,7 @@ class WhileWalrusTransformer(BlockTransformer):
                 return [node]
             elif isinstance(test2, ast.BinOp) and isinstance(test2.right, ast.NamedExpr):
                 test = test2.right
-                logg.log(DEBUG_TYPING, "whwalrus-right: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "whwalrus-right: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -664,7 +1253,7 @@ class WhileWalrusTransformer(BlockTransformer):
                 return [node]
             elif isinstance(test2, ast.Compare) and isinstance(test2.comparators[0], ast.NamedExpr):
                 test = test2.comparators[0]
-                logg.log(DEBUG_TYPING, "whwalrus-compared: %s", ast.dump(test))
+                logg.log(DEBUG_TYPING, "whwalrus-compared: %s", LazyDump(test))
                 assign = ast.Assign([test.target], test.value)
                 assign = copy_location(assign, node)
                 newtest = ast.Name(test.target.id)
@@ -682,18 +1271,18 @@ class WhileWalrusTransformer(BlockTransformer):
                 node.body = [assign, newif]
                 return [node]
             else:
-                logg.log(DEBUG_TYPING, "whwalrus?: %s", ast.dump(test2))
+                logg.log(DEBUG_TYPING, "whwalrus?: %s", LazyDump(test2))
                 return [node]
         else:
-            logg.log(DEBUG_TYPING, "whwalrus-if?: %s", ast.dump(node))
+            logg.log(DEBUG_TYPING, "whwalrus-if?: %s", LazyDump(node))
             return [node]
 
-class DetectImportsTransformer(ast.NodeTransformer):
+class DetectImportsTransformer(DispatchTransformer):
     importfrom: Dict[str, Dict[str, str]]
     imported: Dict[str, str]
     importas: Dict[str, str]
     def __init__(self) -> None:
-        ast.NodeTransformer.__init__(self)
+        DispatchTransformer.__init__(self)
         self.importfrom = {}
         self.imported = {}
         self.importas = {}
@@ -720,13 +1309,86 @@ class DetectImportsTransformer(ast.NodeTransformer):
                     self.importfrom[modulename][symbol.name] = codename
         return self.generic_visit(node)
 
+IMPORT_INDEX_BLOCKS: Tuple[type, ...] = (ast.stmt, ast.excepthandler, Comment) + ((ast.match_case,) if sys.version_info >= (3,10) else ())
+
+class ImportIndex:
+    """ same mappings as DetectImportsTransformer but only the statements are walked, and the
+        Require* transformers keep it up to date on the imports that they add or remove """
+    importfrom: Dict[str, Dict[str, str]]
+    imported: Dict[str, str]
+    importas: Dict[str, str]
+    def __init__(self, tree: Optional[ast.AST] = None) -> None:
+        self.importfrom = {}
+        self.imported = {}
+        self.importas = {}
+        self.countfrom: Dict[Tuple[str, str], int] = {}
+        self.counted: Dict[str, int] = {}
+        if tree is not None:
+            self.scan(tree)
+    def scan(self, tree: ast.AST) -> None:
+        todo: List[ast.AST] = [tree]
+        while todo:
+            node = todo.pop()
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                self.add(node)
+                continue
+            children: List[ast.AST] = []
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if isinstance(value, list) and value and isinstance(value[0], IMPORT_INDEX_BLOCKS):
+                    children += value
+            todo += reversed(children)
+    def add(self, node: Union[ast.Import, ast.ImportFrom]) -> None:
+        if isinstance(node, ast.Import):
+            for symbol in node.names:
+                origname = symbol.name
+                codename = symbol.name if not symbol.asname else symbol.asname
+                self.imported[origname] = codename
+                self.importas[codename] = origname
+                self.counted[origname] = self.counted.get(origname, 0) + 1
+        elif node.module:
+            modulename = ("." * node.level) + node.module
+            if modulename not in self.importfrom:
+                self.importfrom[modulename] = {}
+            for symbol in node.names:
+                origname = modulename + "." + symbol.name
+                codename = symbol.name if not symbol.asname else symbol.asname
+                self.imported[origname] = codename
+                self.importas[codename] = origname
+                if symbol.name not in self.importfrom[modulename]:
+                    self.importfrom[modulename][symbol.name] = codename
+                self.counted[origname] = self.counted.get(origname, 0) + 1
+                self.countfrom[(modulename, symbol.name)] = self.countfrom.get((modulename, symbol.name), 0) + 1
+    def remove(self, node: ast.ImportFrom, symbols: Iterable[ast.alias]) -> None:
+        """ the symbols were removed from the import statement (the whole statement if all of them) """
+        if not node.module:
+            return
+        modulename = ("." * node.level) + node.module
+        for symbol in symbols:
+            origname = modulename + "." + symbol.name
+            codename = symbol.name if not symbol.asname else symbol.asname
+            self.countfrom[(modulename, symbol.name)] -= 1
+            if not self.countfrom[(modulename, symbol.name)]:
+                del self.countfrom[(modulename, symbol.name)]
+                del self.importfrom[modulename][symbol.name]
+                if not self.importfrom[modulename]:
+                    del self.importfrom[modulename]
+            self.counted[origname] -= 1
+            if not self.counted[origname]:
+                del self.counted[origname]
+                del self.imported[origname]
+                if self.importas.get(codename) == origname:
+                    del self.importas[codename]
+
 class RequireImportFrom:
     require: Dict[str, Optional[str]]
     removes: Dict[str, Optional[str]]
+    imports: Optional[ImportIndex]
     def __init__(self, require: Iterable[str] = ()) -> None:
         self.require = {}
         self.append(require)
         self.removes = {}
+        self.imports = None # shared index, or walk the tree
     def removefrom(self, module: str, *symbols: str) -> None:
         for symbol in symbols:
             self.removes[F"{module}.{symbol}"] = None
@@ -747,8 +1409,7 @@ class RequireImportFrom:
             return node
         logg.debug("-- import require: %s", self.require)
         logg.debug("-- import removes: %s", self.removes)
-        imports = DetectImportsTransformer()
-        imports.visit(node)
+        imports = self.imports if self.imports is not None else ImportIndex(node)
         newimport: List[str] = []
         anyremove: List[str] = []
         for require in self.require:
@@ -795,6 +1456,7 @@ class RequireImportFrom:
                     importing = cast(ast.ImportFrom, stmt)  # type: ignore[redundant-cast]
                     if importing.module in rems:
                         symbols = [alias for alias in importing.names if alias.name not in rems[importing.module]]
+                        imports.remove(importing, [alias for alias in importing.names if alias.name in rems[importing.module]])
                         if symbols:
                             importing.names = symbols
                         else:
@@ -808,6 +1470,7 @@ class RequireImportFrom:
                 else:
                     for mod, funcs in mods.items():
                         body.append(ast.ImportFrom(mod, [ast.alias(name=func) for func in sorted(funcs)], 0))
+                        imports.add(cast(ast.ImportFrom, body[-1]))
                     if not drop:
                         body.append(stmt)
                     done = True
@@ -823,6 +1486,7 @@ class RequireImportFrom:
                 else:
                     for mod, funcs in mods.items():
                         body.append(ast.ImportFrom(mod, [ast.alias(name=func) for func in sorted(funcs)], 0))
+                        imports.add(cast(ast.ImportFrom, body[-1]))
                     body.append(stmt)
                     done = True
         if not done:
@@ -833,9 +1497,11 @@ class RequireImportFrom:
 
 class RequireImport:
     require: Dict[str, Optional[str]]
+    imports: Optional[ImportIndex]
     def __init__(self, require: Iterable[str] = ()) -> None:
         self.require = {}
         self.append(require)
+        self.imports = None # shared index, or walk the tree
     def add(self, *require: Union[str, Tuple[str, Optional[str]]]) -> None:
         for req in require:
             if isinstance(req, str):
@@ -848,8 +1514,7 @@ class RequireImport:
     def visit(self, node: ast.AST) -> ast.AST:
         if not self.require:
             return node
-        imports = DetectImportsTransformer()
-        imports.visit(node)
+        imports = self.imports if self.imports is not None else ImportIndex(node)
         newimport: Dict[str, Optional[str]] = {}
         for require, asname in self.require.items():
             if require not in imports.imported:
@@ -861,6 +1526,7 @@ class RequireImport:
             return node
         module = cast(ast.Module, node)  # type: ignore[redundant-cast]
         body: List[ast.stmt] = []
+        added: List[Union[ast.Import, ast.ImportFrom]] = []
         done = False
         simple: Dict[str, Optional[str]] = {}
         dotted: Dict[str, Optional[str]] = {}
@@ -883,14 +1549,15 @@ class RequireImport:
                     body.append(stmt)
                 else:
                     if simple:
-                        body.append(ast.Import([ast.alias(mod, simple[mod] if simple[mod] != mod else None) for mod in sorted(simple)]))
+                        added.append(ast.Import([ast.alias(mod, simple[mod] if simple[mod] != mod else None) for mod in sorted(simple)]))
                     for mod in sorted(dotted):
                         alias = dotted[mod]
                         if alias and "." in mod:
                             libname, sym = mod.rsplit(".", 1)
-                            body.append(ast.ImportFrom(libname, [ast.alias(sym, alias if alias != sym else None)], 0))
+                            added.append(ast.ImportFrom(libname, [ast.alias(sym, alias if alias != sym else None)], 0))
                         else:
-                            body.append(ast.Import([ast.alias(mod, alias)]))
+                            added.append(ast.Import([ast.alias(mod, alias)]))
+                    body += added
                     body.append(stmt)
                     done = True
         if not done:
@@ -904,26 +1571,30 @@ class RequireImport:
                     body.append(stmt)
                 else:
                     if simple:
-                        body.append(ast.Import([ast.alias(mod, simple[mod] if simple[mod] != mod else None) for mod in sorted(simple)]))
+                        added.append(ast.Import([ast.alias(mod, simple[mod] if simple[mod] != mod else None) for mod in sorted(simple)]))
                     for mod in sorted(dotted):
                         alias = dotted[mod]
                         if alias and "." in mod:
                             libname, sym = mod.rsplit(".", 1)
-                            body.append(ast.ImportFrom(libname, [ast.alias(sym, alias if alias != sym else None)], 0))
+                            added.append(ast.ImportFrom(libname, [ast.alias(sym, alias if alias != sym else None)], 0))
                         else:
-                            body.append(ast.Import([ast.alias(mod, alias)]))
+                            added.append(ast.Import([ast.alias(mod, alias)]))
+                    body += added
                     body.append(stmt)
                     done = True
         if not done:
             logg.error("did not add imports %s %s", simple, dotted)
         else:
             module.body = body
+            for addedimport in added:
+                imports.add(addedimport)
         return module
 
 
-class ReplaceIsinstanceBaseType(ast.NodeTransformer):
+class ReplaceIsinstanceBaseType(DispatchTransformer):
+    triggers = ("isinstance",)
     def __init__(self, replace: Optional[Dict[str, str]] = None) -> None:
-        ast.NodeTransformer.__init__(self)
+        DispatchTransformer.__init__(self)
         self.replace = replace if replace is not None else { "str": "basestring"}
         self.defines: List[str] = []
     def visit_Call(self, node: ast.Call) -> Optional[ast.AST]:  # pylint: disable=invalid-name
@@ -982,7 +1653,7 @@ class DetectImportedFunctionCalls(DetectImportsTransformer):
                     self.calls[callname] = funcname
                     if funcname in self.replace:
                         return ast.Call(func=ast.Name(self.replace[funcname]), args=calls.args, keywords=calls.keywords)
-                else:
+                elif logg.isEnabledFor(logging.DEBUG):
                     logg.debug("skips call2: %s.%s", module2, call2.attr)
                     logg.debug("have imports: %s", ", ".join(self.importas.keys()))
             elif isinstance(call2.value, ast.Attribute):
@@ -998,7 +1669,7 @@ class DetectImportedFunctionCalls(DetectImportsTransformer):
                         self.calls[callname] = funcname
                         if funcname in self.replace:
                             return ast.Call(func=ast.Name(self.replace[funcname]), args=calls.args, keywords=calls.keywords)
-                    else:
+                    elif logg.isEnabledFor(logging.DEBUG):
                         logg.debug("skips call3: %s.%s", module3, call2.attr)
                         logg.debug("have imports: %s", ", ".join(self.importas.keys()))
                 elif isinstance(call3.value, ast.Attribute):
@@ -1023,12 +1694,12 @@ class DefineIfPython2:
         self.body = []
         self.orelse = []
         if or_else:
-            for elselist in [cast(ast.Module, ast_parse(part)).body for part in or_else]: # type: ignore[redundant-cast]
+            for elselist in [boilerplate.body(part) for part in or_else]:
                 self.orelse += elselist
         if orelse:
             for stmt in orelse:
                 self.orelse.append(stmt)
-        for stmtlist in [cast(ast.Module, ast_parse(e)).body for e in expr]: # type: ignore[redundant-cast]
+        for stmtlist in [boilerplate.body(e) for e in expr]:
             self.body += stmtlist
         if body:
             for stmt in body:
@@ -1055,23 +1726,12 @@ class DefineIfPython2:
                     body.append(stmt)
                 else:
                     testcode = "sys.version_info < (3, 0)"
-                    testparsed: ast.Module = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                    assert isinstance(testparsed.body[0], ast.Expr)
-                    testbody: ast.Expr = testparsed.body[0]
-                    assert isinstance(testbody.value, ast.Compare)
-                    testcompare: ast.expr = testbody.value
                     if self.before:
                         testcode = "sys.version_info < ({}, {})".format(self.before[0], self.before[1])
-                        testparsed = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                        assert isinstance(testparsed.body[0], ast.Expr)
-                        testbody = testparsed.body[0]
-                        testcompare = testbody.value
+                    testcompare: ast.expr = boilerplate.expr(testcode)
                     if self.atleast:
                         testcode = "sys.version_info >= ({}, {})".format(self.atleast[0], self.atleast[1])
-                        testparsed = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                        assert isinstance(testparsed.body[0], ast.Expr)
-                        testbody = testparsed.body[0]
-                        testatleast = testbody.value
+                        testatleast = boilerplate.expr(testcode)
                         testcompare = ast.BoolOp(op=ast.Or(), values=[testcompare, testatleast])
                     before = self.before if self.before else (3,0)
                     logg.log(HINT, "python2 atleast %s before %s", self.atleast, before)
@@ -1098,12 +1758,12 @@ class DefineIfPython3:
         self.body = []
         self.orelse = []
         if or_else:
-            for elselist in [cast(ast.Module, ast_parse(part)).body for part in or_else]: # type: ignore[redundant-cast]
+            for elselist in [boilerplate.body(part) for part in or_else]:
                 self.orelse += elselist
         if orelse:
             for stmt in orelse:
                 self.orelse.append(stmt)
-        for stmtlist in [cast(ast.Module, ast_parse(e)).body for e in expr]: # type: ignore[redundant-cast]
+        for stmtlist in [boilerplate.body(e) for e in expr]:
             self.body += stmtlist
         if body:
             for stmt in body:
@@ -1130,23 +1790,12 @@ class DefineIfPython3:
                     body.append(stmt)
                 else:
                     testcode = "sys.version_info >= (3, 0)"
-                    testparsed: ast.Module = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                    assert isinstance(testparsed.body[0], ast.Expr)
-                    testbody: ast.Expr = testparsed.body[0]
-                    assert isinstance(testbody.value, ast.Compare)
-                    testcompare: ast.expr = testbody.value
                     if self.atleast:
                         testcode = "sys.version_info >= ({}, {})".format(self.atleast[0], self.atleast[1])
-                        testparsed = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                        assert isinstance(testparsed.body[0], ast.Expr)
-                        testbody = testparsed.body[0]
-                        testcompare = testbody.value
+                    testcompare: ast.expr = boilerplate.expr(testcode)
                     if self.before:
                         testcode = "sys.version_info < ({}, {})".format(self.before[0], self.before[1])
-                        testparsed = cast(ast.Module, ast_parse(testcode)) # type: ignore[redundant-cast]
-                        assert isinstance(testparsed.body[0], ast.Expr)
-                        testbody = testparsed.body[0]
-                        testbefore = testbody.value
+                        testbefore = boilerplate.expr(testcode)
                         testcompare = ast.BoolOp(op=ast.And(), values=[testcompare, testbefore])
                     atleast = self.atleast if self.atleast else (3,0)
                     logg.log(HINT, "python3 atleast %s before %s", atleast, self.before)
@@ -1161,8 +1810,247 @@ class DefineIfPython3:
         else:
             return node
 
+class FusedTransformer(DispatchTransformer):
+    """ runs a number of DispatchTransformers in one walk over the tree - each node is handed to the
+        transformers in the order of registration and a transformer that calls generic_visit()
+        on its result will descend into the children along with the fused walk. Any other
+        generic_visit() in a handler is run as a walk of its own when the handler has returned. """
+    transformers: List[DispatchTransformer]
+    def __init__(self, transformers: Iterable[DispatchTransformer] = ()) -> None:
+        DispatchTransformer.__init__(self)
+        self.transformers = list(transformers)
+    def append(self, transformer: DispatchTransformer) -> None:
+        self.transformers.append(transformer)
+    def visit(self, node: TypeAST) -> TypeAST:
+        tree: ast.AST = node
+        if self.transformers:
+            logg.debug("fused walk of %s", " ".join(transformer.__class__.__name__ for transformer in self.transformers))
+            result = self.fused_visit(tree, self.transformers, [])
+            if isinstance(result, GeneratorType):
+                result = run_walk(result)
+            if isinstance(result, ast.AST):
+                tree = result
+            else: # pragma: nocover
+                logg.error("fused walk did not return a single node: %s", type(result))
+        return cast(TypeAST, tree)
+    def fused_visit(self, node: ast.AST, transformers: List[DispatchTransformer], descending: List[DispatchTransformer]) -> object:
+        """ the handlers of the transformers for the node - when the result needs to be descended
+            into then the walk for run_walk() is returned (its result is the result of the handlers) """
+        descending = list(descending)
+        for num, transformer in enumerate(transformers):
+            try:
+                method = transformer.dispatch_table[node.__class__]
+            except KeyError:
+                method = transformer.dispatch(node.__class__)
+            if method is None:
+                descending.append(transformer) # generic_visit
+                continue
+            result, recursing = transformer.call_handler(method, node)
+            if result is None:
+                return None
+            if isinstance(result, list):
+                return self.fused_results(result, transformers[num+1:], descending, transformer, recursing)
+            if recursing:
+                descending.append(transformer)
+            node = cast(ast.AST, result)
+        if descending and node_fields(node.__class__):
+            if node.__class__ in CONSTANT_LITERALS and want.skip_constants and constant_only(node):
+                if all(transformer.skip_constants for transformer in descending):
+                    return node
+            return self.fused_generic_visit(node, descending)
+        return node
+    def fused_results(self, result: List[ast.AST], transformers: List[DispatchTransformer], descending: List[DispatchTransformer],
+                      transformer: DispatchTransformer, recursing: List[ast.AST]) -> Walk[List[ast.AST]]:
+        """ the rest of the transformers for each node of a list result """
+        results: List[ast.AST] = []
+        for item in result:
+            descend = descending + [transformer] if any(item is elem for elem in recursing) else descending
+            done = self.fused_visit(item, transformers, descend)
+            if isinstance(done, GeneratorType):
+                done = yield done
+            if isinstance(done, list):
+                results.extend(done)
+            elif done is not None:
+                results.append(cast(ast.AST, done))
+        return results
+    def fused_generic_visit(self, node: ast.AST, transformers: List[DispatchTransformer]) -> Walk[ast.AST]:
+        """ same as DispatchTransformer.generic_walk """
+        for field in node_fields(node.__class__):
+            old_value = getattr(node, field, None)
+            if isinstance(old_value, list):
+                new_values: List[object] = []
+                for value in old_value:
+                    if isinstance(value, ast.AST):
+                        value = self.fused_visit(value, transformers, [])
+                        if isinstance(value, GeneratorType):
+                            value = yield value
+                        if value is None:
+                            continue
+                        elif not isinstance(value, ast.AST):
+                            new_values.extend(cast(Iterable[object], value))
+                            continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, ast.AST):
+                new_node = self.fused_visit(old_value, transformers, [])
+                if isinstance(new_node, GeneratorType):
+                    new_node = yield new_node
+                if new_node is None:
+                    delattr(node, field)
+                else:
+                    setattr(node, field, new_node)
+        return node
+
+class SyntaxCensus:
+    """ one walk over the tree recording the node types and the identifiers (names, attributes,
+        imported aliases) that are present. A transformer may declare `triggers` - the node types
+        or names it can rewrite - and a pass is skipped when none of them are in the tree. The
+        `produces` of a transformer that does run are added, so that later passes see them. """
+    nodes: Set[str]
+    names: Set[str]
+    def __init__(self, tree: Optional[ast.AST] = None) -> None:
+        self.nodes = set()
+        self.names = set()
+        if tree is not None:
+            self.scan(tree)
+    def scan(self, tree: ast.AST) -> None:
+        nodes, names = self.nodes, self.names
+        for node in walk_nodes(tree):
+            nodetype = node.__class__
+            nodes.add(nodetype.__name__)
+            if nodetype is ast.Name:
+                names.add(cast(ast.Name, node).id)
+            elif nodetype is ast.Attribute:
+                names.add(cast(ast.Attribute, node).attr)
+            elif nodetype is ast.alias:
+                names.add(cast(ast.alias, node).name.rsplit(".", 1)[-1])
+            elif nodetype is ast.arguments:
+                funcargs = cast(ast.arguments, node)
+                if funcargs.posonlyargs:
+                    nodes.add("posonlyargs")
+                if funcargs.kwonlyargs:
+                    nodes.add("kwonlyargs")
+    def present(self, *triggers: str) -> bool:
+        return any(trigger in self.nodes or trigger in self.names for trigger in triggers)
+    def fires(self, transformer: object) -> bool:
+        """ whether the transformer can change anything - no triggers means that it always runs """
+        triggers: Tuple[str, ...] = getattr(transformer, "triggers", ())
+        if triggers and want.syntax_census and not self.present(*triggers):
+            logg.debug("no %s - skipping %s", "/".join(triggers), transformer.__class__.__name__)
+            return False
+        self.nodes.update(getattr(transformer, "produces", ()))
+        return True
+
+def source_text(node: ast.AST) -> str:
+    if isinstance(node, ast.Name):
+        return node.id # the most common typehint
+    return ast.unparse(node)
+
+def source_expr(text: str) -> ast.expr:
+    if text.isidentifier():
+        return ast.Name(text)
+    return ast.parse(text, mode="eval").body
+
+class PyiArg:
+    """ a parameter of a PyiDef - with the annotation and the default as source text """
+    __slots__ = ("name", "annotation", "default")
+    def __init__(self, arg: ast.arg, default: Optional[ast.expr] = None) -> None:
+        self.name = arg.arg
+        self.annotation = source_text(arg.annotation) if arg.annotation is not None else None
+        self.default = source_text(default) if default is not None else None
+    def render(self) -> ast.arg:
+        return ast.arg(self.name, source_expr(self.annotation) if self.annotation is not None else None)
+
+class PyiDef:
+    """ a compact record of the outer interface (an import, a var, a def or a class) to render the pyi from.
+        All expressions are held as source text, so it does not share any node with the transformed tree. """
+    __slots__ = ("kind", "name", "lineno", "end_lineno", "annotation", "simple", "names", "level",
+                 "posonlyargs", "args", "vararg", "kwonlyargs", "kwarg", "returns", "decorators", "bases", "keywords", "body")
+    def __init__(self, kind: str, name: str, node: Optional[ast.AST] = None) -> None:
+        self.kind = kind
+        self.name = name
+        self.lineno: Optional[int] = getattr(node, "lineno", None)
+        self.end_lineno: Optional[int] = getattr(node, "end_lineno", None)
+        self.annotation: Optional[str] = None
+        self.simple = 1
+        self.names: Tuple[Tuple[str, Optional[str]], ...] = ()
+        self.level = 0
+        self.posonlyargs: Tuple[PyiArg, ...] = ()
+        self.args: Tuple[PyiArg, ...] = ()
+        self.vararg: Optional[PyiArg] = None
+        self.kwonlyargs: Tuple[PyiArg, ...] = ()
+        self.kwarg: Optional[PyiArg] = None
+        self.returns: Optional[str] = None
+        self.decorators: Tuple[str, ...] = ()
+        self.bases: Tuple[str, ...] = ()
+        self.keywords: Tuple[Tuple[Optional[str], str], ...] = ()
+        self.body: Tuple[PyiDef, ...] = ()
+    @staticmethod
+    def importfrom(node: ast.ImportFrom) -> "PyiDef":
+        record = PyiDef("import", node.module or NIX, node)
+        record.names = tuple((alias.name, alias.asname) for alias in node.names)
+        record.level = node.level or 0
+        return record
+    @staticmethod
+    def var(node: ast.AnnAssign) -> "PyiDef":
+        record = PyiDef("var", source_text(node.target), node)
+        record.annotation = source_text(node.annotation)
+        record.simple = node.simple
+        return record
+    @staticmethod
+    def function(node: ast.FunctionDef) -> "PyiDef":
+        record = PyiDef("def", node.name, node)
+        funcargs = node.args
+        positional = funcargs.posonlyargs + funcargs.args
+        defaults: List[Optional[ast.expr]] = [None] * (len(positional) - len(funcargs.defaults)) + list(funcargs.defaults)
+        arglist = [PyiArg(arg, default) for arg, default in zip(positional, defaults)]
+        record.posonlyargs = tuple(arglist[:len(funcargs.posonlyargs)])
+        record.args = tuple(arglist[len(funcargs.posonlyargs):])
+        record.vararg = PyiArg(funcargs.vararg) if funcargs.vararg is not None else None
+        record.kwonlyargs = tuple(PyiArg(arg, default) for arg, default in zip(funcargs.kwonlyargs, funcargs.kw_defaults))
+        record.kwarg = PyiArg(funcargs.kwarg) if funcargs.kwarg is not None else None
+        record.returns = source_text(node.returns) if node.returns is not None else None
+        record.decorators = tuple(source_text(decorator) for decorator in node.decorator_list)
+        return record
+    @staticmethod
+    def classdef(node: ast.ClassDef, body: Iterable["PyiDef"]) -> "PyiDef":
+        record = PyiDef("class", node.name, node)
+        record.bases = tuple(source_text(base) for base in node.bases)
+        record.keywords = tuple((keyword.arg, source_text(keyword.value)) for keyword in node.keywords)
+        record.decorators = tuple(source_text(decorator) for decorator in node.decorator_list)
+        record.body = tuple(body)
+        return record
+    def render(self) -> ast.stmt:
+        """ a fresh pyi statement - with a pass as the body of a def """
+        stmt: ast.stmt
+        if self.kind == "import":
+            stmt = ast.ImportFrom(self.name or None, [ast.alias(name, asname) for name, asname in self.names], self.level)
+        elif self.kind == "var":
+            stmt = ast.AnnAssign(cast(Union[ast.Name, ast.Attribute, ast.Subscript], source_expr(self.name)), source_expr(self.annotation or "None"), None, self.simple)
+        elif self.kind == "def":
+            positional = self.posonlyargs + self.args
+            defaults = [source_expr(arg.default) for arg in positional if arg.default is not None]
+            kw_defaults = [source_expr(arg.default) if arg.default is not None else None for arg in self.kwonlyargs]
+            funcargs = ast.arguments([arg.render() for arg in self.posonlyargs], [arg.render() for arg in self.args],
+                                     self.vararg.render() if self.vararg else None, [arg.render() for arg in self.kwonlyargs],
+                                     kw_defaults, self.kwarg.render() if self.kwarg else None, defaults)
+            stmt = ast.FunctionDef(self.name, funcargs, [ast.Pass()], [source_expr(decorator) for decorator in self.decorators],
+                                   source_expr(self.returns) if self.returns is not None else None)
+        else:
+            stmt = ast.ClassDef(self.name, [source_expr(base) for base in self.bases],
+                                [ast.keyword(arg, source_expr(value)) for arg, value in self.keywords],
+                                [record.render() for record in self.body], [source_expr(decorator) for decorator in self.decorators])
+        if self.lineno is not None:
+            setattr(stmt, "lineno", self.lineno)
+            setattr(stmt, "end_lineno", self.end_lineno)
+        return stmt
+
+def pyi_render(pyi: Iterable[Union[PyiDef, ast.stmt]]) -> List[ast.stmt]:
+    return [stmt.render() if isinstance(stmt, PyiDef) else stmt for stmt in pyi]
+
 class NamedTupleToCollectionsTransformer(DetectImportsTransformer):
-    typedefs: List[ast.stmt]
+    triggers = ("NamedTuple",)
+    typedefs: List[PyiDef]
     requiresfrom: Set[str]
     only: Set[str]
     def __init__(self) -> None:
@@ -1170,13 +2058,11 @@ class NamedTupleToCollectionsTransformer(DetectImportsTransformer):
         self.typedefs = []
         self.requiresfrom = set()
         self.only = set()
-    def visit(self, node: ast.AST) -> ast.AST:
-        if isinstance(node, ast.Module):
-            module = cast(ast.Module, node)  # type: ignore[redundant-cast]
-            for stmt in module.body:
-                if isinstance(stmt, ast.ClassDef):
-                    self.only.add(stmt.name) # only top-level class names
-        return cast(ast.AST, DetectImportsTransformer.visit(self, node))
+    def visit_Module(self, node: ast.Module) -> ast.AST: # pylint: disable=invalid-name
+        for stmt in node.body:
+            if isinstance(stmt, ast.ClassDef):
+                self.only.add(stmt.name) # only top-level class names
+        return self.generic_visit(node)
     def visit_ClassDef(self, node: ast.ClassDef) -> ast.AST: # pylint: disable=invalid-name
         classname = node.name
         for base in node.bases:
@@ -1185,23 +2071,20 @@ class NamedTupleToCollectionsTransformer(DetectImportsTransformer):
                 basetype = basename.id
                 if basetype in self.importas:
                     if self.importas[basetype] == "typing.NamedTuple":
-                        body: List[ast.stmt] = []
+                        body: List[PyiDef] = []
                         fields: List[ast.expr] = []
                         for stmt in node.body:
                             if isinstance(stmt, ast.AnnAssign):
                                 assign = cast(ast.AnnAssign, stmt)   # type: ignore[redundant-cast]
                                 fieldname = cast(ast.Name, assign.target).id
-                                annotation = assign.annotation
-                                body.append(ast.AnnAssign(ast.Name(fieldname), annotation, None, assign.simple))
+                                body.append(PyiDef.var(assign))
                                 fields.append(ast.Constant(fieldname))
                             else: # pragma: nocover
                                 raise TransformerSyntaxError(F"NamedTuple {classname} - can only replace variable declarations", #  ..
                                     (None, stmt.lineno, stmt.col_offset, str(type(stmt)), stmt.end_lineno, stmt.end_col_offset))
-                        typebase = ast.Name("NamedTuple")
-                        copy_location(typebase, node)
-                        typebases: List[ast.expr] = [typebase]
-                        typeclass = ast.ClassDef(classname, typebases, body=body, keywords=[], decorator_list=[])
-                        copy_location(typeclass, node)
+                        typeclass = PyiDef("class", classname, node)
+                        typeclass.bases = ("NamedTuple",)
+                        typeclass.body = tuple(body)
                         if not self.only or classname in self.only:
                             self.typedefs.append(typeclass)
                         args: List[ast.expr] = [ast.Constant(classname)]
@@ -1209,12 +2092,13 @@ class NamedTupleToCollectionsTransformer(DetectImportsTransformer):
                         replaced = ast.Assign([ast.Name(classname)], ast.Call(ast.Name("namedtuple"), args, []))
                         copy_location(replaced, node)
                         self.requiresfrom.add("collections.namedtuple")
-                        logg.debug("replaced NamedTuple %s = %s", classname, ast.dump(replaced))
+                        logg.debug("replaced NamedTuple %s = %s", classname, LazyDump(replaced))
                         return replaced
         return self.generic_visit(node)
 
 class TypedDictToDictTransformer(DetectImportsTransformer):
-    typedefs: List[ast.stmt]
+    triggers = ("TypedDict",)
+    typedefs: List[PyiDef]
     requiresfrom: Set[str]
     only: Set[str]
     def __init__(self) -> None:
@@ -1222,13 +2106,11 @@ class TypedDictToDictTransformer(DetectImportsTransformer):
         self.typedefs = []
         self.requiresfrom = set()
         self.only = set()
-    def visit(self, node: ast.AST) -> ast.AST:
-        if isinstance(node, ast.Module):
-            module = cast(ast.Module, node)  # type: ignore[redundant-cast]
-            for stmt in module.body:
-                if isinstance(stmt, ast.ClassDef):
-                    self.only.add(stmt.name) # only top-level class names
-        return cast(ast.AST, DetectImportsTransformer.visit(self, node))
+    def visit_Module(self, node: ast.Module) -> ast.AST: # pylint: disable=invalid-name
+        for stmt in node.body:
+            if isinstance(stmt, ast.ClassDef):
+                self.only.add(stmt.name) # only top-level class names
+        return self.generic_visit(node)
     def visit_ClassDef(self, node: ast.ClassDef) -> ast.AST: # pylint: disable=invalid-name
         for base in node.bases:
             classname = node.name
@@ -1237,23 +2119,20 @@ class TypedDictToDictTransformer(DetectImportsTransformer):
                 basetype = basename.id
                 if basetype in self.importas:
                     if self.importas[basetype] == "typing.TypedDict":
-                        body: List[ast.stmt] = []
+                        body: List[PyiDef] = []
                         fields: List[ast.expr] = []
                         for stmt in node.body:
                             if isinstance(stmt, ast.AnnAssign):
                                 assign = cast(ast.AnnAssign, stmt)   # type: ignore[redundant-cast]
                                 fieldname = cast(ast.Name, assign.target).id
-                                annotation = assign.annotation
-                                body.append(ast.AnnAssign(ast.Name(fieldname), annotation, None, assign.simple))
+                                body.append(PyiDef.var(assign))
                                 fields.append(ast.Constant(fieldname))
                             else: # pragma: nocover
                                 raise TransformerSyntaxError(F"TypedDict {classname} - must only have variable declarations", #  ..
                                     (None, stmt.lineno, stmt.col_offset, str(type(stmt)), stmt.end_lineno, stmt.end_col_offset))
-                        typebase = ast.Name("TypedDict")
-                        copy_location(typebase, node)
-                        typebases: List[ast.expr] = [typebase]
-                        typeclass = ast.ClassDef(classname, typebases, body=body, keywords=[], decorator_list=[])
-                        copy_location(typeclass, node)
+                        typeclass = PyiDef("class", classname, node)
+                        typeclass.bases = ("TypedDict",)
+                        typeclass.body = tuple(body)
                         if not self.only or classname in self.only:
                             self.typedefs.append(typeclass)
                         replaced = ast.Assign([ast.Name(classname)], ast.Name("dict"))
@@ -1263,8 +2142,9 @@ class TypedDictToDictTransformer(DetectImportsTransformer):
 
 
 
-class FStringToFormatTransformer(ast.NodeTransformer):
+class FStringToFormatTransformer(DispatchTransformer):
     """ The 3.8 F="{a=}" syntax is resolved before ast nodes are generated. """
+    triggers = ("JoinedStr",)
     def string_format(self, values: List[Union[ast.Constant, ast.FormattedValue]]) -> ast.AST:
         num: int = 1
         form: str = ""
@@ -1321,15 +2201,17 @@ class FStringToFormatTransformer(ast.NodeTransformer):
     def visit_JoinedStr(self, node: ast.JoinedStr) -> ast.AST:  # pylint: disable=invalid-name
         return self.string_format(cast(List[Union[ast.Constant, ast.FormattedValue]], node.values))
 
-class FStringFromLocalsFormat(ast.NodeTransformer):
+class FStringFromLocalsFormat(DispatchTransformer):
     filename: str
     """ the portable idiom `x = "{y}+".format(**locals())` should be replaced by f-string. """
+    triggers = ("locals",)
+    produces = ("JoinedStr",)
     def visit_Call(self, node: ast.Call) -> ast.AST: # pylint: disable=invalid-name
         call = cast(ast.Call, node) # type: ignore[redundant-cast]
-        logg.debug("call %s", ast.dump(call))
+        logg.debug("call %s", LazyDump(call))
         if isinstance(call.func, ast.Attribute):
             calls = cast(ast.Attribute, call.func) # type: ignore[redundant-cast]
-            logg.debug("calls %s", ast.dump(calls))
+            logg.debug("calls %s", LazyDump(calls))
             if isinstance(calls.value, ast.Constant):
                 value = cast(ast.Constant, calls.value) # type: ignore[redundant-cast]
                 if isinstance(value.value, str) and calls.attr == 'format':
@@ -1338,7 +2220,7 @@ class FStringFromLocalsFormat(ast.NodeTransformer):
                         keywords = ast_unparse(call.keywords[0])
                         if keywords == '**locals()':
                             module = ast_parse(F'F"{text}"')
-                            logg.debug("created %s", ast.dump(module))
+                            logg.debug("created %s", LazyDump(module))
                             if isinstance(module, ast.Module):
                                 if module.body and isinstance(module.body[0], ast.Expr):
                                     expr = cast(ast.Expr, module.body[0]) # type: ignore[redundant-cast]
@@ -1348,6 +2230,8 @@ class FStringFromLocalsFormat(ast.NodeTransformer):
 class FStringFromVarLocalsFormat(BlockTransformer):
     filename: str
     """ the portable idiom `x = "{y}+"; print(x.format(**locals()))` should be replaced by f-string. """
+    triggers = ("locals",)
+    produces = ("JoinedStr",)
     def next_body(self, body: List[ast.stmt], block: Deque[ast.AST], part: str = NIX) -> List[ast.stmt]:
         varvalue: Dict[str, str] = {}
         varused: Dict[str, int] = {}
@@ -1356,10 +2240,10 @@ class FStringFromVarLocalsFormat(BlockTransformer):
             runs: Optional[ast.Call] = None
             if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
                 runs = cast(ast.Call, node.value) # type: ignore[redundant-cast]
-                logg.debug("runs %s", ast.dump(runs))
+                logg.debug("runs %s", LazyDump(runs))
             elif isinstance(node, ast.Assign):
                 sets = cast(ast.Assign, node) # type: ignore[redundant-cast]
-                logg.debug("sets %s", ast.dump(sets))
+                logg.debug("sets %s", LazyDump(sets))
                 if isinstance(sets.value, ast.Constant) and isinstance(sets.value.value, str):
                     if len(sets.targets) == 1 and isinstance(sets.targets[0], ast.Name):
                         targetname = cast(ast.Name, sets.targets[0]) # type: ignore[redundant-cast]
@@ -1368,9 +2252,9 @@ class FStringFromVarLocalsFormat(BlockTransformer):
                         replaced[targetname.id] = 0
                 elif isinstance(sets.value, ast.Call):
                     runs = cast(ast.Call, sets.value) # type: ignore[redundant-cast]
-                    logg.debug("run2 %s", ast.dump(runs))
+                    logg.debug("run2 %s", LazyDump(runs))
             else:
-                logg.debug("? %s", ast.dump(node))
+                logg.debug("? %s", LazyDump(node))
             if runs is not None:
                 for n, arg in enumerate(runs.args):
                     if isinstance(arg, ast.Name):
@@ -1379,10 +2263,10 @@ class FStringFromVarLocalsFormat(BlockTransformer):
                             varused[use1.id] += 1
                     elif isinstance(arg, ast.Call):
                         call = cast(ast.Call, arg) # type: ignore[redundant-cast]
-                        logg.debug("call %s", ast.dump(call))
+                        logg.debug("call %s", LazyDump(call))
                         if isinstance(call.func, ast.Attribute):
                             calls = cast(ast.Attribute, call.func) # type: ignore[redundant-cast]
-                            logg.debug("calls %s", ast.dump(calls))
+                            logg.debug("calls %s", LazyDump(calls))
                             if isinstance(calls.value, ast.Name) and calls.attr == 'format':
                                 name = cast(ast.Name, calls.value) # type: ignore[redundant-cast]
                                 logg.debug("%s == ... %s", name.id, varvalue)
@@ -1393,18 +2277,18 @@ class FStringFromVarLocalsFormat(BlockTransformer):
                                         keywords = ast_unparse(call.keywords[0])
                                         if keywords == '**locals()':
                                             module = ast_parse(F'F"{text}"')
-                                            logg.debug("created %s", ast.dump(module))
+                                            logg.debug("created %s", LazyDump(module))
                                             if isinstance(module, ast.Module):
                                                 if module.body and isinstance(module.body[0], ast.Expr):
                                                     expr = cast(ast.Expr, module.body[0]) # type: ignore[redundant-cast]
-                                                    logg.debug("expr %s", ast.dump(expr))
+                                                    logg.debug("expr %s", LazyDump(expr))
                                                     runs.args[n] = expr.value
                                                     replaced[name.id] += 1
         newbody: list[ast.stmt] = []
         for node in body:
             if isinstance(node, ast.Assign):
                 sets = cast(ast.Assign, node) # type: ignore[redundant-cast]
-                logg.debug("sets %s", ast.dump(sets))
+                logg.debug("sets %s", LazyDump(sets))
                 if isinstance(sets.value, ast.Constant) and isinstance(sets.value.value, str):
                     if len(sets.targets) == 1 and isinstance(sets.targets[0], ast.Name):
                         targetname = cast(ast.Name, sets.targets[0]) # type: ignore[redundant-cast]
@@ -1425,13 +2309,21 @@ class ReplaceCallResult(NamedTuple):
     requires: List[str]
     removed: List[str]
 
-def replace_datetime_fromisoformat(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
-    if calls is None:   # pragma: nocover
-        calls = DetectImportedFunctionCalls()
-        calls.visit(tree)
-    assert calls is not None
+# the rename of the calls, then the define of the replacement - and its requires after its walk
+class ReplaceCallWalks(NamedTuple):
+    rename: DetectImportedFunctionCalls
+    define: DefineIfPython3
+    requires: List[str]
+    removed: List[str]
+
+def replace_call(tree: ast.AST, walks: Optional[ReplaceCallWalks]) -> ReplaceCallResult:
+    if walks is None:
+        return ReplaceCallResult(tree, [], [])
+    tree = walks.define.visit(walks.rename.visit(tree))
+    return ReplaceCallResult(tree, walks.requires + walks.define.requires, walks.removed)
+
+def replace_datetime_fromisoformat_walks(calls: DetectImportedFunctionCalls) -> Optional[ReplaceCallWalks]:
     requires: List[str] = []
-    removed: List[str] = []
     if "datetime.datetime.fromisoformat" in calls.found:
         if OK:
             if OK:
@@ -1453,20 +2345,18 @@ def replace_datetime_fromisoformat(tree: ast.AST, calls: Optional[DetectImported
                     raise ValueError("not a datetime isoformat: "+x)
                 """)])
                 isoformatfunc = DetectImportedFunctionCalls({"datetime.datetime.fromisoformat": fromisoformat})
-                tree = isoformatdef.visit(isoformatfunc.visit(tree))
-                # importrequires.append(isoformatdef.requires)
-                # importrequiresfrom.remove(["datetime.datetime.fromisoformat"])
-                requires += isoformatdef.requires
-                removed += ["datetime.datetime.fromisoformat"]
-    return ReplaceCallResult(tree, requires, removed)
+                return ReplaceCallWalks(isoformatfunc, isoformatdef, requires, ["datetime.datetime.fromisoformat"])
+    return None
 
-def replace_subprocess_run(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None, minversion: Tuple[int, int] = (2, 7)) -> ReplaceCallResult:
+def replace_datetime_fromisoformat(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
     if calls is None:   # pragma: nocover
         calls = DetectImportedFunctionCalls()
         calls.visit(tree)
     assert calls is not None
+    return replace_call(tree, replace_datetime_fromisoformat_walks(calls))
+
+def replace_subprocess_run_walks(calls: DetectImportedFunctionCalls, minversion: Tuple[int, int] = (2, 7)) -> Optional[ReplaceCallWalks]:
     requires: List[str] = []
-    removed: List[str] = []
     if "subprocess.run" in calls.found:
         if OK:
             if OK:
@@ -1515,20 +2405,18 @@ def replace_subprocess_run(tree: ast.AST, calls: Optional[DetectImportedFunction
                 """)])
                 subprocessrundef = subprocessrundef33 if minversion >= (3,3) else subprocessrundef27
                 subprocessrunfunc = DetectImportedFunctionCalls({"subprocess.run": defname})
-                tree = subprocessrundef.visit(subprocessrunfunc.visit(tree))
-                # importrequires.append(subprocessrundef.requires)
-                # importrequiresfrom.remove(["subprocess.run"])
-                requires += subprocessrundef.requires
-                removed += ["subprocess.run"]
-    return ReplaceCallResult(tree, requires, removed)
+                return ReplaceCallWalks(subprocessrunfunc, subprocessrundef, requires, ["subprocess.run"])
+    return None
 
-def replace_time_monotonic(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
+def replace_subprocess_run(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None, minversion: Tuple[int, int] = (2, 7)) -> ReplaceCallResult:
     if calls is None:   # pragma: nocover
         calls = DetectImportedFunctionCalls()
         calls.visit(tree)
     assert calls is not None
+    return replace_call(tree, replace_subprocess_run_walks(calls, minversion))
+
+def replace_time_monotonic_walks(calls: DetectImportedFunctionCalls) -> Optional[ReplaceCallWalks]:
     requires: List[str] = []
-    removed: List[str] = []
     if "time.monotonic" in calls.found:
         if OK:
             if OK:
@@ -1537,20 +2425,18 @@ def replace_time_monotonic(tree: ast.AST, calls: Optional[DetectImportedFunction
                 monotonicdef = DefineIfPython3([F"{defname} = {time_module}.monotonic"], atleast=(3,3), # ..
                    or_else=[F"def {defname}(): return time.time()"])
                 monotonicfunc = DetectImportedFunctionCalls({"time.monotonic": defname})
-                tree = monotonicdef.visit(monotonicfunc.visit(tree))
-                # importrequires.append(monotonicdef.requires)
-                # importrequiresfrom.remove(["time.monotonic"])
-                requires += monotonicdef.requires
-                removed += ["time.monotonic"]
-    return ReplaceCallResult(tree, requires, removed)
+                return ReplaceCallWalks(monotonicfunc, monotonicdef, requires, ["time.monotonic"])
+    return None
 
-def replace_time_monotonic_ns(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
+def replace_time_monotonic(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
     if calls is None:   # pragma: nocover
         calls = DetectImportedFunctionCalls()
         calls.visit(tree)
     assert calls is not None
+    return replace_call(tree, replace_time_monotonic_walks(calls))
+
+def replace_time_monotonic_ns_walks(calls: DetectImportedFunctionCalls) -> Optional[ReplaceCallWalks]:
     requires: List[str] = []
-    removed: List[str] = []
     if "time.monotonic_ns" in calls.found:
         if OK:
             if OK:
@@ -1563,19 +2449,22 @@ def replace_time_monotonic_ns(tree: ast.AST, calls: Optional[DetectImportedFunct
                 monotonicdef = DefineIfPython3([F"{defname} = {time_module}.monotonic_ns"], atleast=(3,7), # ..
                    or_else=[F"def {defname}(): return int((time.time() - 946684800) * 1000000000)"])
                 monotonicfunc = DetectImportedFunctionCalls({"time.monotonic_ns": defname})
-                tree = monotonicdef.visit(monotonicfunc.visit(tree))
-                # importrequires.append(monotonicdef.requires)
-                # importrequiresfrom.remove(["time.monotonic_ns"])
-                requires += monotonicdef.requires
-                removed += ["time.monotonic_ns"]
-    return ReplaceCallResult(tree, requires, removed)
+                return ReplaceCallWalks(monotonicfunc, monotonicdef, requires, ["time.monotonic_ns"])
+    return None
+
+def replace_time_monotonic_ns(tree: ast.AST, calls: Optional[DetectImportedFunctionCalls] = None) -> ReplaceCallResult:
+    if calls is None:   # pragma: nocover
+        calls = DetectImportedFunctionCalls()
+        calls.visit(tree)
+    assert calls is not None
+    return replace_call(tree, replace_time_monotonic_ns_walks(calls))
 
 # ...................................................................................
 
-class DetectAnnotation(ast.NodeVisitor):
+class DetectAnnotation(DispatchVisitor):
     names: Dict[str, str]
     def __init__(self) -> None:
-        ast.NodeVisitor.__init__(self)
+        DispatchVisitor.__init__(self)
         self.names = dict()
     def visit_Attribute(self, node: ast.Attribute) -> ast.Attribute: # pylint: disable=invalid-name
         if isinstance(node.value, ast.Name):
@@ -1603,6 +2492,7 @@ def get_simple_typehint(node: ast.expr) -> str:
 class ReplaceSelfByTypevar(BlockTransformer):
     typing: List[str]
     newclasses: List[str]
+    triggers = ("Self",)
     def __init__(self) -> None:
         BlockTransformer.__init__(self)
         self.typing = []
@@ -1690,7 +2580,7 @@ def types_in_annotation(annotation: ast.expr) -> Dict[str, str]:
     detect.visit(annotation)
     return detect.names
 
-class RemovePosonlyArgs(ast.NodeTransformer):
+class RemovePosonlyArgs(DispatchTransformer):
     def visit_FunctionDef(self, node: ast.FunctionDef) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         func: ast.FunctionDef = node
         if not func.args.posonlyargs:
@@ -1699,33 +2589,33 @@ class RemovePosonlyArgs(ast.NodeTransformer):
         func.args.posonlyargs = []
         return func
 
-class DetectHints(ast.NodeTransformer):
+class DetectHints(DispatchTransformer):
     """ only check all ClassDef, Function and AnnAssign in the source tree """
     typing: Dict[str, str]
     classes: Dict[str, str]
     hints: List[ast.expr]
     def __init__(self) -> None:
-        ast.NodeTransformer.__init__(self)
+        DispatchTransformer.__init__(self)
         self.typing = dict()
         self.classes = dict()
         self.hints = list()
     def visit_ImportFrom(self, node: ast.ImportFrom) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         imports: ast.ImportFrom = cast(ast.ImportFrom, node) # type: ignore[redundant-cast]
-        logg.debug("?imports: %s", ast.dump(imports))
+        logg.debug("?imports: %s", LazyDump(imports))
         if imports.module == "typing":
             for symbol in imports.names:
                 self.typing[symbol.asname or symbol.name] = F"typing.{symbol.name}"
         return node # unchanged no recurse
     def visit_AnnAssign(self, node: ast.AnnAssign) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         assign: ast.AnnAssign = cast(ast.AnnAssign, node)  # type: ignore[redundant-cast]
-        logg.debug("?assign: %s", ast.dump(assign))
+        logg.debug("?assign: %s", LazyDump(assign))
         if assign.annotation:
             self.hints.append(assign.annotation)
             self.classes.update(types_in_annotation(assign.annotation))
         return node
     def visit_FunctionDef(self, node: ast.FunctionDef) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         func: ast.FunctionDef = node
-        logg.debug("?func: %s", ast.dump(func))
+        logg.debug("?func: %s", LazyDump(func))
         vargarg = func.args.vararg
         kwarg = func.args.kwarg
         return_annotation = func.returns
@@ -1755,19 +2645,19 @@ class DetectHints(ast.NodeTransformer):
                 self.classes.update(types_in_annotation(return_annotation))
         return self.generic_visit(node)
 
-class StripTypeHints(ast.NodeTransformer):
+class StripTypeHints(DispatchTransformer):
     """ check all ClassDef, Function and AnnAssign in the source tree """
     typing: Set[str]
     removed: Set[str]
     def __init__(self) -> None:
-        ast.NodeTransformer.__init__(self)
+        DispatchTransformer.__init__(self)
         self.typing = set()
         self.removed = set()
     def visit_ImportFrom(self, node: ast.ImportFrom) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         if not want.remove_typehints:
             return node
         imports: ast.ImportFrom = node
-        logg.debug("-imports: %s", ast.dump(imports))
+        logg.debug("-imports: %s", LazyDump(imports))
         if imports.module != "typing":
             return node # unchanged
         return None
@@ -1775,7 +2665,7 @@ class StripTypeHints(ast.NodeTransformer):
         if not want.remove_typehints:
             return self.generic_visit(node)
         calls: ast.Call = node
-        logg.debug("-calls: %s", ast.dump(calls))
+        logg.debug("-calls: %s", LazyDump(calls))
         if not isinstance(calls.func, ast.Name):
             return self.generic_visit(node)
         callfunc: ast.Name = calls.func
@@ -1783,13 +2673,13 @@ class StripTypeHints(ast.NodeTransformer):
             return node # unchanged
         if len(calls.args) > 1:
             return self.generic_visit(calls.args[1])
-        logg.error("-bad cast: %s", ast.dump(node))
+        logg.error("-bad cast: %s", LazyDump(node))
         return ast.Constant(None)
     def visit_AnnAssign(self, node: ast.AnnAssign) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         if not want.remove_typehints and not want.remove_var_typehints:
             return self.generic_visit(node)
         assign: ast.AnnAssign = node
-        logg.debug("-assign: %s", ast.dump(assign))
+        logg.debug("-assign: %s", LazyDump(assign))
         if assign.value is not None:
             assign2 = ast.Assign(targets=[assign.target], value=assign.value)
             assign2 = copy_location(assign2, assign)
@@ -1816,7 +2706,7 @@ class StripTypeHints(ast.NodeTransformer):
         return node
     def visit_FunctionDef(self, node: ast.FunctionDef) -> Optional[ast.AST]:  # pylint: disable=invalid-name
         func: ast.FunctionDef = node
-        logg.debug("-func: %s", ast.dump(func))
+        logg.debug("-func: %s", LazyDump(func))
         annos = 0
         posonlyargs: List[ast.arg] = []
         functionargs: List[ast.arg] = []
@@ -1827,7 +2717,7 @@ class StripTypeHints(ast.NodeTransformer):
         defaults: List[ast.expr] = []
         if OK:
             for arg in func.args.posonlyargs:
-                logg.debug("-pos arg: %s", ast.dump(arg))
+                logg.debug("-pos arg: %s", LazyDump(arg))
                 new1 = types36_remove_typehints(arg.annotation)
                 arg1 = ast.arg(arg.arg, new1.annotation)
                 if want.remove_positional:
@@ -1840,7 +2730,7 @@ class StripTypeHints(ast.NodeTransformer):
                 self.removed.update(new1.removed)
         if OK:
             for arg in func.args.args:
-                logg.debug("-fun arg: %s", ast.dump(arg))
+                logg.debug("-fun arg: %s", LazyDump(arg))
                 new1 = types36_remove_typehints(arg.annotation)
                 arg1 = ast.arg(arg.arg, new1.annotation)
                 functionargs.append(arg1)
@@ -1850,7 +2740,7 @@ class StripTypeHints(ast.NodeTransformer):
                 self.removed.update(new1.removed)
         if OK:
             for arg in func.args.kwonlyargs:
-                logg.debug("-kwo arg: %s", ast.dump(arg))
+                logg.debug("-kwo arg: %s", LazyDump(arg))
                 new1 = types36_remove_typehints(arg.annotation)
                 arg1 = ast.arg(arg.arg, new1.annotation)
                 if want.remove_keywordonly:
@@ -1903,97 +2793,47 @@ class StripTypeHints(ast.NodeTransformer):
         return self.generic_visit(func2)
 
 class ExtractTypeHints:
-    """ check the outer interface - extract typedefs for pyi """
-    typedefs: List[ast.stmt]
+    """ check the outer interface - extract typedefs for pyi (as PyiDef records) """
+    typedefs: List[PyiDef]
     def __init__(self) -> None:
         self.typedefs = []
     def visit(self, node: ast.AST) -> ast.AST:
         if isinstance(node, ast.Module):
             for child in node.body:
                 if isinstance(child, ast.ImportFrom):
-                    imports = child
-                    if imports.module == "typing":
-                        imports3 = ast.ImportFrom(imports.module, imports.names, imports.level)
-                        imports3 = copy_location(imports3, imports)
-                        self.typedefs.append(imports3)
+                    if child.module == "typing":
+                        self.typedefs.append(PyiDef.importfrom(child))
                 elif isinstance(child, ast.AnnAssign):
-                    assign1: ast.AnnAssign = child
-                    assign3 = ast.AnnAssign(target=assign1.target, annotation=assign1.annotation, value=None, simple=assign1.simple)
-                    self.typedefs.append(assign3)
+                    self.typedefs.append(PyiDef.var(child))
                 elif isinstance(child, ast.FunctionDef):
-                    funcdef1: ast.FunctionDef = child
-                    if OK:
-                        if OK:
-                            annos = 0
-                            if OK:
-                                for arg in funcdef1.args.posonlyargs:
-                                    if arg.annotation:
-                                        annos += 1
-                            if OK:
-                                for arg in funcdef1.args.args:
-                                    if arg.annotation:
-                                        annos += 1
-                            if OK:
-                                for arg in funcdef1.args.kwonlyargs:
-                                    if arg.annotation:
-                                        annos += 1
-                            if funcdef1.args.vararg is not None:
-                                arg = funcdef1.args.vararg
-                                if arg.annotation:
-                                    annos += 1
-                            if funcdef1.args.kwarg is not None:
-                                arg = funcdef1.args.kwarg
-                                if arg.annotation:
-                                    annos += 1
-                            if annos or funcdef1.returns:
-                                funcargs3 = funcdef1.args
-                                funcdef3 = ast.FunctionDef(funcdef1.name, funcargs3, [ast.Pass()], funcdef1.decorator_list, funcdef1.returns)
-                                funcdef3 = copy_location(funcdef3, funcdef1)
-                                self.typedefs.append(funcdef3)
+                    if self.annotated(child):
+                        self.typedefs.append(PyiDef.function(child))
                 elif isinstance(child, ast.ClassDef):
-                    decl: List[ast.stmt] = []
+                    decl: List[PyiDef] = []
                     for part in child.body:
                         if isinstance(part, ast.AnnAssign):
-                            assign: ast.AnnAssign = part
-                            assign3 = ast.AnnAssign(target=assign.target, annotation=assign.annotation, value=None, simple=assign.simple)
-                            decl.append(assign3)
+                            decl.append(PyiDef.var(part))
                         elif isinstance(part, ast.FunctionDef):
-                            func: ast.FunctionDef = part
-                            annos = 0
-                            if OK:
-                                for arg in func.args.posonlyargs:
-                                    if arg.annotation:
-                                        annos += 1
-                            if OK:
-                                for arg in func.args.args:
-                                    if arg.annotation:
-                                        annos += 1
-                            if OK:
-                                for arg in func.args.kwonlyargs:
-                                    if arg.annotation:
-                                        annos += 1
-                            if func.args.vararg is not None:
-                                arg = func.args.vararg
-                                if arg.annotation:
-                                    annos += 1
-                            if func.args.kwarg is not None:
-                                arg = func.args.kwarg
-                                if arg.annotation:
-                                    annos += 1
-                            if annos or func.returns:
-                                args3 = func.args
-                                func3 = ast.FunctionDef(func.name, args3, [ast.Pass()], func.decorator_list, func.returns)
-                                func3 = copy_location(func3, func)
-                                decl.append(func3)
+                            if self.annotated(part):
+                                decl.append(PyiDef.function(part))
                     if decl:
-                        class3 = ast.ClassDef(child.name, child.bases, child.keywords, decl, child.decorator_list)
-                        class3 = copy_location(class3, child)
-                        self.typedefs.append(class3)
+                        self.typedefs.append(PyiDef.classdef(child, decl))
         return node
+    def annotated(self, func: ast.FunctionDef) -> bool:
+        """ whether the function has any typehint to be shown in the pyi """
+        funcargs = func.args
+        for arg in funcargs.posonlyargs + funcargs.args + funcargs.kwonlyargs:
+            if arg.annotation:
+                return True
+        if funcargs.vararg is not None and funcargs.vararg.annotation:
+            return True
+        if funcargs.kwarg is not None and funcargs.kwarg.annotation:
+            return True
+        return func.returns is not None
 
-class TypesTransformer(ast.NodeTransformer):
+class TypesTransformer(DispatchTransformer):
     def __init__(self) -> None:
-        ast.NodeTransformer.__init__(self)
+        DispatchTransformer.__init__(self)
         self.typing: Set[str] = set()
         self.removed: Set[str] = set()
     def visit_Subscript(self, node: ast.Subscript) -> Optional[ast.AST]:  # pylint: disable=invalid-name
@@ -2017,7 +2857,7 @@ class TypesTransformer(ast.NodeTransformer):
                     return self.generic_visit(elems.elts[0])
         return self.generic_visit(node)
     def visit_BinOp(self, node: ast.BinOp) -> Optional[ast.AST]:  # pylint: disable=invalid-name
-        logg.log(DEBUG_TYPING, "have BINOP %s", ast.dump(node))
+        logg.log(DEBUG_TYPING, "have BINOP %s", LazyDump(node))
         if isinstance(node.op, ast.BitOr):
             left: ast.expr = cast(ast.expr, self.generic_visit(node.left))
             right: ast.expr = cast(ast.expr, self.generic_visit(node.right))
@@ -2041,7 +2881,7 @@ class Types36(NamedTuple):
     typing: Set[str]
     removed: Set[str]
 def types36(ann: ast.expr) -> Types36:
-    logg.log(DEBUG_TYPING, "types36: %s", ast.dump(ann))
+    logg.log(DEBUG_TYPING, "types36: %s", LazyDump(ann))
     types = TypesTransformer()
     annotation = types.visit(ann)
     return Types36(annotation, types.typing, types.removed)
@@ -2057,14 +2897,14 @@ def types36_remove_typehints(ann: Optional[ast.expr]) -> OptionalTypes36:
         return OptionalTypes36(new1.annotation, new1.typing, new1.removed)
     return OptionalTypes36(None, set(), set())
 
-def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = None) -> ast.Module:
+def pyi_module(pyi: Iterable[Union[PyiDef, ast.stmt]], type_ignores: Optional[List[TypeIgnore]] = None) -> ast.Module:
     """ generates the *.pyi part - based on the output of ExtractTypeHints """
     type_ignores1: List[TypeIgnore] = type_ignores if type_ignores is not None else []
     typing_extensions: List[str] = []
     typing_require: Set[str] = set()
     typing_removed: Set[str] = set()
     body: List[ast.stmt] = []
-    for stmt in pyi:
+    for stmt in pyi_render(pyi):
         if isinstance(stmt, ast.ImportFrom):
             import1: ast.ImportFrom = stmt
             if import1.module in ["typing", "typing_extensions"]:
@@ -2074,7 +2914,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
         elif isinstance(stmt, ast.AnnAssign):
             assign1: ast.AnnAssign = stmt
             anng = assign1.annotation
-            logg.log(DEBUG_TYPING, "anng %s", ast.dump(anng))
+            logg.log(DEBUG_TYPING, "anng %s", LazyDump(anng))
             newg = types36(anng)
             assign1.annotation = newg.annotation
             typing_require.update(newg.typing)
@@ -2085,7 +2925,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
             for n, arg1 in enumerate(funcdef1.args.posonlyargs):
                 ann1 = arg1.annotation
                 if ann1:
-                    logg.log(DEBUG_TYPING, "anp1[%i] %s", n, ast.dump(ann1))
+                    logg.log(DEBUG_TYPING, "anp1[%i] %s", n, LazyDump(ann1))
                     new1 = types36(ann1)
                     arg1.annotation = new1.annotation
                     typing_require.update(new1.typing)
@@ -2093,25 +2933,25 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
             for n, arg1 in enumerate(funcdef1.args.args):
                 ann1 = arg1.annotation
                 if ann1:
-                    logg.log(DEBUG_TYPING, "ann1[%i] %s", n, ast.dump(ann1))
+                    logg.log(DEBUG_TYPING, "ann1[%i] %s", n, LazyDump(ann1))
                     new1 = types36(ann1)
                     arg1.annotation = new1.annotation
                     typing_require.update(new1.typing)
                     typing_removed.update(new1.removed)
             kwargs2 = funcdef1.args.kwonlyargs
             if kwargs2:
-                logg.log(DEBUG_TYPING, "funcdef kwargs %s",  [ast.dump(a) for a in kwargs2])
+                logg.log(DEBUG_TYPING, "funcdef kwargs %s",  [LazyDump(a) for a in kwargs2])
                 for k2, argk2 in enumerate(kwargs2):
                     ann2 = argk2.annotation
                     if ann2:
-                        logg.log(DEBUG_TYPING, "ann2[%i] %s", k2, ast.dump(ann2))
+                        logg.log(DEBUG_TYPING, "ann2[%i] %s", k2, LazyDump(ann2))
                         newk2 = types36(ann2)
                         argk2.annotation = newk2.annotation
                         typing_require.update(newk2.typing)
                         typing_removed.update(newk2.removed)
             ann0 = funcdef1.returns
             if ann0:
-                logg.log(DEBUG_TYPING, "ann0 %s",ast.dump(ann0))
+                logg.log(DEBUG_TYPING, "ann0 %s",LazyDump(ann0))
                 new0 = types36(ann0)
                 funcdef1.returns = new0.annotation
                 typing_require.update(new0.typing)
@@ -2123,7 +2963,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
                 if isinstance(part, ast.AnnAssign):
                     assign: ast.AnnAssign = part
                     annv = assign.annotation
-                    logg.log(DEBUG_TYPING, "annv %s", ast.dump(annv))
+                    logg.log(DEBUG_TYPING, "annv %s", LazyDump(annv))
                     newv = types36(annv)
                     assign.annotation = newv.annotation
                     typing_require.update(newv.typing)
@@ -2133,7 +2973,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
                     for n, arg in enumerate(funcdef.args.posonlyargs):
                         annp = arg.annotation
                         if annp:
-                            logg.log(DEBUG_TYPING, "annp[%i] %s", n, ast.dump(annp))
+                            logg.log(DEBUG_TYPING, "annp[%i] %s", n, LazyDump(annp))
                             newp = types36(annp)
                             arg.annotation = newp.annotation
                             typing_require.update(newp.typing)
@@ -2141,7 +2981,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
                     for n, arg in enumerate(funcdef.args.args):
                         annp = arg.annotation
                         if annp:
-                            logg.log(DEBUG_TYPING, "anna[%i] %s", n, ast.dump(annp))
+                            logg.log(DEBUG_TYPING, "anna[%i] %s", n, LazyDump(annp))
                             newp = types36(annp)
                             arg.annotation = newp.annotation
                             typing_require.update(newp.typing)
@@ -2151,7 +2991,7 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
                         for k, argk in enumerate(kwargs):
                             annk = argk.annotation
                             if annk:
-                                logg.log(DEBUG_TYPING, "annk[%i] %s", k, ast.dump(annk))
+                                logg.log(DEBUG_TYPING, "annk[%i] %s", k, LazyDump(annk))
                                 newk = types36(annk)
                                 argk.annotation = newk.annotation
                                 typing_require.update(newk.typing)
@@ -2177,19 +3017,18 @@ def pyi_module(pyi: List[ast.stmt], type_ignores: Optional[List[TypeIgnore]] = N
     typehints = ast.Module(body, type_ignores=type_ignores1)
     return typehints
 
-def pyi_copy_imports(pyi: ast.Module, py1: ast.AST, py2: ast.AST) -> ast.Module:
-    pyi_imports = DetectImportsTransformer()
-    pyi_imports.visit(pyi)
-    py1_imports = DetectImportsTransformer()
-    py1_imports.visit(py1)
-    py2_imports = DetectImportsTransformer()
-    py2_imports.visit(py2)
+def pyi_copy_imports(pyi: ast.Module, py1: ast.AST, py2: ast.AST, symbols: Optional["PackageSymbols"] = None, module: str = NIX) -> ast.Module:
+    """ the pyi gets the imports for its typehints from the py code - and with --package from the module defining the name """
+    pyi_imports = ImportIndex(pyi)
+    py1_imports = ImportIndex(py1)
+    py2_imports = ImportIndex(py2)
     pyi_hints = DetectHints()
     pyi_hints.visit(pyi)
     logg.log(DEBUG_COPY, "found pyi used classes = %s", pyi_hints.classes)
     logg.log(DEBUG_COPY, "py1 imported %s", py1_imports.imported)
     logg.log(DEBUG_COPY, "py2 imported %s", py2_imports.imported)
     requiredimport = RequireImport()
+    requiredimport.imports = pyi_imports
     imports: Dict[str, str] = {}
     notfound: List[str] = []
     for name in pyi_hints.classes:
@@ -2219,6 +3058,15 @@ def pyi_copy_imports(pyi: ast.Module, py1: ast.AST, py2: ast.AST) -> ast.Module:
                     logg.info("found %s in py2: %s", libname, orig)
                     imports[name] = orig
                     requiredimport.add((orig, libname))
+        if name not in imports and symbols is not None and module and "." not in name:
+            if name in symbols.defined.get(module, ()):
+                imports[name] = F"{module}.{name}" # the pyi has it as well
+            else:
+                origin = symbols.resolve(module, name)
+                if origin:
+                    logg.info("found %s in package: %s", name, origin)
+                    imports[name] = origin
+                    requiredimport.add((origin, name))
         if name not in imports:
             if name not in ["bool", "int", "float", "complex", "str", "bytes", "bytearray", "set"]: # "memoryview", "frozenset"
                 notfound += [ name ]
@@ -2232,191 +3080,1081 @@ def pyi_copy_imports(pyi: ast.Module, py1: ast.AST, py2: ast.AST) -> ast.Module:
         tree = selftypes.visit(tree)
         typingrequires = RequireImportFrom()
         typingrequires.importfrom("typing", *selftypes.typing)
+        typingrequires.imports = pyi_imports
         tree = cast(ast.Module, typingrequires.visit(tree))
     if want.remove_positional_pyi:
         posonly = RemovePosonlyArgs()
         tree = posonly.visit(tree)
     if want.replace_typeddict_pyi:
         typeddict = TypedDictToDictTransformer()
-        tree = cast(ast.Module, typeddict.visit(tree))
+        tree = typeddict.visit(tree)
         typedrequires = RequireImportFrom()
         typedrequires.remove(["typing.TypedDict"])
+        typedrequires.imports = pyi_imports
         tree = cast(ast.Module, typedrequires.visit(tree))
     return tree
 
+class PackageSymbols:
+    """ the top-level names of all the modules of a --package, scanned once before the transformation, so that
+        a typehint name that a module got from a star import can be imported in the pyi from its defining module """
+    def __init__(self) -> None:
+        self.modules: Dict[str, str] = {} # filename -> dotted module name
+        self.stubs: Dict[str, str] = {} # filename -> file in the consolidated *-stubs package
+        self.defined: Dict[str, Set[str]] = {}
+        self.imported: Dict[str, Dict[str, str]] = {} # module -> name -> absolute module.name
+        self.starred: Dict[str, List[str]] = {} # module -> absolute modules
+    def add(self, filename: str, topdir: str, eachfile: int = 0, stubsdir: str = NIX) -> None:
+        """ the file as a module of the package at the topdir (named like the transformed file) """
+        relname = fs.relpath(transformfile_out(filename, eachfile | EACH_INPLACE), topdir)
+        parts = [fs.basename(fs.abspath(topdir))] + fs.splitext(relname)[0].split(os.sep)
+        ispackage = parts[-1] == "__init__"
+        module = ".".join(parts[:-1] if ispackage else parts)
+        self.modules[filename] = module
+        self.stubs[filename] = fs.join(stubsdir or fs.dirname(fs.abspath(topdir)), F"{parts[0]}-stubs", fs.splitext(relname)[0] + ".pyi")
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read())
+        except (OSError, SyntaxError, ValueError) as e:
+            logg.debug("%s: not scanned: %s", filename, e)
+            return
+        self.scan(module, tree, ispackage)
+    def scan(self, module: str, tree: ast.Module, ispackage: bool = False) -> None:
+        defined = self.defined.setdefault(module, set())
+        imported = self.imported.setdefault(module, {})
+        starred = self.starred.setdefault(module, [])
+        package = module if ispackage else module.rpartition(".")[0]
+        todo: List[ast.stmt] = list(tree.body)
+        while todo:
+            stmt = todo.pop(0)
+            if isinstance(stmt, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                defined.add(stmt.name)
+            elif isinstance(stmt, (ast.Assign, ast.AnnAssign)):
+                for target in (stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]):
+                    if isinstance(target, ast.Name):
+                        defined.add(target.id)
+            elif isinstance(stmt, ast.Import):
+                for symbol in stmt.names:
+                    imported[symbol.asname or symbol.name] = symbol.name
+            elif isinstance(stmt, ast.ImportFrom):
+                base = stmt.module or NIX
+                if stmt.level:
+                    parent = package.split(".")[:len(package.split(".")) - (stmt.level - 1)]
+                    base = ".".join(parent + ([base] if base else []))
+                for symbol in stmt.names:
+                    if symbol.name == "*":
+                        starred.append(base)
+                    else:
+                        imported[symbol.asname or symbol.name] = F"{base}.{symbol.name}"
+            elif isinstance(stmt, (ast.If, ast.Try, ast.With)):
+                todo += stmt.body + getattr(stmt, "orelse", []) + getattr(stmt, "finalbody", [])
+                for handler in getattr(stmt, "handlers", []):
+                    todo += handler.body
+    def resolve(self, module: str, name: str, seen: Optional[Set[Tuple[str, str]]] = None) -> str:
+        """ the module.name defining a name that is visible in the module (or NIX if not in the package) """
+        seen = seen if seen is not None else set()
+        if (module, name) in seen or module not in self.defined:
+            return NIX
+        seen.add((module, name))
+        if name in self.defined[module]:
+            return F"{module}.{name}"
+        if name in self.imported[module]:
+            origin = self.imported[module][name]
+            orig_module, _, orig_name = origin.rpartition(".")
+            return self.resolve(orig_module, orig_name, seen) or origin
+        if not name.startswith("_"):
+            for starmodule in self.starred[module]:
+                found = self.resolve(starmodule, name, seen)
+                if found:
+                    return found
+        return NIX
+    def digest(self) -> str:
+        import hashlib # pylint: disable=import-outside-toplevel
+        tables = (sorted(self.modules.items()), sorted((module, sorted(names)) for module, names in self.defined.items()),
+                  sorted((module, sorted(names.items())) for module, names in self.imported.items()), sorted(self.starred.items()))
+        return hashlib.sha256(repr(tables).encode("utf-8")).hexdigest()
+
 # ............................................................................... MAIN
 
 
 EACH_REMOVE3 = 1
 EACH_APPEND2 = 2
 EACH_INPLACE = 4
-def transformfiles(args: List[str], eachfile: int = 0, outfile: str = "", pyi: str = NIX, stubs: str = NIX, run_python: str = NIX, minversion: Tuple[int, int] = (2,7), nowrite: bool = False) -> int:
-    written: List[str] = []
-    for arg in args:
+
+# with stream the py text is left to ast_unparse_stream of the module
+class TransformedFile(NamedTuple):
+    filename: str
+    py: str
+    pyi: str
+    diagnostics: List[str]
+    cached: bool
+    timings: Tuple[Tuple[str, float, int], ...]
+    module: Optional[ast.Module]
+
+def transform_text(text: str, filename: str = NIX, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False,
+                   symbols: Optional[PackageSymbols] = None, stream: bool = False) -> TransformedFile:
+    """ transforms the python source text to the py text (and the pyi typehints text) without writing anything """
+    del stage_timings.stages[:]
+    if want.timings and not want.no_comments:
+        tree1 = timed("ast.parse", ast.parse, text)
+        tree1 = timed("enrich", ast_enrich, text, tree1)
+    else:
+        tree1 = timed("ast_parse", ast_parse, text)
+    try:
+        transformers = StripPythonTransformer(minversion, filename=filename)
+        tree = transformers.visit(tree1)
+        typedefs = transformers.typedefs
+    except TransformerSyntaxError as e:  # pragma: nocover
+        if e.filename is None:
+            e.filename = filename
+        raise
+    if want.show_dump:
+        logg.log(NOTE, "%s: (before transformations)\n%s", filename, _beautify_dump(ast.dump(tree1)))
+    if want.show_dump > 1:
+        logg.log(NOTE, "%s: (after transformations)\n%s", filename, _beautify_dump(ast.dump(tree)))
+    if stream:
+        done, streamed = NIX, cast(Optional[ast.Module], tree)
+    else:
+        done, streamed = timed("ast_unparse", ast_unparse_text, tree, run_python), None
+    if want.show_dump > 2:
+        logg.log(NOTE, "%s: (after transformations) ---------------- \n%s", filename, done)
+    pyi = NIX
+    if typehints:
+        type_ignores: List[TypeIgnore] = []
+        if isinstance(tree1, ast.Module):
+            type_ignores = tree1.type_ignores
+        typehintsmodule = timed("pyi_module", pyi_module, typedefs, type_ignores)
+        module = symbols.modules.get(filename, NIX) if symbols is not None else NIX
+        typehintsmodule = timed("pyi_copy_imports", pyi_copy_imports, typehintsmodule, tree1, tree, symbols, module)
+        pyi = timed("ast_unparse", ast_unparse, typehintsmodule)
+    return TransformedFile(filename, done, pyi, transformers.diagnostics, False, tuple(stage_timings.stages), streamed)
+
+def transformfile(arg: str, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False,
+                  symbols: Optional[PackageSymbols] = None, stream: bool = False) -> TransformedFile:
+    started = time.perf_counter()
+    if arg in ["-"]:
+        text = sys.stdin.read()
+    else:
         with open(arg, "r", encoding="utf-8") as f:
             text = f.read()
-        tree1 = ast_parse(text)
+    read = (("read", time.perf_counter() - started, 0),) if want.timings else ()
+    if want.cache_dir and not want.show_dump and symbols is None:
+        cache = TransformCache(want.cache_dir)
+        key = cache.key(text, minversion=minversion, run_python=run_python, typehints=typehints)
+        found = cache.load(key)
+        if found is not None:
+            logg.debug("%s: cache hit %s", arg, key)
+            for level, message in found.warnings:
+                logg.log(level, "%s", cache_message(message, found.filename, arg))
+            diagnostics = [cache_message(problem, found.filename, arg) for problem in found.diagnostics]
+            return TransformedFile(arg, found.py, found.pyi, diagnostics, True, read, None)
+        warnings = LogRecorder(logging.WARNING)
+        logg.addHandler(warnings)
         try:
-            transformers = StripPythonTransformer(minversion, filename=arg)
-            tree = transformers.visit(tree1)
-            typedefs = transformers.typedefs
-        except TransformerSyntaxError as e:  # pragma: nocover
-            if e.filename is None:
-                e.filename = arg
-            raise
-        if want.show_dump:
-            logg.log(NOTE, "%s: (before transformations)\n%s", arg, _beautify_dump(ast.dump(tree1)))
-        if want.show_dump > 1:
-            logg.log(NOTE, "%s: (after transformations)\n%s", arg, _beautify_dump(ast.dump(tree)))
-        done = ast_unparse(tree)
-        if want.show_dump > 2:
-            logg.log(NOTE, "%s: (after transformations) ---------------- \n%s", arg, done)
-        if run_python:
-            running = run_python if "/" in run_python else F"/usr/bin/env {run_python}"
-            if done.startswith("#!"):
-                _, done2 = done.split("\n", 1)
-            else:
-                done2 = done
-            done = F"#! {running}\n" + done2
-        if outfile:
-            out = outfile
-        elif arg.endswith("3.py") and eachfile & EACH_REMOVE3:
-            out = arg[:-len("3.py")]+".py"
-        elif arg.endswith(".py") and eachfile & EACH_APPEND2:
-            out = arg[:-len(".py")]+"_2.py"
-        elif eachfile & EACH_INPLACE:
-            out = arg
-        else:
-            out = "-"
-        if out not in written:
-            if out in ["", "."]:
-                pass
-            elif out in ["-"]:
-                if done:
-                    print(done)
-            elif not nowrite:
-                with open(out, "w", encoding="utf-8") as w:
-                    w.write(done)
+            transformed = transform_text(text, arg, minversion=minversion, run_python=run_python, typehints=typehints)
+        finally:
+            logg.removeHandler(warnings)
+        cache.save(key, CacheEntry(transformed.py, transformed.pyi, transformed.diagnostics, warnings.records, arg))
+        return transformed._replace(timings=read + transformed.timings)
+    transformed = transform_text(text, arg, minversion=minversion, run_python=run_python, typehints=typehints, symbols=symbols, stream=stream)
+    return transformed._replace(timings=read + transformed.timings)
+
+def want_settings() -> Dict[str, Union[int, str]]:
+    """ snapshot of the transformer settings - the global 'want' does not exist in a subprocess """
+    return dict((name, getattr(want, name)) for name in dir(Want) if not name.startswith("_"))
+
+def want_settings_update(settings: Dict[str, Union[int, str]]) -> None:
+    for name, value in settings.items():
+        setattr(want, name, value)
+
+WANT_SAME_RESULT = ("timings", "sequential_walks", "check_fused_walks", "syntax_census", "skip_constants")
+
+def want_settings_digest(minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False) -> str:
+    """ hash of everything besides the source text that makes a difference to the transformed result """
+    import hashlib # pylint: disable=import-outside-toplevel
+    settings = dict((name, value) for name, value in want_settings().items() if not name.startswith("cache_") and name not in WANT_SAME_RESULT)
+    effective = repr((__version__, sys.version_info[:2], sorted(settings.items()), minversion, run_python, typehints))
+    return hashlib.sha256(effective.encode("utf-8")).hexdigest()
+
+def cache_dir_default() -> str:
+    cachehome = os.environ.get("XDG_CACHE_HOME", NIX) or fs.expanduser("~/.cache")
+    return fs.join(cachehome, "strip-python3")
+
+class LogRecorder(logging.Handler):
+    """ keeps the (level, message) of the log records while it is added to a logger """
+    def __init__(self, level: int = logging.NOTSET) -> None:
+        logging.Handler.__init__(self, level)
+        self.records: List[Tuple[int, str]] = []
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append((record.levelno, record.getMessage()))
+
+# the warnings are logged again on a cache hit - for the file that has the same source text
+class CacheEntry(NamedTuple):
+    py: str
+    pyi: str
+    diagnostics: List[str]
+    warnings: List[Tuple[int, str]]
+    filename: str
+
+def cache_message(message: str, filename: str, arg: str) -> str:
+    """ the messages of a cache entry start with the name of the file that was transformed """
+    if filename and message.startswith(filename + ":"):
+        return arg + message[len(filename):]
+    return message
+
+class TransformCache:
+    """ content-addressed store of transformed py and pyi texts, evicting the least recently used """
+    sizefile = "size.log" # each save appends the size of its entry, summed up by oversize()
+    def __init__(self, cachedir: str, maxsize: int = 0) -> None:
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+    def key(self, text: str, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False) -> str:
+        import hashlib # pylint: disable=import-outside-toplevel
+        source = hashlib.sha256(text.encode("utf-8"))
+        source.update(want_settings_digest(minversion, run_python, typehints).encode("utf-8"))
+        return source.hexdigest()
+    def path(self, key: str) -> str:
+        return fs.join(self.cachedir, key[:2], key[2:] + ".json")
+    def load(self, key: str) -> Optional[CacheEntry]:
+        import json # pylint: disable=import-outside-toplevel
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path) # the mtime is the last use
+            return CacheEntry(str(entry["py"]), str(entry["pyi"]), [str(problem) for problem in entry["diagnostics"]],
+                              [(int(level), str(message)) for level, message in entry["warnings"]], str(entry["filename"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logg.debug("cache entry %s: %s", path, e)
+            return None
+    def save(self, key: str, entry: CacheEntry) -> None:
+        import json # pylint: disable=import-outside-toplevel
+        path = self.path(key)
+        temp = F"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(fs.dirname(path), exist_ok=True)
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(entry._asdict(), f)
+            replaced = fs.getsize(path) if fs.exists(path) else 0 # a --jobs worker or a broken entry
+            self.count(fs.getsize(temp) - replaced)
+            os.replace(temp, path)
+        except OSError as e:
+            logg.warning("can not write cache entry %s: %s", path, e)
+    def count(self, size: int) -> None:
+        """ a short append is atomic, so the workers of --jobs can all add to the size counter """
+        with open(fs.join(self.cachedir, self.sizefile), "a", encoding="utf-8") as f:
+            f.write(F"{size}\n")
+    def oversize(self) -> bool:
+        """ the size counter is above maxsize - without looking at all the entries """
+        if not self.maxsize:
+            return False
+        try:
+            with open(fs.join(self.cachedir, self.sizefile), "r", encoding="utf-8") as f:
+                return sum(int(line) for line in f if line.strip()) > self.maxsize
+        except (OSError, ValueError) as e:
+            logg.debug("cache size %s: %s", self.cachedir, e)
+            return True # to rebuild it
+    def entries(self) -> List[Tuple[float, int, str]]:
+        found: List[Tuple[float, int, str]] = []
+        if not fs.isdir(self.cachedir):
+            return found
+        for subdir in os.scandir(self.cachedir):
+            if subdir.is_dir() and subdir.name != ConfigCache.subdir: # the config snapshots are not in the size budget
+                for entry in os.scandir(subdir.path):
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+    def evict(self) -> Tuple[int, int, int]:
+        """ remove the least recently used entries above maxsize, returns (entries, size, evicted) """
+        found = self.entries()
+        size = sum(entry[1] for entry in found)
+        evicted = 0
+        if self.maxsize:
+            for _, entrysize, path in sorted(found):
+                if size <= self.maxsize:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entrysize
+                    evicted += 1
+                except OSError as e:
+                    logg.debug("cache entry %s: %s", path, e)
+        if found:
+            sizefile = fs.join(self.cachedir, self.sizefile)
+            try:
+                with open(F"{sizefile}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+                    f.write(F"{size}\n")
+                os.replace(F"{sizefile}.{os.getpid()}.tmp", sizefile)
+            except OSError as e:
+                logg.debug("cache size %s: %s", sizefile, e)
+        return len(found) - evicted, size, evicted
+
+_transformfile_symbols: Optional[PackageSymbols] = None # in the worker processes
+
+def _transformfile_init(settings: Dict[str, Union[int, str]], loglevel: int, symbols: Optional[PackageSymbols] = None) -> None:
+    global _transformfile_symbols # pylint: disable=global-statement
+    want_settings_update(settings)
+    logging.basicConfig(level=loglevel)
+    _transformfile_symbols = symbols
+
+def _transformfile_job(job: Tuple[str, Tuple[int, int], str, bool]) -> TransformedFile:
+    arg, minversion, run_python, typehints = job
+    return transformfile_checked(arg, minversion=minversion, run_python=run_python, typehints=typehints, symbols=_transformfile_symbols)
+
+def transformfile_checked(arg: str, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False,
+                          symbols: Optional[PackageSymbols] = None, stream: bool = False) -> TransformedFile:
+    """ transformfile() with a syntax error as the diagnostic of the file - the same with or without --jobs """
+    try:
+        return transformfile(arg, minversion=minversion, run_python=run_python, typehints=typehints, symbols=symbols, stream=stream)
+    except SyntaxError as e:  # including TransformerSyntaxError
+        filename = e.filename if e.filename not in [None, NIX, "<unknown>"] else arg # ast.parse was not given the name
+        return TransformedFile(arg, NIX, NIX, [F"{filename}:{e.lineno}: {e.msg}"], False, (), None)
+
+def transformfile_out(arg: str, eachfile: int = 0, outfile: str = NIX, outdir: str = NIX, basedir: str = NIX) -> str:
+    """ the name of the transformed py file ("-" for stdout) - with an outdir the tree below the basedir is mirrored """
+    if outfile:
+        return outfile
+    elif outdir:
+        relname = fs.relpath(transformfile_out(arg, eachfile | EACH_INPLACE), basedir or os.curdir)
+        return fs.join(outdir, relname)
+    elif arg.endswith("3.py") and eachfile & EACH_REMOVE3:
+        return arg[:-len("3.py")]+".py"
+    elif arg.endswith(".py") and eachfile & EACH_APPEND2:
+        return arg[:-len(".py")]+"_2.py"
+    elif eachfile & EACH_INPLACE:
+        return arg
+    else:
+        return "-"
+
+def path_patterns(text: str) -> List[str]:
+    return [pattern for pattern in re.split(r"[,\s]+", text) if pattern]
+
+def path_matches(relpath: str, isdir: bool, patterns: List[str]) -> bool:
+    """ gitignore style - a pattern without a slash matches the name at any depth, a pattern
+        with a slash matches the path from the top, and a pattern "dir/" matches only directories """
+    from fnmatch import fnmatchcase # pylint: disable=import-outside-toplevel
+    name = fs.basename(relpath)
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            if not isdir:
+                continue
+            pattern = pattern[:-1]
+        if "/" in pattern:
+            if fnmatchcase(relpath, pattern.lstrip("/")):
+                return True
+        elif fnmatchcase(name, pattern):
+            return True
+    return False
+
+def outdir_outside(arg: str, basedir: str = NIX) -> bool:
+    """ an input file that is not below its basedir can not be mirrored into the outdir """
+    relname = fs.relpath(arg, basedir or os.curdir)
+    return relname == os.pardir or relname.startswith(os.pardir + os.sep)
+
+def scandir_files(topdir: str, include: List[str], exclude: List[str] = []) -> Iterator[str]: # pylint: disable=dangerous-default-value
+    """ the files below the topdir that match an include pattern and no exclude pattern (in sorted order) """
+    subdirs = [NIX]
+    while subdirs:
+        reldir = subdirs.pop()
+        try:
+            with os.scandir(fs.join(topdir, reldir) if reldir else topdir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logg.error("can not scan %s", e)
+            continue
+        found: List[str] = []
+        for entry in entries:
+            relpath = F"{reldir}/{entry.name}" if reldir else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if not path_matches(relpath, True, exclude):
+                    found.append(relpath)
+            elif entry.is_file():
+                if path_matches(relpath, False, include) and not path_matches(relpath, False, exclude):
+                    yield fs.join(topdir, relpath)
+        subdirs.extend(reversed(found))
+
+def typehintsfile_out(out: str, suffix: str) -> str:
+    out_name, _ = os.path.splitext(out)
+    return suffix.replace("*", out_name) if "*" in suffix else out+suffix
+
+def text_hash(text: str) -> str:
+    import hashlib # pylint: disable=import-outside-toplevel
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_hash(filename: str) -> str:
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            return text_hash(f.read())
+    except (OSError, ValueError):
+        return NIX
+
+MANIFEST = ".strip-python3.json"
+
+class TransformManifest:
+    """ the settings digest and the input hash for each output file, to skip the outputs that are current """
+    def __init__(self, filename: str, settings: str) -> None:
+        import json # pylint: disable=import-outside-toplevel
+        self.filename = filename
+        self.settings = settings
+        self.entries: Dict[str, Dict[str, Union[str, Dict[str, str]]]] = {}
+        self.inputs: Dict[str, str] = {}
+        self.changed = False
+        if fs.isfile(filename):
+            try:
+                with open(filename, "r", encoding="utf-8") as f:
+                    self.entries = dict(json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logg.warning("can not read manifest %s: %s", filename, e)
+    def current(self, arg: str, outputs: List[str]) -> bool:
+        """ whether the outputs were made from the same input and settings (and were not changed since) """
+        self.inputs[arg] = inputhash = file_hash(arg)
+        entry = self.entries.get(outputs[0])
+        if not entry or entry.get("settings") != self.settings:
+            return False
+        recorded = cast(Dict[str, str], entry.get("outputs", {}))
+        if inputhash != entry.get("input") and inputhash != recorded.get(arg):
+            return False # with --inplace the input is the output of the last run
+        if sorted(recorded) != sorted(outputs):
+            return False
+        for output in outputs:
+            if file_hash(output) != recorded[output]:
+                return False
+        return True
+    def update(self, arg: str, outputs: Dict[str, str]) -> None:
+        out = next(iter(outputs))
+        inputhash = self.inputs.get(arg) or file_hash(arg)
+        self.entries[out] = {"settings": self.settings, "input": inputhash, "outputs": outputs}
+        self.changed = True
+    def remove(self, out: str) -> None:
+        if out in self.entries:
+            del self.entries[out]
+            self.changed = True
+    def save(self) -> None:
+        import json # pylint: disable=import-outside-toplevel
+        if not self.changed:
+            return
+        temp = F"{self.filename}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp, self.filename)
+        except OSError as e:
+            logg.warning("can not write manifest %s: %s", self.filename, e)
+
+def transformfiles(args: List[str], eachfile: int = 0, outfile: str = "", pyi: str = NIX, stubs: str = NIX, run_python: str = NIX, minversion: Tuple[int, int] = (2,7), nowrite: bool = False,
+                   jobs: int = 0, cache_stats: bool = False, manifest: str = NIX, connect: str = NIX, timings_json: str = NIX,
+                   outdir: str = NIX, basedirs: Optional[Dict[str, str]] = None, symbols: Optional[PackageSymbols] = None) -> int:
+    written: List[str] = []
+    timings: List[Tuple[str, Tuple[Tuple[str, float, int], ...]]] = []
+    errors = 0
+    hits = 0
+    typehints = bool(pyi or stubs)
+    todo = args
+    incremental: Optional[TransformManifest] = None
+    basedirs = basedirs or {}
+    def typehints_out(arg: str, out: str, suffix: str) -> str:
+        if symbols is not None and suffix == stubs and arg in symbols.stubs:
+            return symbols.stubs[arg] # the consolidated *-stubs package
+        return typehintsfile_out(out, suffix)
+    if outdir and not outfile:
+        for arg in args:
+            if arg not in ["-"] and outdir_outside(arg, basedirs.get(arg, NIX)):
+                logg.error("%s: not below %s - can not be mirrored into %s", arg, basedirs.get(arg, NIX) or os.curdir, outdir)
+                errors += 1
+        todo = [arg for arg in args if arg in ["-"] or not outdir_outside(arg, basedirs.get(arg, NIX))]
+    if manifest and (eachfile or outdir) and not outfile and not nowrite:
+        settings = want_settings_digest(minversion, run_python, typehints) + (symbols.digest() if symbols is not None else NIX)
+        incremental = TransformManifest(manifest, settings)
+        candidates, todo = todo, []
+        for arg in candidates:
+            out = transformfile_out(arg, eachfile, NIX, outdir, basedirs.get(arg, NIX))
+            if out not in ["-"]:
+                outfiles = [out] + [typehints_out(arg, out, suffix) for suffix in [pyi, stubs] if suffix]
+                if incremental.current(arg, outfiles):
+                    logg.info("up to date %s", out)
+                    continue
+            todo.append(arg)
+    results: Iterable[TransformedFile]
+    executor = None
+    client = TransformClient(connect) if connect and todo and "-" not in todo and symbols is None else None
+    if client is not None and not client.connect():
+        logg.info("no server on %s - transform in-process", connect)
+        client = None
+    if client is not None:
+        logg.debug("transform %s files on %s", len(todo), connect)
+        results = (client.transformfile(arg, minversion=minversion, run_python=run_python, typehints=typehints) for arg in todo)
+    elif jobs > 1 and len(todo) > 1 and "-" not in todo:
+        from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+        logg.debug("transform %s files in %s jobs", len(todo), min(jobs, len(todo)))
+        executor = ProcessPoolExecutor(min(jobs, len(todo)), initializer=_transformfile_init, initargs=(want_settings(), logging.getLogger().level, symbols))
+        results = executor.map(_transformfile_job, [(arg, minversion, run_python, typehints) for arg in todo])
+    else:
+        stream = not nowrite and not incremental and not want.show_dump # the py text is unparsed into the output file
+        results = (transformfile_checked(arg, minversion=minversion, run_python=run_python, typehints=typehints, symbols=symbols, stream=stream) for arg in todo)
+    try:
+        for transformed in results:
+            arg = transformed.filename
+            if transformed.cached:
+                hits += 1
+            out = transformfile_out(arg, eachfile, outfile, outdir, basedirs.get(arg, NIX))
+            if transformed.diagnostics:
+                for problem in transformed.diagnostics:
+                    logg.error("%s", problem)
+                errors += 1
+                if incremental:
+                    incremental.remove(out)
+                continue
+            done = transformed.py
+            outputs: Dict[str, str] = {}
+            started = time.perf_counter()
+            streamed = 0.0 # the ast_unparse_stream into the output
+            if out not in written:
+                if out in ["", "."]:
+                    pass
+                elif out in ["-"]:
+                    if transformed.module is not None:
+                        UnparseStream(sys.stdout.write, run_python, newline=True).unparse(transformed.module)
+                        streamed = time.perf_counter() - started
+                    elif done:
+                        print(done)
+                elif not nowrite and transformed.module is not None:
+                    if outdir and not os.path.isdir(os.path.dirname(out)):
+                        os.makedirs(os.path.dirname(out))
+                    temp = F"{out}.{os.getpid()}.tmp" # the out file (maybe the source) stays intact when the unparse fails
+                    try:
+                        with open(temp, "w", encoding="utf-8") as w:
+                            UnparseStream(w.write, run_python, newline=True).unparse(transformed.module)
+                        if os.path.exists(out):
+                            os.chmod(temp, os.stat(out).st_mode & 0o7777)
+                        os.replace(temp, out)
+                    except BaseException:
+                        if os.path.exists(temp):
+                            os.remove(temp)
+                        raise
+                    streamed = time.perf_counter() - started
+                    logg.log(NOTE, "written %s", out)
+                    written.append(out)
+                elif not nowrite:
                     if done and not done.endswith("\n"):
-                        w.write("\n")
-                logg.log(NOTE, "written %s", out)
-                written.append(out)
-            if pyi or stubs:
-                type_ignores: List[TypeIgnore] = []
-                if isinstance(tree1, ast.Module):
-                    type_ignores = tree1.type_ignores
-                typehints = pyi_module(typedefs, type_ignores=type_ignores)
-                typehints = pyi_copy_imports(typehints, tree1, tree)
-                done = ast_unparse(typehints)
-                if out in ["", ".", "-"]:
-                    print("## typehints:")
-                    print(done)
-                else:
-                    for suffix in [pyi, stubs]:
-                        if not suffix:
-                            continue
-                        out_name, _ = os.path.splitext(out)
-                        typehintsfile = suffix.replace("*", out_name) if "*" in suffix else out+suffix
-                        logg.debug("typehints: %s", typehintsfile)
-                        typehintsfiledir = os.path.dirname(typehintsfile)
-                        if not os.path.isdir(typehintsfiledir):
-                            os.makedirs(typehintsfiledir)
-                        with open(typehintsfile, "w", encoding="utf-8") as w:
+                        done += "\n"
+                    outputs[out] = text_hash(done)
+                    if incremental and file_hash(out) == outputs[out]:
+                        logg.info("unchanged %s", out)
+                    else:
+                        if outdir and not os.path.isdir(os.path.dirname(out)):
+                            os.makedirs(os.path.dirname(out))
+                        with open(out, "w", encoding="utf-8") as w:
                             w.write(done)
-                            if done and not done.endswith("\n"):
-                                w.write("\n")
-                        logg.log(NOTE, "written %s", typehintsfile)
+                        logg.log(NOTE, "written %s", out)
+                    written.append(out)
+                if typehints:
+                    done = transformed.pyi
+                    if out in ["", ".", "-"]:
+                        print("## typehints:")
+                        print(done)
+                    else:
+                        if done and not done.endswith("\n"):
+                            done += "\n"
+                        for suffix in [pyi, stubs]:
+                            if not suffix:
+                                continue
+                            typehintsfile = typehints_out(arg, out, suffix)
+                            logg.debug("typehints: %s", typehintsfile)
+                            outputs[typehintsfile] = text_hash(done)
+                            if incremental and file_hash(typehintsfile) == outputs[typehintsfile]:
+                                logg.info("unchanged %s", typehintsfile)
+                                continue
+                            typehintsfiledir = os.path.dirname(typehintsfile)
+                            if not os.path.isdir(typehintsfiledir):
+                                os.makedirs(typehintsfiledir)
+                            with open(typehintsfile, "w", encoding="utf-8") as w:
+                                w.write(done)
+                            logg.log(NOTE, "written %s", typehintsfile)
+            if want.timings or timings_json:
+                unparsed = (("ast_unparse_stream", streamed, 0),) if transformed.module is not None else ()
+                timings.append((arg, transformed.timings + unparsed + (("write", time.perf_counter() - started - streamed, 0),)))
+            if incremental and outputs:
+                incremental.update(arg, outputs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if client is not None:
+            client.close()
+        if incremental:
+            incremental.save()
+    if want.cache_dir and not want.show_dump:
+        cache = TransformCache(want.cache_dir, want.cache_size * 1024)
+        if cache_stats or (hits < len(todo) and cache.oversize()):
+            entries, size, evicted = cache.evict()
+            if cache_stats:
+                logg.log(NOTE, "cache %s: %s hits, %s misses, %s evicted, %s entries with %s KB (limit %s KB)",
+                         want.cache_dir, hits, len(todo) - hits, evicted, entries, (size + 1023) // 1024, want.cache_size)
+    if timings:
+        timings_report(timings, timings_json)
+    if errors:
+        logg.error("%s of %s files had errors", errors, len(args))
+        return 1
+    return 0
+
+WATCH_INTERVAL = 0.2 # seconds between looking at the mtimes
+WATCH_DEBOUNCE = 0.05 # seconds without another change before a file is transformed
+
+def watch_stat(filename: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(filename)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return 0, -1
+
+def watch_transform(transform: Callable[[List[str]], int], args: List[str]) -> int:
+    """ a broken file (or one that can not be read) is reported and the watching goes on """
+    try:
+        return transform(args)
+    except SyntaxError as e:  # including TransformerSyntaxError
+        logg.error("%s:%s: %s", e.filename if e.filename not in [None, NIX, "<unknown>"] else " ".join(args), e.lineno, e.msg)
+    except OSError as e:
+        logg.error("%s: %s", " ".join(args), e)
+    return 1
+
+def watchfiles(args: List[str], transform: Callable[[List[str]], int], interval: float = 0., debounce: float = 0.) -> int:
+    """ the --watch mode transforms all files once and then each file again when its mtime has changed """
+    if not args or "-" in args:
+        logg.error("--watch needs input files")
+        return 1
+    watch_transform(transform, args)
+    seen = dict((arg, watch_stat(arg)) for arg in args) # after the transform (as --inplace writes to them)
+    logg.log(NOTE, "watching %s files", len(args))
+    try:
+        while True:
+            time.sleep(interval or WATCH_INTERVAL)
+            changed = [arg for arg in args if watch_stat(arg) != seen[arg]]
+            if not changed:
+                continue
+            while True: # an editor may write the file in multiple steps
+                stats = dict((arg, watch_stat(arg)) for arg in changed)
+                time.sleep(debounce or WATCH_DEBOUNCE)
+                if all(watch_stat(arg) == stats[arg] for arg in changed):
+                    break
+            for arg in changed:
+                if stats[arg][1] < 0:
+                    logg.info("%s: gone", arg)
+                    seen[arg] = stats[arg]
+                    continue
+                started = time.perf_counter()
+                watch_transform(transform, [arg])
+                logg.log(NOTE, "%s: %.1f ms", arg, 1000 * (time.perf_counter() - started))
+                seen[arg] = watch_stat(arg)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def stream_fields(stream: BinaryIO, chunksize: int = 65536) -> Iterator[bytes]:
+    """ the NUL terminated fields of a binary stream as soon as they have come in """
+    parts: List[bytes] = []
+    read: Callable[[int], bytes] = getattr(stream, "read1", stream.read)
+    while True:
+        chunk = read(chunksize)
+        if not chunk:
+            break
+        if b"\0" not in chunk:
+            parts.append(chunk)
+            continue
+        fields = (b"".join(parts) + chunk).split(b"\0")
+        parts = [fields.pop()]
+        yield from fields
+    if b"".join(parts):
+        yield b"".join(parts) # the last field without a NUL
+
+def stream_records(instream: BinaryIO, outstream: BinaryIO, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False) -> int:
+    """ the --stream mode reads path\\0source\\0 records and writes path\\0py\\0pyi\\0 records """
+    errors = 0
+    fields = stream_fields(instream)
+    for path in fields:
+        source = next(fields, None)
+        filename = path.decode("utf-8", "surrogateescape")
+        if source is None:
+            logg.error("%s: no source in the stream", filename)
+            errors += 1
+            break
+        try:
+            transformed = transform_text(source.decode("utf-8"), filename, minversion=minversion, run_python=run_python, typehints=typehints)
+            diagnostics = transformed.diagnostics
+        except SyntaxError as e:  # including TransformerSyntaxError
+            diagnostics = [F"{filename}:{e.lineno}: {e.msg}"]
+        except UnicodeDecodeError as e:
+            diagnostics = [F"{filename}: {e}"]
+        py, pyi = NIX, NIX
+        if diagnostics:
+            for problem in diagnostics:
+                logg.error("%s", problem)
+            errors += 1
+        else:
+            py, pyi = transformed.py, transformed.pyi
+            if py and not py.endswith("\n"):
+                py += "\n"
+            if pyi and not pyi.endswith("\n"):
+                pyi += "\n"
+        outstream.write(path + b"\0" + py.encode("utf-8") + b"\0" + pyi.encode("utf-8") + b"\0")
+        outstream.flush()
+    if errors:
+        logg.error("%s files had errors in the stream", errors)
+        return 1
+    return 0
+
+def timings_report(files: List[Tuple[str, Tuple[Tuple[str, float, int], ...]]], jsonfile: str = NIX) -> None:
+    """ the --timings table for each file and the totals for each stage (or the same as --timings-json) """
+    totals: Dict[str, Tuple[float, int, int]] = OrderedDict()
+    for _, stages in files:
+        for stage, took, nodes in stages:
+            took0, nodes0, count0 = totals.get(stage, (0., 0, 0))
+            totals[stage] = (took0 + took, nodes0 + nodes, count0 + 1)
+    if jsonfile:
+        import json # pylint: disable=import-outside-toplevel
+        report = {"files": [{"filename": filename, "seconds": sum(took for _, took, _ in stages),
+                             "stages": [{"stage": stage, "seconds": took, "nodes": nodes} for stage, took, nodes in stages]}
+                            for filename, stages in files],
+                  "totals": [{"stage": stage, "seconds": took, "nodes": nodes, "count": count} for stage, (took, nodes, count) in totals.items()]}
+        if jsonfile in ["-"]:
+            print(json.dumps(report, indent=1))
+        else:
+            with open(jsonfile, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+            logg.log(NOTE, "written %s", jsonfile)
+    else:
+        lines: List[str] = []
+        for filename, stages in files:
+            lines.append(F"{filename}: {sum(took for _, took, _ in stages):.4f}s")
+            for stage, took, nodes in stages:
+                lines.append(F"  {took:9.4f}s {nodes:8} nodes  {stage}")
+        lines.append(F"total for {len(files)} files: {sum(took for took, _, _ in totals.values()):.4f}s")
+        for stage, (took, nodes, count) in totals.items():
+            lines.append(F"  {took:9.4f}s {count:8}x      {stage}")
+        logg.log(NOTE, "timings:\n%s", "\n".join(lines))
+
+def profiled(filename: str, func: Callable[[List[str]], int]) -> Callable[[List[str]], int]:
+    """ for --profile - the call is run under cProfile and the stats are dumped for pstats """
+    def profiling(args: List[str]) -> int:
+        import cProfile # pylint: disable=import-outside-toplevel
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, args)
+        finally:
+            profiler.dump_stats(filename)
+            logg.log(NOTE, "written %s", filename)
+    return profiling
+
+def transform_request(request: Dict[str, object]) -> Dict[str, object]:
+    """ one request of the --serve mode - {path or source, options} gives {py, pyi, diagnostics} """
+    options = cast(Dict[str, object], request.get("options") or {})
+    minversion = cast(Tuple[int, int], tuple(cast(Iterable[int], options.get("minversion", (2,7)))))
+    run_python = str(options.get("run_python", NIX))
+    typehints = bool(options.get("typehints", False))
+    filename = str(request.get("filename") or request.get("path") or "-")
+    with want_lock:
+        settings = want_settings()
+        try:
+            requested = cast(Dict[str, Union[int, str]], options.get("want") or {})
+            want_settings_update(dict((name, value) for name, value in requested.items() if name in settings))
+            if "source" in request:
+                transformed = transform_text(str(request["source"]), filename, minversion=minversion, run_python=run_python, typehints=typehints)
+            else:
+                transformed = transformfile(str(request["path"]), minversion=minversion, run_python=run_python, typehints=typehints)
+            return {"py": transformed.py, "pyi": transformed.pyi, "diagnostics": transformed.diagnostics}
+        except SyntaxError as e:  # including TransformerSyntaxError
+            if e.filename not in [None, NIX, "<unknown>"]:
+                filename = str(e.filename)
+            return {"py": NIX, "pyi": NIX, "diagnostics": [F"{filename}:{e.lineno}: {e.msg}"]}
+        except OSError as e:
+            return {"py": NIX, "pyi": NIX, "diagnostics": [F"{filename}: {e}"]}
+        finally:
+            want_settings_update(settings)
+
+def serve_lines(lines: Iterable[str], write: Callable[[str], object]) -> None:
+    import json # pylint: disable=import-outside-toplevel
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or ("path" not in request and "source" not in request):
+                raise ValueError("expecting {path or source, options}")
+            reply = transform_request(request)
+        except (ValueError, TypeError) as e:
+            reply = {"py": NIX, "pyi": NIX, "diagnostics": [F"bad request: {e}"]}
+        write(json.dumps(reply) + "\n")
 
+def serve(socketpath: str = NIX) -> int:
+    """ the --serve mode answers json-lines requests on stdin/stdout or on a unix socket """
+    if not socketpath:
+        def write_stdout(text: str) -> None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        serve_lines(sys.stdin, write_stdout)
+        return 0
+    import socketserver # pylint: disable=import-outside-toplevel
+    import signal # pylint: disable=import-outside-toplevel
+    if TransformClient(socketpath).connect():
+        logg.error("already serving on %s", socketpath)
+        return 1
+    if os.path.exists(socketpath):
+        os.remove(socketpath) # left over from a killed server
+    class ServeRequests(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            def write_socket(text: str) -> None:
+                self.wfile.write(text.encode("utf-8"))
+                self.wfile.flush()
+            serve_lines((line.decode("utf-8") for line in self.rfile), write_socket)
+    def terminated(signum: int, frame: object) -> None: # pylint: disable=unused-argument
+        raise SystemExit(0) # to remove the socket below
+    signal.signal(signal.SIGTERM, terminated)
+    with socketserver.ThreadingUnixStreamServer(socketpath, ServeRequests) as server:
+        server.daemon_threads = True # a client that keeps its connection does not block the exit
+        logg.log(NOTE, "serving on %s", socketpath)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socketpath)
     return 0
 
+class TransformClient:
+    """ thin client for a --serve process on a unix socket, falling back to in-process work """
+    def __init__(self, socketpath: str) -> None:
+        self.socketpath = socketpath
+        self.conn: Optional["socket.socket"] = None
+        self.reply: Optional[TextIO] = None
+    def connect(self) -> bool:
+        import socket # pylint: disable=import-outside-toplevel
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socketpath)
+        except OSError:
+            conn.close()
+            return False
+        self.conn = conn
+        self.reply = conn.makefile("r", encoding="utf-8")
+        return True
+    def close(self) -> None:
+        if self.reply is not None:
+            self.reply.close()
+            self.reply = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    def transformfile(self, arg: str, minversion: Tuple[int, int] = (2,7), run_python: str = NIX, typehints: bool = False) -> TransformedFile:
+        import json # pylint: disable=import-outside-toplevel
+        if self.conn is not None and self.reply is not None:
+            options = {"minversion": minversion, "run_python": run_python, "typehints": typehints, "want": want_settings()}
+            try:
+                self.conn.sendall((json.dumps({"path": fs.abspath(arg), "filename": arg, "options": options}) + "\n").encode("utf-8"))
+                reply = json.loads(self.reply.readline())
+                return TransformedFile(arg, str(reply["py"]), str(reply["pyi"]), list(reply["diagnostics"]), False, (), None)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logg.warning("server on %s failed: %s - transform in-process", self.socketpath, e)
+                self.close()
+        return transformfile(arg, minversion=minversion, run_python=run_python, typehints=typehints)
+
+class StripResult(NamedTuple):
+    filename: str
+    py: str
+    pyi: str
+    stubs: str
+    diagnostics: List[str]
+
+want_lock = threading.RLock() # the transformers are reading the global 'want' settings
+
+class StripSession:
+    """ library use of the transformers - the session has the settings from the commandline options
+        (and optional config files) but the global 'want' is only swapped in while transforming, so
+        the transformations of all sessions in all threads are run one at a time on the want_lock """
+    def __init__(self, options: Iterable[str] = (), settings: Optional[Dict[str, Union[int, str]]] = None, config: Iterable[str] = ()) -> None:
+        cmdline = cmdline_parser()
+        if config:
+            cmdline_set_defaults_from(cmdline, Want.toolsection, *config)
+        def bad_options(msg: str) -> None:
+            raise ValueError(msg) # instead of printing the usage and exiting
+        cmdline.error = bad_options # type: ignore[method-assign,assignment]
+        opt, args = cmdline.parse_args(list(options))
+        if args:
+            raise ValueError(F"unexpected arguments {args}")
+        session = Want()
+        self.minversion, no_make_pyi = cmdline_want(opt, session)
+        self.settings = dict((name, getattr(session, name)) for name in dir(Want) if not name.startswith("_"))
+        for name, value in (settings or {}).items():
+            if name not in self.settings:
+                raise ValueError(F"unknown setting {name}")
+            self.settings[name] = value
+        self.run_python = str(self.settings["run_python"])
+        self.typehints = not no_make_pyi
+        self.stubs = self.typehints and bool(opt.make_stubs)
+    def result(self, transformed: TransformedFile) -> StripResult:
+        stubs = transformed.pyi if self.stubs else NIX
+        return StripResult(transformed.filename, transformed.py, transformed.pyi, stubs, transformed.diagnostics)
+    def transform(self, text: str, filename: str, path: str = NIX) -> StripResult:
+        with want_lock:
+            saved = want_settings()
+            try:
+                want_settings_update(self.settings)
+                if path:
+                    transformed = transformfile(path, minversion=self.minversion, run_python=self.run_python, typehints=self.typehints)
+                else:
+                    transformed = transform_text(text, filename, minversion=self.minversion, run_python=self.run_python, typehints=self.typehints)
+                return self.result(transformed)
+            except SyntaxError as e:  # including TransformerSyntaxError
+                return StripResult(filename, NIX, NIX, NIX, [F"{filename or e.filename}:{e.lineno}: {e.msg}"])
+            finally:
+                want_settings_update(saved)
+    def transform_source(self, text: str, filename: str = NIX) -> StripResult:
+        """ transforms the source text without reading or writing any file """
+        return self.transform(text, filename)
+    def transform_file(self, path: str) -> StripResult:
+        """ reads the file (and uses the --cache when configured) but does not write anything """
+        return self.transform(NIX, path, path)
+    def transform_many(self, sources: Iterable[Tuple[str, str]]) -> Iterator[StripResult]:
+        """ transforms (filename, text) pairs, e.g. from a dict.items() """
+        for filename, text in sources:
+            yield self.transform(text, filename)
+
 def _beautify_dump(x: str) -> str:
     return x.replace("body=[", "\n body=[").replace("FunctionDef(", "\n FunctionDef(").replace(", ctx=Load()",",.")
 
+PipelineStage = Union[TreeVisitor, List[DispatchTransformer]] # one walk, or the walks that can be fused into one
+
 class StripPythonTransformer:
     minversion: Tuple[int, int]
-    typedefs: List[ast.stmt]
+    typedefs: List[PyiDef]
+    diagnostics: List[str]
     def __init__(self, minversion: Tuple[int, int] = (2,7), filename: str = NIX):
         self.minversion = minversion
         self.filename = filename
         self.typedefs = []
+        self.diagnostics = []
     def visit(self, tree: ast.AST) -> ast.AST:
+        if want.check_fused_walks:
+            return self.visit_checked(tree)
+        return self.visit_stages(tree, fused=not want.sequential_walks)
+    def visit_checked(self, tree: ast.AST) -> ast.AST:
+        """ run the sequential walks on a copy of the tree and compare the unparsed results """
+        import copy, difflib # pylint: disable=import-outside-toplevel,multiple-imports
+        sequential = StripPythonTransformer(self.minversion, self.filename)
+        tree1 = sequential.visit_sequential(copy.deepcopy(tree))
+        tree2 = self.visit_fused(tree)
+        done1, done2 = ast_unparse(tree1), ast_unparse(tree2)
+        pyi1, pyi2 = ast_unparse(ast.Module(pyi_render(sequential.typedefs), [])), ast_unparse(ast.Module(pyi_render(self.typedefs), []))
+        if done1 == done2 and pyi1 == pyi2:
+            logg.debug("%s: fused walks are the same as sequential walks", self.filename)
+            return tree2
+        for part, text1, text2 in [("py", done1, done2), ("pyi", pyi1, pyi2)]:
+            if text1 != text2:
+                diffs = difflib.unified_diff(text1.splitlines(), text2.splitlines(), "sequential", "fused", lineterm=NIX)
+                logg.warning("%s: fused walks differ in %s\n%s", self.filename, part, "\n".join(diffs))
+        self.diagnostics.append(F"{self.filename}: fused walks are not the same as sequential walks")
+        self.typedefs = sequential.typedefs
+        return tree1
+    def visit_sequential(self, tree: ast.AST) -> ast.AST:
+        return self.visit_stages(tree, fused=False)
+    def visit_fused(self, tree: ast.AST) -> ast.AST:
+        return self.visit_stages(tree, fused=True)
+    def visit_stages(self, tree: ast.AST, fused: bool = True) -> ast.AST:
+        """ run the walks of each stage - fused into one walk over the tree, or else one walk after the other """
+        stages = self.stages(tree, timed("SyntaxCensus", SyntaxCensus, tree))
+        stage = next(stages, None)
+        while stage is not None:
+            if not isinstance(stage, list):
+                tree = visit_timed(stage, tree)
+            elif fused and len(stage) > 1:
+                tree = visit_timed(FusedTransformer(stage), tree)
+            else:
+                for walk in stage:
+                    tree = visit_timed(walk, tree)
+            try:
+                stage = stages.send(tree)
+            except StopIteration:
+                stage = None
+        return tree
+    def stages(self, tree: ast.AST, census: SyntaxCensus) -> Generator[PipelineStage, ast.AST, None]:
+        """ the walks of the transformation in their order - each yield is a stage that gets back the tree
+            after its walks, so that the next stage can depend on the results. A list is the walks of
+            DispatchTransformers that can be fused into one walk (with the same result). """
         typingrequires = RequireImportFrom()
         importrequires = RequireImport()
         importrequiresfrom = RequireImportFrom()
         if want.fstring_from_var_locals_format:
             formatvarlocals = FStringFromVarLocalsFormat()
             formatvarlocals.filename = self.filename
-            tree = formatvarlocals.visit(tree)
+            if census.fires(formatvarlocals):
+                tree = yield formatvarlocals
+        formatting: List[DispatchTransformer] = []
         if want.fstring_from_locals_format:
             formatlocals = FStringFromLocalsFormat()
             formatlocals.filename = self.filename
-            tree = formatlocals.visit(tree)
+            if census.fires(formatlocals):
+                formatting.append(formatlocals)
         if want.replace_fstring:
             fstring = FStringToFormatTransformer()
-            tree = fstring.visit(tree)
-        if want.replace_namedtuple_class:
-            namedtuples = NamedTupleToCollectionsTransformer()
-            tree = namedtuples.visit(tree)
-            importrequiresfrom.append(namedtuples.requiresfrom)
-            self.typedefs.extend(namedtuples.typedefs)
-        if want.replace_typeddict_class:
-            typeddict = TypedDictToDictTransformer()
-            tree = typeddict.visit(tree)
-            importrequiresfrom.append(typeddict.requiresfrom)
-            self.typedefs.extend(typeddict.typedefs)
+            if census.fires(fstring):
+                formatting.append(fstring)
+        namedtuples = NamedTupleToCollectionsTransformer()
+        if want.replace_namedtuple_class and census.fires(namedtuples):
+            formatting.append(namedtuples)
+        typeddict = TypedDictToDictTransformer()
+        if want.replace_typeddict_class and census.fires(typeddict):
+            formatting.append(typeddict)
+        tree = yield formatting
+        importrequiresfrom.append(namedtuples.requiresfrom)
+        self.typedefs.extend(namedtuples.typedefs)
+        importrequiresfrom.append(typeddict.requiresfrom)
+        self.typedefs.extend(typeddict.typedefs)
         extracted = ExtractTypeHints()
-        tree = extracted.visit(tree)
+        tree = yield extracted
         self.typedefs.extend(extracted.typedefs)
+        # the function calls are detected after the typehints are gone (the TypeVar of a Self typehint
+        # is none of the detected calls) and the boilerplate below has no isinstance(x, str) checks
         striphints = StripTypeHints()
-        tree = striphints.visit(tree)
+        calls = DetectImportedFunctionCalls()
+        basetypes = ReplaceIsinstanceBaseType({"str": "basestring"})
+        stripping: List[DispatchTransformer] = [striphints, calls]
+        if want.define_basestring and census.fires(basetypes):
+            stripping.append(basetypes)
+        tree = yield stripping
         typingrequires.importfrom("typing", *striphints.typing)
         typingrequires.removefrom("typing", *striphints.removed)
         if want.replace_self_typing:
             selftypes = ReplaceSelfByTypevar()
-            tree = selftypes.visit(tree)
+            if census.fires(selftypes):
+                tree = yield selftypes
             typingrequires.importfrom("typing", *selftypes.typing)
-        calls = DetectImportedFunctionCalls()
-        calls.visit(tree)
         if want.show_dump:
             logg.log(HINT, "detected module imports:\n%s", "\n".join(calls.imported.keys()))
             logg.log(HINT, "detected function calls:\n%s", "\n".join(calls.found.keys()))
         if want.define_callable:
             if "callable" in calls.found:
-                defs1 = DefineIfPython3(["def callable(x): return hasattr(x, '__call__')"], before=(3,2))
-                tree = defs1.visit(tree)
+                tree = yield DefineIfPython3(["def callable(x): return hasattr(x, '__call__')"], before=(3,2))
+        replacing: List[Optional[ReplaceCallWalks]] = []
         if want.datetime_fromisoformat:
             if "datetime.datetime.fromisoformat" in calls.found:
-                isoformatdef = replace_datetime_fromisoformat(tree, calls)
-                tree = isoformatdef.tree
-                importrequires.append(isoformatdef.requires)
-                importrequiresfrom.remove(isoformatdef.removed)
+                replacing.append(timed("replace_datetime_fromisoformat", replace_datetime_fromisoformat_walks, calls))
         if want.subprocess_run:
             if "subprocess.run" in calls.found:
-                subprocessrundef = replace_subprocess_run(tree, calls, self.minversion)
-                tree = subprocessrundef.tree
-                importrequires.append(subprocessrundef.requires)
-                importrequiresfrom.remove(subprocessrundef.removed)
+                replacing.append(timed("replace_subprocess_run", replace_subprocess_run_walks, calls, self.minversion))
         if want.time_monotonic:
             if "time.monotonic" in calls.found:
-                monotonicdef = replace_time_monotonic(tree, calls)
-                tree = monotonicdef.tree
-                importrequires.append(monotonicdef.requires)
-                importrequiresfrom.remove(monotonicdef.removed)
+                replacing.append(timed("replace_time_monotonic", replace_time_monotonic_walks, calls))
         if want.time_monotonic_ns:
             if "time.monotonic_ns" in calls.found:
-                monotonicdef = replace_time_monotonic_ns(tree, calls)
-                tree = monotonicdef.tree
-                importrequires.append(monotonicdef.requires)
-                importrequiresfrom.remove(monotonicdef.removed)
+                replacing.append(timed("replace_time_monotonic_ns", replace_time_monotonic_ns_walks, calls))
+        replaced = [replace for replace in replacing if replace is not None]
+        dropped: List[Tuple[DetectImportedFunctionCalls, DefineIfPython2]] = []
         if want.import_pathlib2:
             if "pathlib" in calls.imported:
                 logg.log(HINT, "detected pathlib")
                 pathlibname = calls.imported["pathlib"]
                 pathlibdef = DefineIfPython2([F"import pathlib2 as {pathlibname}"], before=(3,3), # ..
                    or_else=[text4("import pathlib") if pathlibname == "pathlib" else text4(F"""import pathlib as {pathlibname}""")])
-                pathlibdrop = DetectImportedFunctionCalls(noimport=["pathlib"])
-                tree = pathlibdef.visit(pathlibdrop.visit(tree))
-                importrequires.append(pathlibdef.requires)
+                dropped.append((DetectImportedFunctionCalls(noimport=["pathlib"]), pathlibdef))
         if want.import_backports_zoneinfo:
             if "zoneinfo" in calls.imported:
                 logg.log(HINT, "detected zoneinfo")
@@ -2424,55 +4162,59 @@ class StripPythonTransformer:
                 as_zoneinfo = F"as {zoneinfoname}" if zoneinfoname != "zoneinfo" else ""
                 zoneinfodef = DefineIfPython2([F"from backports import zoneinfo {as_zoneinfo}"], before=(3,9), # ..
                    or_else=[text4("import zoneinfo") if zoneinfoname == "zoneinfo" else text4(F"""import zoneinfo as {zoneinfoname}""")])
-                zoneinfodrop = DetectImportedFunctionCalls(noimport=["zoneinfo"])
-                tree = zoneinfodef.visit(zoneinfodrop.visit(tree))
-                importrequires.append(zoneinfodef.requires)
+                dropped.append((DetectImportedFunctionCalls(noimport=["zoneinfo"]), zoneinfodef))
         if want.import_toml:
             if "tomllib" in calls.imported:
                 logg.log(HINT, "detected tomllib")
                 tomllibname = calls.imported["tomllib"]
                 tomllibdef = DefineIfPython2([F"import toml as {tomllibname}"], before=(3,11), # ..
                    or_else=[text4("import tomllib") if tomllibname == "tomllib" else text4(F"""import tomllib as {tomllibname}""")])
-                tomllibdrop = DetectImportedFunctionCalls(noimport=["tomllib"])
-                tree = tomllibdef.visit(tomllibdrop.visit(tree))
-                importrequires.append(tomllibdef.requires)
+                dropped.append((DetectImportedFunctionCalls(noimport=["tomllib"]), tomllibdef))
+        # the boilerplate does not use any of the renamed calls or dropped imports, so it is added after their walk
+        renaming: List[DispatchTransformer] = []
+        renaming.extend(replace.rename for replace in replaced)
+        renaming.extend(drop for drop, _ in dropped)
+        tree = yield renaming
+        for replace in replaced:
+            tree = yield replace.define
+            importrequires.append(replace.requires + replace.define.requires)
+            importrequiresfrom.remove(replace.removed)
+        for _, define in dropped:
+            tree = yield define
+            importrequires.append(define.requires)
         if want.define_range:
-            calls = DetectImportedFunctionCalls()
-            calls.visit(tree)
             if "range" in calls.found:
-                defs2 = DefineIfPython2(["range = xrange"])
-                tree = defs2.visit(tree)
+                tree = yield DefineIfPython2(["range = xrange"])
         if want.define_basestring:
-            basetypes = ReplaceIsinstanceBaseType({"str": "basestring"})
-            basetypes.visit(tree)
             if basetypes.replace:
-                defs3 = DefineIfPython3(basetypes.defines)
-                tree = defs3.visit(tree)
+                tree = yield DefineIfPython3(basetypes.defines)
         if want.replace_walrus_operator:
             walrus = WalrusTransformer()
-            tree = walrus.visit(tree)
+            if census.fires(walrus):
+                tree = yield walrus
             whwalrus = WhileWalrusTransformer()
-            tree = whwalrus.visit(tree)
+            if census.fires(whwalrus):
+                tree = yield whwalrus
         futurerequires = RequireImportFrom()
-        if want.define_print_function or want.define_float_division:
-            calls2 = DetectImportedFunctionCalls()
-            calls2.visit(tree)
-            if "print" in calls.found and want.define_print_function:
-                futurerequires.add("__future__.print_function")
-            if calls.divs and want.define_float_division:
-                futurerequires.add("__future__.division")
+        if "print" in calls.found and want.define_print_function:
+            futurerequires.add("__future__.print_function")
+        if calls.divs and want.define_float_division:
+            futurerequires.add("__future__.division")
         if want.define_absolute_import:
-            imps = DetectImportsTransformer()
-            imps.visit(tree)
-            relative = [imp for imp in imps.importfrom if imp.startswith(".")]
+            relative = [imp for imp in calls.importfrom if imp.startswith(".")]
             if relative:
                 futurerequires.add("__future__.absolute_import")
-        tree = importrequiresfrom.visit(tree)
-        tree = importrequires.visit(tree)
-        tree = typingrequires.visit(tree)
-        tree = futurerequires.visit(tree)
+        if importrequiresfrom.require or importrequiresfrom.removes or importrequires.require or typingrequires.require or typingrequires.removes or futurerequires.require:
+            imports = ImportIndex(tree) # one walk for all of them
+            importrequiresfrom.imports = imports
+            importrequires.imports = imports
+            typingrequires.imports = imports
+            futurerequires.imports = imports
+        yield importrequiresfrom
+        yield importrequires
+        yield typingrequires
+        yield futurerequires
         # the __future__ imports must be first, so we add them last (if any)
-        return tree
 
 if __name__ == "__main__":
     sys.exit(main())
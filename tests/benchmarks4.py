@@ -0,0 +1,510 @@
+#! /usr/bin/env python3
+# pylint: disable=missing-module-docstring,missing-class-docstring,missing-function-docstring,line-too-long,too-many-lines,too-many-public-methods
+# pylint: disable=invalid-name,unspecified-encoding,consider-using-with
+""" benchmarks for strip_python3 on generated source files """
+
+__copyright__ = "(C) 2025 Guido Draheim, licensed under MIT License"
+__author__ = "Guido U. Draheim"
+__version__ = "1.3.1287"
+
+from typing import Dict, List, Optional, Tuple, TypeVar, cast, TYPE_CHECKING
+from types import ModuleType
+import sys
+import ast
+import json
+import time
+import unittest
+import logging
+import os.path
+from fnmatch import fnmatchcase as fnmatch
+
+logg = logging.getLogger(os.path.basename(__file__))
+
+if TYPE_CHECKING:
+    from typing import Callable, ParamSpec
+    TypeParams = ParamSpec("TypeParams")
+TypeResult = TypeVar("TypeResult")
+
+sys.path = [os.path.abspath(os.curdir)] + sys.path
+from strip3 import strip_python3 as app # pylint: disable=wrong-import-position,import-error,no-name-in-module
+
+TODO = 0
+VV = "-vv"
+ROUNDS = 3
+SIZES = "1000,10000"
+JSONFILE = ""
+BASELINE = ""
+THRESHOLD = 0.25
+NOISE = 0.002
+
+def pyproject_toml(tables: int) -> str:
+    """ a pyproject.toml with many [tool.*] tables of other tools - and the one for strip-python3 at the end """
+    text: List[str] = []
+    text.append("[project]")
+    text.append('name = "example"')
+    text.append('dependencies = [')
+    text.extend(F'  "package{num} >= 1.{num}",  # for feature {num}' for num in range(20))
+    text.append("]")
+    for num in range(tables):
+        text.append("")
+        text.append(F"[tool.other{num}]")
+        text.append(F'description = """the settings of tool {num}')
+        text.append('[not.a.table]')
+        text.append('"""')
+        text.append(F"line-length = {num}")
+        text.append(F"ratio = {num}.5e-3")
+        text.append(F"enabled = {'true' if num % 2 else 'false'}")
+        text.append(F"released = 2024-01-{num % 28 + 1:02d}T12:00:00Z")
+        text.append("exclude = [")
+        text.append(F'  "build{num}/",')
+        text.append('  ["nested", \'literal\'],')
+        text.append("]")
+        text.append(F'per-file = {{ "a{num}.py" = ["E1", "W2"], b = {{ c = 1 }} }}')
+        text.append(F"[[tool.other{num}.overrides]]")
+        text.append(F'module = "pkg{num}.\\u00e9.*"')
+    text.append("")
+    text.append("[tool.strip-python3]")
+    text.append('python-version = "2.7"')
+    text.append('exclude = [".*/", "build/"]')
+    return "\n".join(text) + "\n"
+
+def typed_module(lines: int) -> str:
+    """ a python3 module with typehints on about every other line """
+    text: List[str] = []
+    text.append("from typing import List, Dict, Optional, cast")
+    text.append("import time")
+    text.append("")
+    num = 0
+    while len(text) < lines:
+        num += 1
+        text.append(F"class Item{num}:")
+        text.append(F"    name: str = 'item{num}'")
+        text.append("    values: List[int] = []")
+        text.append(F"    def __init__(self, name: str, *values: int) -> None:")
+        text.append("        self.name = name")
+        text.append("        self.values = list(values)")
+        text.append(F"    def total(self, start: int = 0, /, *, scale: Optional[float] = None) -> float:")
+        text.append("        result = cast(float, sum(self.values, start))")
+        text.append("        if scale is not None:")
+        text.append("            result = result * scale / len(self.values)")
+        text.append("        return result")
+        text.append(F"    def show(self, prefix: str = '') -> str:")
+        text.append("        return f\"{prefix}{self.name}: {self.total():.2f} {self.values!r}\"")
+        text.append(F"def make_item{num}(names: Dict[str, int], *, default: int = {num}) -> List[Item{num}]:")
+        text.append(F"    items: List[Item{num}] = []")
+        text.append("    for name, value in names.items():")
+        text.append(F"        items.append(Item{num}(name, value, default))")
+        text.append("    return items")
+        text.append("")
+    return "\n".join(text) + "\n"
+
+def commented_module(lines: int) -> str:
+    """ a python3 module with comment lines and inline comments in nested blocks """
+    text: List[str] = []
+    text.append("# generated")
+    num = 0
+    while len(text) < lines:
+        num += 1
+        text.append(F"def check{num}(value: int) -> int:  # function {num}")
+        text.append("    # the value is checked")
+        text.append("    if value > 0:")
+        text.append("        # positive")
+        text.append("        return value  # done")
+        text.append("    # negative")
+        text.append("    return -value")
+        text.append("")
+    return "\n".join(text) + "\n"
+
+def pipeline_module(lines: int) -> str:
+    """ a python3 module with f-strings, walrus, NamedTuple/TypedDict classes, subprocess.run and typehints """
+    text: List[str] = []
+    text.append("from typing import List, Dict, NamedTuple, TypedDict, Optional")
+    text.append("import subprocess")
+    text.append("")
+    num = 0
+    while len(text) < lines:
+        num += 1
+        text.append(F"class Point{num}(NamedTuple):")
+        text.append("    x: int")
+        text.append(F"    y: int = {num}")
+        text.append(F"class Config{num}(TypedDict):")
+        text.append("    name: str")
+        text.append("    size: Optional[int]")
+        text.append(F"def run{num}(cmd: List[str], config: Config{num}) -> str:")
+        text.append(F"    # run the command {num}")
+        text.append("    if (result := subprocess.run(cmd, stdout=subprocess.PIPE)).returncode:")
+        text.append("        return f\"{cmd[0]} failed with {result.returncode}\"")
+        text.append("    lines = result.stdout.splitlines()")
+        text.append("    while (line := lines.pop() if lines else None):")
+        text.append(F"        print(f\"{{config['name']}}: {{line!r:>{num % 10 + 1}}}\")")
+        text.append("    return f\"{config['name']} {len(cmd):d} ok\"")
+        text.append(F"def area{num}(p: Point{num}, *, scale: float = 1.0) -> float:")
+        text.append("    values: Dict[str, int] = {'x': p.x, 'y': p.y}")
+        text.append("    return p.x * p.y * scale / max(1, len(values))  # area")
+        text.append("")
+    return "\n".join(text) + "\n"
+
+def pipeline_timings(text: str, rounds: int = 0) -> Dict[str, float]:
+    """ best of some rounds for each stage of the transformation (with python2.7 settings) """
+    best: Dict[str, float] = {}
+    def timed(name: str, func: "Callable[TypeParams, TypeResult]", *args: "TypeParams.args", **kwargs: "TypeParams.kwargs") -> TypeResult:
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        took = time.perf_counter() - started
+        if name not in best or took < best[name]:
+            best[name] = took
+        return result
+    for _ in range(rounds or ROUNDS):
+        timed("ast_parse_no_comments", ast.parse, text)
+        tree1 = timed("ast_parse", app.parse, text)
+        transformer = app.StripPythonTransformer((2,7))
+        tree = timed("StripPythonTransformer", transformer.visit, tree1)
+        pyi = timed("pyi_module", app.pyi_module, transformer.typedefs)
+        pyi = timed("pyi_copy_imports", app.pyi_copy_imports, pyi, tree1, tree)
+        timed("ast_unparse", app.ast_unparse, tree)
+        timed("ast_unparse_pyi", app.ast_unparse, pyi)
+        # the stages one after another (like visit_sequential) on a fresh tree
+        tree = app.parse(text)
+        tree = timed("FStringToFormatTransformer", app.FStringToFormatTransformer().visit, tree)
+        namedtuples = app.NamedTupleToCollectionsTransformer()
+        tree = timed("NamedTupleToCollectionsTransformer", namedtuples.visit, tree)
+        typeddict = app.TypedDictToDictTransformer()
+        tree = timed("TypedDictToDictTransformer", typeddict.visit, tree)
+        tree = timed("ExtractTypeHints", app.ExtractTypeHints().visit, tree)
+        tree = timed("StripTypeHints", app.StripTypeHints().visit, tree)
+        calls = app.DetectImportedFunctionCalls()
+        tree = timed("DetectImportedFunctionCalls", calls.visit, tree)
+        tree = timed("ReplaceIsinstanceBaseType", app.ReplaceIsinstanceBaseType({"str": "basestring"}).visit, tree)
+        tree = timed("ReplaceSelfByTypevar", app.ReplaceSelfByTypevar().visit, tree)
+        subprocessrundef = timed("replace_subprocess_run", app.replace_subprocess_run, tree, calls, (2,7))
+        tree = timed("WalrusTransformer", app.WalrusTransformer().visit, subprocessrundef.tree)
+        tree = timed("WhileWalrusTransformer", app.WhileWalrusTransformer().visit, tree)
+        importrequiresfrom = app.RequireImportFrom()
+        importrequiresfrom.append(namedtuples.requiresfrom)
+        importrequiresfrom.append(typeddict.requiresfrom)
+        importrequires = app.RequireImport()
+        importrequires.append(subprocessrundef.requires)
+        tree = timed("RequireImportFrom", importrequiresfrom.visit, tree)
+        tree = timed("RequireImport", importrequires.visit, tree)
+    return best
+
+def regressions(results: Dict[str, float], baseline: Dict[str, float], threshold: float = 0.) -> List[Tuple[str, float, float]]:
+    """ the results that are slower than the baseline by more than the threshold (and the noise) """
+    slower: List[Tuple[str, float, float]] = []
+    for name, took in sorted(results.items()):
+        if name in baseline:
+            base = baseline[name]
+            if took > base * (1 + (threshold or THRESHOLD)) and took - base > NOISE:
+                slower.append((name, base, took))
+    return slower
+
+def parse_time(text: str, rounds: int = 0) -> float:
+    """ best of some rounds for ast_comments.parse (tokenize and attach the comments) """
+    best = 0.
+    for _ in range(rounds or ROUNDS):
+        started = time.perf_counter()
+        app.parse(text)
+        took = time.perf_counter() - started
+        if not best or took < best:
+            best = took
+    return best
+
+def want_python27() -> None:
+    for name in ["remove_typehints", "remove_var_typehints", "remove_keywordonly", "remove_positional", "replace_fstring",
+                 "replace_namedtuple_class", "replace_typeddict_class", "replace_walrus_operator", "define_range", "define_basestring",
+                 "define_callable", "define_print_function", "define_float_division", "define_absolute_import",
+                 "datetime_fromisoformat", "subprocess_run", "time_monotonic", "time_monotonic_ns",
+                 "import_pathlib2", "import_backports_zoneinfo", "import_toml", "replace_self_typing"]:
+        setattr(app.want, name, 1)
+
+def transform_time(text: str, rounds: int = 0) -> float:
+    """ best of some rounds for the StripPythonTransformer (without parse and unparse) """
+    best = 0.
+    for _ in range(rounds or ROUNDS):
+        tree = app.ast_parse(text)
+        started = time.perf_counter()
+        app.StripPythonTransformer((2,7)).visit(tree)
+        took = time.perf_counter() - started
+        if not best or took < best:
+            best = took
+    return best
+
+class FormattedNullHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        self.format(record)
+
+class StripBenchmark(unittest.TestCase):
+    def setUp(self) -> None:
+        self.settings = app.want_settings() # want_python27() changes the global settings
+    def tearDown(self) -> None:
+        app.want_settings_update(self.settings)
+    def test_4001(self) -> None:
+        """ the debug messages (with ast.dump) are only formatted when the debug level is on """
+        want_python27()
+        text = typed_module(5000)
+        modulelog = logging.getLogger(app.__name__)
+        formatted = FormattedNullHandler() # message is formatted but not shown
+        oldlevel, oldpropagate = modulelog.level, modulelog.propagate
+        try:
+            modulelog.setLevel(logging.WARNING)
+            lazy = transform_time(text)
+            modulelog.setLevel(logging.DEBUG)
+            modulelog.propagate = False
+            modulelog.addHandler(formatted)
+            eager = transform_time(text)
+        finally:
+            modulelog.removeHandler(formatted)
+            modulelog.setLevel(oldlevel)
+            modulelog.propagate = oldpropagate
+        logg.warning("5000 typed lines: %.3fs without debug, %.3fs with debug messages (%.1fx)", lazy, eager, eager / lazy)
+        self.assertLess(lazy, eager)
+    def test_4002(self) -> None:
+        """ attaching the comments is about linear in the number of lines """
+        small = parse_time(commented_module(2000))
+        large = parse_time(commented_module(16000))
+        logg.warning("2000 commented lines: %.3fs, 16000 commented lines: %.3fs (%.1fx)", small, large, large / small)
+        self.assertLess(large / small, 8 * 2)
+    def test_4003(self) -> None:
+        """ the boilerplate code is parsed once and then copied for each file """
+        want_python27()
+        text = "import subprocess\nimport datetime\nimport time\n" + "\n".join([
+            "def run(x: str) -> str:", "    return subprocess.run([x], stdout=subprocess.PIPE).stdout",
+            "def when(x: str) -> float:", "    return datetime.datetime.fromisoformat(x).timestamp() - time.monotonic()"]) + "\n"
+        files = 200
+        def transform_files(cold: bool) -> float:
+            started = time.perf_counter()
+            for _ in range(files):
+                if cold:
+                    app.boilerplate.templates.clear()
+                app.transform_text(text)
+            return time.perf_counter() - started
+        cold = min(transform_files(True) for _ in range(ROUNDS))
+        warm = min(transform_files(False) for _ in range(ROUNDS))
+        logg.warning("%s small files with boilerplate: %.3fs parsing each time, %.3fs with templates (%.1fx)", files, cold, warm, cold / warm)
+        self.assertLess(warm, cold)
+    def test_4004(self) -> None:
+        """ the stages of the pipeline for 1k/10k/100k lines - with --json and --baseline to see regressions """
+        want_python27()
+        results: Dict[str, float] = {}
+        for size in [int(size) for size in SIZES.split(",") if size]:
+            timings = pipeline_timings(pipeline_module(size))
+            for name, took in timings.items():
+                results[F"{size}/{name}"] = took
+            logg.warning("%s lines: %s", size, ", ".join(F"{name} {took:.3f}s" for name, took in timings.items()))
+        if JSONFILE:
+            if os.path.dirname(JSONFILE) and not os.path.isdir(os.path.dirname(JSONFILE)):
+                os.makedirs(os.path.dirname(JSONFILE))
+            with open(JSONFILE, "w") as f:
+                json.dump({"python": sys.version.split()[0], "version": app.__version__, "rounds": ROUNDS, "results": results}, f, indent=1, sort_keys=True)
+            logg.warning("written %s", JSONFILE)
+        if BASELINE:
+            with open(BASELINE) as f:
+                baseline = json.load(f)["results"]
+            slower = regressions(results, baseline)
+            for name, base, took in slower:
+                logg.error("%s: %.3fs -> %.3fs (%+.0f%%)", name, base, took, 100 * (took - base) / base)
+            self.assertEqual([name for name, _, _ in slower], [], F"slower than {BASELINE} by more than {THRESHOLD:.0%}")
+    def test_4005(self) -> None:
+        """ the regression check ignores small differences and stages missing in the baseline """
+        baseline = {"1000/ast_parse": 0.100, "1000/ast_unparse": 0.001, "1000/StripTypeHints": 0.050}
+        results = {"1000/ast_parse": 0.150, "1000/ast_unparse": 0.002, "1000/StripTypeHints": 0.055, "1000/RequireImport": 0.5}
+        self.assertEqual(regressions(results, baseline, 0.25), [("1000/ast_parse", 0.100, 0.150)])
+    def test_4006(self) -> None:
+        """ the startup time of 'strip-python3 --version' - optparse is loaded lazily and the config not at all """
+        import subprocess # pylint: disable=import-outside-toplevel
+        env = dict(os.environ)
+        env.pop("PYTHONDONTWRITEBYTECODE", None) # the installed script runs from the *.pyc
+        def startup(*args: str) -> float:
+            subprocess.run([sys.executable] + list(args), env=env, stdout=subprocess.PIPE, check=True)
+            best = 0.0
+            for _ in range(ROUNDS * 3):
+                started = time.perf_counter()
+                subprocess.run([sys.executable] + list(args), env=env, stdout=subprocess.PIPE, check=True)
+                took = time.perf_counter() - started
+                best = took if not best or took < best else best
+            return best
+        bare = startup("-c", "pass")
+        version = startup("-m", "strip3.strip_python3", "--version")
+        logg.warning("python startup %.1f ms, strip-python3 --version %.1f ms (+%.1f ms)", bare * 1000, version * 1000, (version - bare) * 1000)
+        check = "import sys; import strip3.strip_python3 as app; print(' '.join(sorted(set(sys.modules) & set(sys.argv[1:]))))"
+        run = subprocess.run([sys.executable, "-c", check, "optparse", "configparser", "tomllib", "difflib", "copy"],
+                             env=env, stdout=subprocess.PIPE, check=True)
+        self.assertEqual(run.stdout.decode().strip(), "")
+    def test_4007(self) -> None:
+        """ the bundled qtoml_decoder (for python 3.9/3.10) against tomllib - and reading only [tool.strip-python3] """
+        from strip3 import qtoml_decoder # pylint: disable=import-outside-toplevel
+        tomllib: Optional[ModuleType] = None
+        try:
+            import tomllib # type: ignore[no-redef] # pylint: disable=import-outside-toplevel
+        except ImportError: # pragma: nocover
+            pass
+        text = pyproject_toml(2000)
+        def best(func: "Callable[TypeParams, TypeResult]", *args: "TypeParams.args", **kwargs: "TypeParams.kwargs") -> Tuple[TypeResult, float]:
+            took = 0.0
+            for _ in range(ROUNDS):
+                started = time.perf_counter()
+                result = func(*args, **kwargs)
+                took = min(took, time.perf_counter() - started) if took else time.perf_counter() - started
+            return result, took
+        full, full_time = best(qtoml_decoder.loads, text)
+        part, part_time = best(qtoml_decoder.loads, text, ("tool", "strip-python3"))
+        self.assertEqual(part, {"tool": {"strip-python3": full["tool"]["strip-python3"]}})
+        self.assertEqual(full["tool"]["other7"]["per-file"], {"a7.py": ["E1", "W2"], "b": {"c": 1}})
+        if tomllib is None: # pragma: nocover
+            logg.warning("%s lines: qtoml_decoder %.3fs, one table %.3fs", text.count("\n"), full_time, part_time)
+            return
+        expect, tomllib_time = best(tomllib.loads, text)
+        self.assertEqual(full, expect)
+        logg.warning("%s lines: tomllib %.3fs, qtoml_decoder %.3fs (%.1fx), one table %.3fs (%.1fx)", text.count("\n"),
+                     tomllib_time, full_time, full_time / tomllib_time, part_time, part_time / tomllib_time)
+        self.assertLess(part_time, full_time)
+    def test_4008(self) -> None:
+        """ the dispatch table of the DispatchTransformer against the getattr() per node of ast.NodeTransformer """
+        class CountCalls:
+            calls = 0
+            def visit_Call(self, node: ast.Call) -> ast.AST:
+                self.calls += 1
+                return cast(ast.AST, self.generic_visit(node)) # type: ignore[attr-defined]
+        class GetattrCalls(CountCalls, ast.NodeTransformer):
+            pass
+        class DispatchCalls(CountCalls, app.DispatchTransformer):
+            pass
+        sample = sum(1 for _ in ast.walk(ast.parse(typed_module(1000))))
+        tree = ast.parse(typed_module(1000 * 50000 // sample))
+        nodes = sum(1 for _ in ast.walk(tree))
+        def best(transformer: ast.NodeVisitor) -> float:
+            took = 0.0
+            for _ in range(ROUNDS):
+                started = time.perf_counter()
+                transformer.visit(tree)
+                took = min(took, time.perf_counter() - started) if took else time.perf_counter() - started
+            return took
+        before, after = GetattrCalls(), DispatchCalls()
+        before_time, after_time = best(before), best(after)
+        self.assertEqual(before.calls, after.calls)
+        logg.warning("%s nodes: %.0f visits/s with getattr, %.0f visits/s with dispatch table (%.1fx)", nodes,
+                     nodes / before_time, nodes / after_time, before_time / after_time)
+        self.assertLess(after_time, before_time)
+    def test_4009(self) -> None:
+        """ a data table in a module is not walked by each transformer pass when its literals are constants only """
+        code = typed_module(200)
+        def data_module(rows: int) -> str:
+            table = "".join(F"    ({num}, 'name{num}', -{num}.5, None),\n" for num in range(rows))
+            return code + "TABLE = [\n" + table + "]\n"
+        settings = app.want_settings()
+        try:
+            times: Dict[Tuple[int, int], float] = {}
+            for rows in [0, 10000, 100000]:
+                text = data_module(rows)
+                for skip in [1, 0]:
+                    app.want.skip_constants = skip
+                    took = 0.0
+                    for _ in range(ROUNDS):
+                        tree = ast.parse(text)
+                        started = time.perf_counter()
+                        app.StripPythonTransformer((2,7)).visit(tree)
+                        took = min(took, time.perf_counter() - started) if took else time.perf_counter() - started
+                    times[rows, skip] = took
+                logg.warning("%s table rows: %.3fs skipping constants, %.3fs walking them (%.1fx)", rows,
+                             times[rows, 1], times[rows, 0], times[rows, 0] / times[rows, 1])
+        finally:
+            app.want_settings_update(settings)
+        self.assertLess(times[10000, 1], times[10000, 0])
+        self.assertLess(times[100000, 1], times[100000, 0])
+        self.assertLess(times[100000, 1] * 3, times[100000, 0])
+    def test_4010(self) -> None:
+        """ the peak memory of writing the py text as one string against the streamed unparse into the file """
+        import tracemalloc # pylint: disable=import-outside-toplevel
+        tree = cast(ast.Module, app.transform_text(typed_module(20000), stream=True).module)
+        def whole() -> None:
+            done = "#! /usr/bin/env python2\n" + app.ast_unparse(tree)
+            if not done.endswith("\n"):
+                done += "\n"
+            with open(os.devnull, "w", encoding="utf-8") as w:
+                w.write(done)
+        def streamed() -> None:
+            with open(os.devnull, "w", encoding="utf-8") as w:
+                app.UnparseStream(w.write, "python2", newline=True).unparse(tree)
+        peaks: Dict[str, int] = {}
+        times: Dict[str, float] = {}
+        for func in [whole, streamed]:
+            tracemalloc.start()
+            func()
+            peaks[func.__name__] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            took = 0.0
+            for _ in range(ROUNDS):
+                started = time.perf_counter()
+                func()
+                took = min(took, time.perf_counter() - started) if took else time.perf_counter() - started
+            times[func.__name__] = took
+        logg.warning("unparse as one string: %.3fs %s KB peak, streamed: %.3fs %s KB peak", times["whole"], peaks["whole"] // 1024,
+                     times["streamed"], peaks["streamed"] // 1024)
+        self.assertLess(peaks["streamed"] * 10, peaks["whole"])
+
+
+if __name__ == "__main__":
+    # unittest.main()
+    from optparse import OptionParser  # pylint: disable=deprecated-module
+    cmdline = OptionParser("%prog [options] test*",
+                      epilog=__doc__.strip().split("\n", 1)[0])
+    cmdline.add_option("-v", "--verbose", action="count", default=0,
+                  help="increase logging level [%default]")
+    cmdline.add_option("-l", "--logfile", metavar="FILE", default="",
+                  help="additionally save the output log to a file [%default]")
+    cmdline.add_option("--todo", action="count", default=TODO,
+                  help="show when an alternative outcome is desired [%default]")
+    cmdline.add_option("--rounds", metavar="N", type="int", default=ROUNDS,
+                  help="best of N runs for each benchmark [%default]")
+    cmdline.add_option("--sizes", metavar="N,M", default=SIZES,
+                  help="lines of the generated modules for test_4004 [%default]")
+    cmdline.add_option("--json", metavar="FILE", default=JSONFILE,
+                  help="write the test_4004 timings to a json file [%default]")
+    cmdline.add_option("--baseline", metavar="FILE", default=BASELINE,
+                  help="fail test_4004 when slower than the json timings there [%default]")
+    cmdline.add_option("--threshold", metavar="X", type="float", default=THRESHOLD,
+                  help="allowed slowdown against the --baseline [%default]")
+    cmdline.add_option("--failfast", action="store_true", default=False,
+                  help="Stop the test run on the first error or failure. [%default]")
+    opt, cmdline_args = cmdline.parse_args()
+    logging.basicConfig(level = logging.WARNING - opt.verbose * 5)
+    TODO = opt.todo
+    ROUNDS = opt.rounds
+    SIZES = opt.sizes
+    JSONFILE = opt.json
+    BASELINE = opt.baseline
+    THRESHOLD = opt.threshold
+    VV = "-v" + ("v" * opt.verbose)
+    logfile = None
+    if opt.logfile:
+        if os.path.exists(opt.logfile):
+            os.remove(opt.logfile)
+        logfile = logging.FileHandler(opt.logfile)
+        logfile.setFormatter(logging.Formatter("%(levelname)s:%(relativeCreated)d:%(message)s"))
+        logging.getLogger().addHandler(logfile)
+        logg.info("log diverted to %s", opt.logfile)
+    #
+    # unittest.main()
+    suite = unittest.TestSuite()
+    if not cmdline_args:
+        cmdline_args = ["test_*"]
+    for arg in cmdline_args:
+        for classname in sorted(globals()):
+            if not classname.endswith("Benchmark"):
+                continue
+            testclass = globals()[classname]
+            for method in sorted(dir(testclass)):
+                if arg.endswith("/"):
+                    arg = arg[:-1]
+                if "*" not in arg:
+                    arg += "*"
+                if len(arg) > 2 and arg[1] == "_":
+                    arg = "test" + arg[1:]
+                if fnmatch(method, arg):
+                    suite.addTest(testclass(method))
+    if not logfile:
+        testresult = unittest.TextTestRunner(verbosity=opt.verbose, failfast=opt.failfast).run(suite)
+    else:
+        testresult = unittest.TextTestRunner(logfile.stream, verbosity=opt.verbose).run(suite) # type: ignore
+    if not testresult.wasSuccessful():
+        sys.exit(1)
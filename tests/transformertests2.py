@@ -18,6 +18,8 @@ import os
 import sys
 import subprocess
 import shutil
+import json
+import pstats
 import datetime
 import time
 import logging
@@ -167,6 +169,14 @@ def file_text(filename: str, delim: str = "^") -> str:
             text = f.read()
             return text.replace("\n", delim)
     return NIX
+def wait_for(filename: str, text: str) -> bool:
+    for _ in range(100):
+        if os.path.exists(filename):
+            with open(filename, encoding="utf-8") as f:
+                if text in f.read():
+                    return True
+        time.sleep(0.05)
+    return False
 
 class ShellResult(NamedTuple):
     returncode: int
@@ -4490,6 +4500,587 @@ class StripTest(unittest.TestCase):
         """)))
         self.coverage()
         self.rm_testdir()
+    def test_2601(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        for name in ["a", "b", "c", "d"]:
+            text_file(F"{tmp}/{name}3.py", F"""
+            from typing import List
+            def func_{name}(x: int) -> List[int]:
+                return [x] * len("{name}")
+            """)
+        run = sh(F"{strip} -3 -j 3 {tmp}/a3.py {tmp}/b3.py {tmp}/c3.py {tmp}/d3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertFalse(run.returncode)
+        for name in ["a", "b", "c", "d"]:
+            py, pyi = file_text4(F"{tmp}/{name}.py"), file_text4(F"{tmp}/{name}.pyi")
+            self.assertEqual(lines4(py), lines4(text4(F"""
+            def func_{name}(x):
+                return [x] * len('{name}')
+            """)))
+            self.assertEqual(lines4(pyi), lines4(text4(F"""
+            from typing import List
+
+            def func_{name}(x: int) -> List[int]:
+                pass
+            """)))
+        written = [line for line in lines4(run.stderr) if "written" in line]
+        self.assertEqual(written, [F"NOTE:strip:written {tmp}/{name}{suffix}" for name in "abcd" for suffix in [".py", ".pyi"]])
+        self.coverage()
+        self.rm_testdir()
+    def test_2602(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        text_file(F"{tmp}/b3.py", """
+        from typing import NamedTuple
+        class B(NamedTuple):
+            x: int
+            def get(self) -> int:
+                return self.x
+        """)
+        text_file(F"{tmp}/c3.py", """
+        def func_c(x: int) -> int:
+            return x
+        """)
+        run = sh(F"{strip} -3 --jobs=2 {tmp}/a3.py {tmp}/b3.py {tmp}/c3.py {vv}", check=False)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(run.returncode)
+        self.assertTrue(greps(run.stderr, "b3.py:4: NamedTuple B - can only replace variable declarations"))
+        self.assertTrue(os.path.exists(F"{tmp}/a.py"))
+        self.assertFalse(os.path.exists(F"{tmp}/b.py"))
+        self.assertTrue(os.path.exists(F"{tmp}/c.py"))
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x:
+        """)
+        for jobs in ["--jobs=2", ""]:
+            os.remove(F"{tmp}/a.py")
+            os.remove(F"{tmp}/c.py")
+            run = sh(F"{strip} -3 {jobs} {tmp}/b3.py {tmp}/a3.py {tmp}/c3.py {vv}", check=False)
+            logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+            self.assertEqual(run.returncode, 1, jobs)
+            self.assertTrue(greps(run.stderr, "b3.py:1: "), jobs)
+            self.assertTrue(greps(run.stderr, "1 of 3 files had errors"), jobs)
+            self.assertFalse(greps(run.stderr, "Traceback"), jobs)
+            self.assertTrue(os.path.exists(F"{tmp}/a.py"), jobs)
+            self.assertFalse(os.path.exists(F"{tmp}/b.py"), jobs)
+            self.assertTrue(os.path.exists(F"{tmp}/c.py"), jobs)
+        self.coverage()
+        self.rm_testdir()
+    def test_2603(self) -> None:
+        vv = self.begin()
+        tmp = self.testdir()
+        strip = coverage(STRIP, tmp)
+        text_file(F"{tmp}/pyproject.toml", """
+        [tool.strip-python3]
+        jobs = 2
+        python-version = "3.6"
+        """)
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x
+        """)
+        run = sh(F"{strip} a3.py b3.py {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertFalse(run.returncode)
+        self.assertEqual(lines4(run.stdout), lines4(text4("""
+        def func_a(x: int) -> int:
+            return x
+        def func_b(x: int) -> int:
+            return x
+        """)))
+        self.coverage()
+        self.rm_testdir()
+    def test_2611(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/test3.py", """
+        from typing import NamedTuple, List, Optional, cast
+        from .sibling import thing
+        import subprocess
+        import time
+        import pathlib
+        class P(NamedTuple):
+            x: int
+        class C:
+            z: int = 1
+            def run(self, n: int = 2, *, k: Optional[str] = None) -> List[int]:
+                print(f"{n} and {k!r}")
+                while (line := input()):
+                    if (m := len(line)) > 3:
+                        print(m / 2)
+                return [cast(int, x) for x in range(n) if isinstance(x, str)]
+        def f(a: int, /, b: str) -> float:
+            r = subprocess.run(["ls", f"{a}"], check=True)
+            return time.monotonic() / len(pathlib.Path(b).name)
+        """)
+        run = sh(F"{strip} --python-version=2.7 --check-fused-walks {tmp}/test3.py -o {tmp}/test.py -y {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertFalse(run.returncode)
+        self.assertFalse(greps(run.stderr, "differ"))
+        run = sh(F"{strip} --python-version=2.7 --sequential-walks {tmp}/test3.py -o {tmp}/test_2.py -y {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        py, py2 = file_text4(F"{tmp}/test.py"), file_text4(F"{tmp}/test_2.py")
+        pyi, pyi2 = file_text4(F"{tmp}/test.pyi"), file_text4(F"{tmp}/test_2.pyi")
+        self.assertEqual(py, py2)
+        self.assertEqual(pyi, pyi2)
+        self.assertTrue(greps(py, "subprocess_run = subprocess.run"))
+        self.assertTrue(greps(py, "from __future__ import absolute_import, division, print_function"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2621(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        for name in ["a", "b"]:
+            text_file(F"{tmp}/{name}3.py", F"""
+            from typing import List
+            def func_{name}(x: int) -> List[int]:
+                return [x] * len("{name}")
+            """)
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache --cache-stats {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "cache .*: 0 hits, 2 misses, 0 evicted, 2 entries"))
+        py1, pyi1 = file_text4(F"{tmp}/a.py"), file_text4(F"{tmp}/a.pyi")
+        os.remove(F"{tmp}/a.py")
+        os.remove(F"{tmp}/a.pyi")
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache --cache-stats {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "cache .*: 2 hits, 0 misses, 0 evicted, 2 entries"))
+        self.assertEqual(file_text4(F"{tmp}/a.py"), py1)
+        self.assertEqual(file_text4(F"{tmp}/a.pyi"), pyi1)
+        self.assertEqual(lines4(py1), lines4(text4("""
+        def func_a(x):
+            return [x] * len('a')
+        """)))
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache --cache-stats --python-version=3.6 {tmp}/a3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "cache .*: 0 hits, 1 misses, 0 evicted, 3 entries"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2622(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        for name in ["a", "b", "c"]:
+            text_file(F"{tmp}/{name}3.py", "\n".join([F"def func_{name}{num}(x: int) -> int:\n    return x + {num}" for num in range(100)]))
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        time.sleep(0.01)
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache --cache-size=20 --cache-stats {tmp}/a3.py {tmp}/c3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "cache .*: 1 hits, 1 misses, 1 evicted, 2 entries"))
+        run = sh(F"{strip} -3 --cache-dir={tmp}/cache --cache-size=20 --cache-stats {tmp}/a3.py {tmp}/b3.py {tmp}/c3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "cache .*: 2 hits, 1 misses"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2631(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        from typing import List
+        def func_a(x: int) -> List[int]:
+            return [x]
+        """)
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x
+        """)
+        manifest = F"{tmp}/manifest.json"
+        run = sh(F"{strip} -3 --manifest={manifest} {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertFalse(os.path.exists(manifest)) # only the path for --incremental
+        for name in ["a.py", "a.pyi", "b.py", "b.pyi"]:
+            os.remove(F"{tmp}/{name}")
+        run = sh(F"{strip} -3 --incremental --manifest={manifest} {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "written .*/b.pyi"))
+        self.assertTrue(os.path.exists(manifest))
+        mtime = os.path.getmtime(F"{tmp}/b.pyi")
+        run = sh(F"{strip} -3 --incremental --manifest={manifest} {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "up to date .*/a.py"))
+        self.assertTrue(greps(run.stderr, "up to date .*/b.py"))
+        self.assertFalse(greps(run.stderr, "written"))
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x + 1
+        """)
+        run = sh(F"{strip} -3 --incremental --manifest={manifest} {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "up to date .*/a.py"))
+        self.assertTrue(greps(run.stderr, "written .*/b.py"))
+        self.assertTrue(greps(run.stderr, "unchanged .*/b.pyi"))
+        self.assertEqual(os.path.getmtime(F"{tmp}/b.pyi"), mtime)
+        self.assertEqual(lines4(file_text4(F"{tmp}/b.py")), lines4(text4("""
+        def func_b(x):
+            return x + 1
+        """)))
+        text_file(F"{tmp}/a.py", "# changed")
+        run = sh(F"{strip} -3 --incremental --manifest={manifest} --python-version=3.6 {tmp}/a3.py {tmp}/b3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "written .*/a.py"))
+        self.assertTrue(greps(run.stderr, "written .*/b.py"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2632(self) -> None:
+        vv = self.begin()
+        tmp = self.testdir()
+        strip = coverage(STRIP, tmp)
+        text_file(F"{tmp}/pyproject.toml", """
+        [tool.strip-python3]
+        incremental = 1
+        """)
+        text_file(F"{tmp}/src/a.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        run = sh(F"{strip} --inplace src/a.py {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "written src/a.py"))
+        self.assertTrue(os.path.exists(F"{tmp}/.strip-python3.json"))
+        run = sh(F"{strip} --inplace src/a.py {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "up to date src/a.py"))
+        self.assertEqual(lines4(file_text4(F"{tmp}/src/a.py")), lines4(text4("""
+        def func_a(x):
+            return x
+        """)))
+        self.coverage()
+        self.rm_testdir()
+    def test_2641(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        requests = [{"path": F"{tmp}/a3.py"},
+                    {"source": "def func_b(x: int) -> int:\n    return x\n", "filename": "b3.py", "options": {"typehints": True}},
+                    {"source": "def func_d(x: int) -> int:\n    return x\n", "options": {"want": {"remove_typehints": 0}}},
+                    {"source": "def func_e(x:", "filename": "e3.py"}]
+        text_file(F"{tmp}/requests.json", "\n".join([json.dumps(request) for request in requests] + ["bad request"]))
+        run = sh(F"{strip} --serve {vv} < {tmp}/requests.json")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        replies = [json.loads(line) for line in lines4(run.stdout)]
+        self.assertEqual(len(replies), 5)
+        self.assertEqual(replies[0], {"py": "def func_a(x):\n    return x", "pyi": "", "diagnostics": []})
+        self.assertEqual(replies[1], {"py": "def func_b(x):\n    return x", "pyi": "def func_b(x: int) -> int:\n    pass", "diagnostics": []})
+        self.assertEqual(replies[2]["py"], "def func_d(x: int) -> int:\n    return x")
+        self.assertTrue(replies[3]["diagnostics"][0].startswith("e3.py:1: "))
+        self.assertTrue(replies[4]["diagnostics"][0].startswith("bad request:"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2642(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        from typing import List
+        def func_a(x: int) -> List[int]:
+            return [x]
+        """)
+        sock = F"{tmp}/strip.sock"
+        server = subprocess.Popen(F"exec {strip} --serve --socket={sock} {vv}", shell=True, stderr=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                if os.path.exists(sock):
+                    break
+                time.sleep(0.05)
+            run = sh(F"{strip} -3 --socket={sock} {tmp}/a3.py {vv} -vv")
+            logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+            self.assertTrue(greps(run.stderr, "transform 1 files on .*strip.sock"))
+            self.assertEqual(lines4(file_text4(F"{tmp}/a.py")), lines4(text4("""
+            def func_a(x):
+                return [x]
+            """)))
+            self.assertEqual(lines4(file_text4(F"{tmp}/a.pyi")), lines4(text4("""
+            from typing import List
+
+            def func_a(x: int) -> List[int]:
+                pass
+            """)))
+        finally:
+            server.terminate()
+            server.wait()
+        self.assertEqual(server.returncode, 0)
+        self.assertFalse(os.path.exists(sock))
+        os.remove(F"{tmp}/a.py")
+        run = sh(F"{strip} -3 --socket={sock} {tmp}/a3.py {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "no server on .*strip.sock"))
+        self.assertTrue(os.path.exists(F"{tmp}/a.py"))
+        run = sh(F"{strip} --serve --socket={sock} {tmp}/a3.py {vv}", check=False)
+        self.assertEqual(run.returncode, 1)
+        self.assertTrue(greps(run.stderr, "--serve takes its files from the requests"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2651(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        import subprocess
+        def func_a(x: str) -> str:
+            return subprocess.run([x]).stdout
+        """)
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x
+        """)
+        run = sh(F"{strip} -3 {tmp}/a3.py {tmp}/b3.py --timings {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertTrue(greps(run.stderr, "^.*a3.py: [0-9.]*s"))
+        self.assertTrue(greps(run.stderr, "^ *[0-9.]*s *[0-9]* nodes  enrich"))
+        self.assertTrue(greps(run.stderr, "^ *[0-9.]*s *[0-9]* nodes  replace_subprocess_run"))
+        self.assertTrue(greps(run.stderr, "^total for 2 files: "))
+        self.assertTrue(greps(run.stderr, "^ *[0-9.]*s *2x *pyi_copy_imports"))
+        self.assertTrue(greps(run.stderr, "^ *[0-9.]*s *2x *write"))
+        run = sh(F"{strip} -3 {tmp}/a3.py {tmp}/b3.py --timings-json={tmp}/timings.json --profile={tmp}/out.pstats {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertFalse(greps(run.stderr, "^total for"))
+        report = json.loads(file_text4(F"{tmp}/timings.json"))
+        self.assertEqual([item["filename"] for item in report["files"]], [F"{tmp}/a3.py", F"{tmp}/b3.py"])
+        stages = [item["stage"] for item in report["files"][0]["stages"]]
+        self.assertEqual(stages[:3], ["read", "ast.parse", "enrich"])
+        self.assertEqual(stages[-4:], ["pyi_copy_imports", "ast_unparse", "ast_unparse_stream", "write"])
+        self.assertIn("replace_subprocess_run", stages)
+        self.assertNotIn("replace_subprocess_run", [item["stage"] for item in report["files"][1]["stages"]])
+        self.assertEqual(dict((item["stage"], item["count"]) for item in report["totals"])["ast_unparse"], 2)
+        self.assertEqual(dict((item["stage"], item["count"]) for item in report["totals"])["ast_unparse_stream"], 2)
+        stats = pstats.Stats(F"{tmp}/out.pstats")
+        self.assertTrue([func for func in stats.stats if func[2] == "transformfiles"]) # type: ignore[attr-defined]
+        self.coverage()
+        self.rm_testdir()
+    def test_2661(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        run = sh(F"cat {tmp}/a3.py | {strip} - {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(lines4(run.stdout), lines4(text4("""
+        def func_a(x):
+            return x
+        """)))
+        run = sh(F"cat {tmp}/a3.py | {strip} -3 - {vv}")
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(lines4(run.stdout), lines4(text4("""
+        def func_a(x):
+            return x
+        ## typehints:
+        def func_a(x: int) -> int:
+            pass
+        """)))
+        self.assertFalse(os.path.exists(F"{tmp}/a.py"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2662(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        records = ["a3.py", "def func_a(x: int) -> int:\n    return x\n", "b3.py", "def func_b(x:", "c3.py", "y: int = 1\n"]
+        text_file(F"{tmp}/records.bin", "".join(record + "\0" for record in records))
+        run = sh(F"{strip} --stream -y {vv} < {tmp}/records.bin", check=False)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(run.returncode, 1)
+        self.assertTrue(greps(run.stderr, "b3.py:1: "))
+        fields = run.stdout.split("\0")
+        self.assertEqual(fields[:3], ["a3.py", "def func_a(x):\n    return x\n", "def func_a(x: int) -> int:\n    pass\n"])
+        self.assertEqual(fields[3:6], ["b3.py", "", ""])
+        self.assertEqual(fields[6:], ["c3.py", "y = 1\n", "y: int\n", ""])
+        run = sh(F"{strip} --stream {vv} < {tmp}/records.bin", check=False)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(run.stdout.split("\0")[:3], ["a3.py", "def func_a(x):\n    return x\n", ""])
+        self.coverage()
+        self.rm_testdir()
+    def test_2663(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text = "import os\nx = " + " + ".join(F"a{num}" for num in range(1500)) + "\ny = 1\n"
+        text_file(F"{tmp}/a3.py", text)
+        run = sh(F"{strip} -1 {tmp}/a3.py {vv} 2>/dev/null", check=False) # a long RecursionError traceback
+        self.assertTrue(run.returncode)
+        self.assertEqual(file_text4(F"{tmp}/a3.py"), text) # not truncated by a failing unparse
+        self.assertEqual(os.listdir(tmp), ["a3.py"])
+        self.coverage()
+        self.rm_testdir()
+    def test_2671(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x: int) -> int:
+            return x
+        """)
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x
+        """)
+        watch = subprocess.Popen(F"exec {strip} -3 --watch {tmp}/a3.py {tmp}/b3.py {vv}", shell=True, stderr=subprocess.PIPE)
+        try:
+            self.assertTrue(wait_for(F"{tmp}/b.py", "def func_b(x):"))
+            os.remove(F"{tmp}/b.py")
+            text_file(F"{tmp}/a3.py", """
+            def func_c(x: int) -> int:
+                return x
+            """)
+            self.assertTrue(wait_for(F"{tmp}/a.py", "def func_c(x):"))
+            self.assertTrue(wait_for(F"{tmp}/a.pyi", "def func_c(x: int) -> int:"))
+        finally:
+            watch.terminate()
+            _, err = watch.communicate()
+        logg.debug("%s %s", strip, errs(err.decode("utf-8")))
+        self.assertTrue(greps(err.decode("utf-8"), "watching 2 files"))
+        self.assertTrue(greps(err.decode("utf-8"), "a3.py: [0-9.]* ms"))
+        self.assertFalse(greps(err.decode("utf-8"), "b3.py: [0-9.]* ms"))
+        self.assertFalse(os.path.exists(F"{tmp}/b.py")) # unchanged b3.py is not transformed again
+        self.coverage()
+        self.rm_testdir()
+    def test_2672(self) -> None:
+        vv = self.begin()
+        strip = coverage(STRIP)
+        tmp = self.testdir()
+        text_file(F"{tmp}/a3.py", """
+        def func_a(x:
+        """)
+        text_file(F"{tmp}/b3.py", """
+        def func_b(x: int) -> int:
+            return x
+        """)
+        watch = subprocess.Popen(F"exec {strip} -3 --watch {tmp}/a3.py {tmp}/b3.py {vv}", shell=True, stderr=subprocess.PIPE)
+        try:
+            self.assertTrue(wait_for(F"{tmp}/b.py", "def func_b(x):"))
+            text_file(F"{tmp}/a3.py", """
+            def func_a(x: int) -> int:
+                return x
+            """)
+            self.assertTrue(wait_for(F"{tmp}/a.py", "def func_a(x):"))
+            text_file(F"{tmp}/b3.py", """
+            def func_b(x: int) -> int
+            """)
+            time.sleep(0.5)
+            text_file(F"{tmp}/b3.py", """
+            def func_c(x: int) -> int:
+                return x
+            """)
+            self.assertTrue(wait_for(F"{tmp}/b.py", "def func_c(x):"))
+            self.assertIsNone(watch.poll())
+        finally:
+            watch.terminate()
+            _, err = watch.communicate()
+        logg.debug("%s %s", strip, errs(err.decode("utf-8")))
+        self.assertTrue(greps(err.decode("utf-8"), "a3.py:1: "))
+        self.assertTrue(greps(err.decode("utf-8"), "b3.py:1: "))
+        self.assertTrue(greps(err.decode("utf-8"), "watching 2 files"))
+        self.assertFalse(greps(err.decode("utf-8"), "Traceback"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2681(self) -> None:
+        vv = self.begin()
+        tmp = self.testdir()
+        strip = coverage(STRIP, tmp)
+        text_file(F"{tmp}/pyproject.toml", """
+        [tool.strip-python3]
+        exclude = [".*/", "build/", "/src/pkg/skip*.py"]
+        """)
+        for name in ["src/top3.py", "src/pkg/a3.py", "src/pkg/sub/b3.py", "src/pkg/skip3.py", "src/pkg/plain.py",
+                     "src/.hidden/c3.py", "src/build/d3.py"]:
+            text_file(F"{tmp}/{name}", """
+            def func_a(x: int) -> int:
+                return x
+            """)
+        run = sh(F"{strip} -3 --recursive src --outdir out {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        found = sorted(F"{dirpath}/{name}"[len(tmp)+1:] for dirpath, _, names in os.walk(F"{tmp}/out") for name in names)
+        self.assertEqual(found, ["out/pkg/a.py", "out/pkg/a.pyi", "out/pkg/skip.py", "out/pkg/skip.pyi",
+                                 "out/pkg/sub/b.py", "out/pkg/sub/b.pyi", "out/top.py", "out/top.pyi"])
+        self.assertEqual(lines4(file_text4(F"{tmp}/out/pkg/sub/b.py")), lines4(text4("""
+        def func_a(x):
+            return x
+        """)))
+        run = sh(F"{strip} --recursive=src/pkg --include='*.py' --exclude='sub/ skip*' --outdir=out2 -n {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        found = sorted(F"{dirpath}/{name}"[len(tmp)+1:] for dirpath, _, names in os.walk(F"{tmp}/out2") for name in names)
+        self.assertEqual(found, ["out2/a3.py", "out2/plain.py"])
+        for name in ["x/a3.py", "y/a3.py"]:
+            text_file(F"{tmp}/{name}", """
+            def func_a(x: int) -> int:
+                return x
+            """)
+        strip2 = coverage(STRIP, F"{tmp}/src")
+        run = sh(F"{strip2} -3 ../x/a3.py ../y/a3.py top3.py --outdir out3 {vv}", cwd=F"{tmp}/src", check=False)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(run.returncode, 1)
+        self.assertTrue(greps(run.stderr, "x/a3.py: not below"))
+        self.assertTrue(greps(run.stderr, "y/a3.py: not below"))
+        found = sorted(F"{dirpath}/{name}"[len(tmp)+1:] for dirpath, _, names in os.walk(F"{tmp}/src/out3") for name in names)
+        self.assertEqual(found, ["src/out3/top.py", "src/out3/top.pyi"])
+        run = sh(F"{strip} -3 --recursive nonexistent --outdir out4 {vv}", cwd=tmp, check=False)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(run.returncode, 1)
+        self.assertTrue(greps(run.stderr, "--recursive nonexistent: not a directory"))
+        self.coverage()
+        self.rm_testdir()
+    def test_2691(self) -> None:
+        vv = self.begin()
+        tmp = self.testdir()
+        strip = coverage(STRIP, tmp)
+        text_file(F"{tmp}/src/mypkg/__init__.py", """
+        from .base import *
+        from .sub.more import Helper as Helper
+        """)
+        text_file(F"{tmp}/src/mypkg/base.py", """
+        class Base:
+            pass
+        """)
+        text_file(F"{tmp}/src/mypkg/sub/__init__.py", "")
+        text_file(F"{tmp}/src/mypkg/sub/more.py", """
+        class Helper:
+            pass
+        """)
+        text_file(F"{tmp}/src/mypkg/user.py", """
+        from mypkg import *
+        def make(x: Base) -> Helper:
+            return Helper()
+        """)
+        run = sh(F"{strip} --recursive src/mypkg --package --outdir out {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        found = sorted(F"{dirpath}/{name}"[len(tmp)+1:] for dirpath, _, names in os.walk(F"{tmp}/out/mypkg-stubs") for name in names)
+        self.assertEqual(found, ["out/mypkg-stubs/__init__.pyi", "out/mypkg-stubs/base.pyi", "out/mypkg-stubs/sub/__init__.pyi",
+                                 "out/mypkg-stubs/sub/more.pyi", "out/mypkg-stubs/user.pyi"])
+        self.assertEqual(lines4(file_text4(F"{tmp}/out/mypkg-stubs/user.pyi")), lines4(text4("""
+        from mypkg.base import Base
+        from mypkg.sub.more import Helper
+
+        def make(x: Base) -> Helper:
+            pass
+        """)))
+        run = sh(F"{strip} --recursive src/mypkg --outdir out2 --stubs {vv}", cwd=tmp)
+        logg.debug("%s %s %s", strip, errs(run.err), outs(run.out))
+        self.assertEqual(lines4(file_text4(F"{tmp}/out2/user-stubs/__init__.pyi")), lines4(text4("""
+        def make(x: Base) -> Helper:
+            pass
+        """)))
+        self.coverage()
+        self.rm_testdir()
 
 
 def summary() -> None:
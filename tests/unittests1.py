@@ -7,8 +7,10 @@ __copyright__ = "(C) 2025 Guido Draheim, licensed under MIT License"
 __author__ = "Guido U. Draheim"
 __version__ = "1.3.1287"
 
-from typing import cast
+from typing import Callable, Dict, List, cast
 import sys
+import threading
+import io
 import unittest
 import logging
 import os.path
@@ -1884,6 +1886,489 @@ class StripUnitTest(unittest.TestCase):
                     return a.b + other[0].b
         """)
         self.assertEqual(want, have)
+    def test_1701(self) -> None:
+        text1 = app.text4("""
+        import subprocess
+        def foo1(a: int) -> str:
+            return f"{a}" + subprocess.run(["ls", f"-l{a}"]).stdout
+        """)
+        tree1 = ast.parse(text1)
+        defs1 = app.FStringToFormatTransformer()
+        defs2 = app.DetectImportedFunctionCalls({"subprocess.run": "subprocess_run"})
+        fused = app.FusedTransformer([defs1, defs2])
+        tree2 = fused.visit(tree1)
+        have = ast.unparse(tree2) + "\n"
+        want = app.text4("""
+        import subprocess
+
+        def foo1(a: int) -> str:
+            return '{}'.format(a) + subprocess_run(['ls', '-l{}'.format(a)]).stdout
+        """)
+        self.assertEqual(want, have)
+        self.assertEqual(list(defs2.found.keys()), ["subprocess.run"])
+    def test_1702(self) -> None:
+        text1 = app.text4("""
+        from typing import List, cast
+        class A:
+            b: List[int] = []
+            def foo1(self, a: int) -> int:
+                return cast(int, len(self.b) / a)
+        """)
+        tree1 = ast.parse(text1)
+        tree2 = ast.parse(text1)
+        defs1 = app.StripTypeHints()
+        defs2 = app.DetectImportedFunctionCalls()
+        tree1 = defs2.visit(defs1.visit(tree1))
+        defs3 = app.StripTypeHints()
+        defs4 = app.DetectImportedFunctionCalls()
+        fused = app.FusedTransformer([defs3, defs4])
+        tree2 = fused.visit(tree2)
+        self.assertEqual(ast.unparse(tree1), ast.unparse(tree2))
+        self.assertEqual(defs2.found, defs4.found)
+        self.assertEqual(defs2.divs, defs4.divs)
+        self.assertEqual(defs1.typing, defs3.typing)
+        self.assertEqual(defs1.removed, defs3.removed)
+    def test_1703(self) -> None:
+        tree1 = ast.parse("x = [1, 2]")
+        dump1 = app.LazyDump(tree1)
+        self.assertEqual(str(dump1), ast.dump(tree1))
+        self.assertEqual(repr([dump1]), "[" + ast.dump(tree1) + "]")
+        tree1.body = []
+        self.assertEqual(str(dump1), ast.dump(ast.Module([], [])))
+    def test_1704(self) -> None:
+        text1 = "# head\nclass A:\n    # c1\n    def f(self):  # c2\n        pass\n        # c3\n    # c4\n# c5\nx = 1  # c6\n"
+        tree1 = app.parse(text1)
+        want1 = "# head\n\nclass A:\n    # c1\n\n    def f(self):  # c2\n        pass\n        # c3\n    # c4\n# c5\nx = 1  # c6"
+        self.assertEqual(app.unparse(tree1), want1)
+        self.assertEqual(tree1.body[1].end_lineno, 7) # type: ignore[attr-defined]
+
+    def test_1705(self) -> None:
+        templates = app.BoilerplateTemplates()
+        body1 = templates.body("def f(x): return x")
+        body2 = templates.body("def f(x): return x")
+        self.assertEqual(len(templates.templates), 1)
+        self.assertIsNot(body1[0], body2[0])
+        self.assertEqual(ast.dump(body1[0], include_attributes=True), ast.dump(body2[0], include_attributes=True))
+        body1[0].name = "g" # type: ignore[attr-defined]
+        self.assertEqual(app.ast_unparse(ast.Module(templates.body("def f(x): return x"), [])), "def f(x):\n    return x")
+        test1 = templates.expr("sys.version_info < (3, 0)")
+        self.assertIsInstance(test1, ast.Compare)
+        self.assertEqual(len(templates.templates), 2)
+
+    def test_1706(self) -> None:
+        tree1 = ast.parse("import os.path as fs\nfrom typing import List, Dict as D\ndef f():\n    from typing import List\n    import sys\n")
+        imports = app.ImportIndex(tree1)
+        detect = app.DetectImportsTransformer()
+        detect.visit(tree1)
+        self.assertEqual(imports.importfrom, detect.importfrom)
+        self.assertEqual(imports.imported, detect.imported)
+        self.assertEqual(imports.importas, detect.importas)
+        self.assertEqual(imports.importfrom, {"typing": {"List": "List", "Dict": "D"}})
+        self.assertEqual(imports.importas["fs"], "os.path")
+        require = app.RequireImportFrom(["typing.Optional"])
+        require.remove(["typing.Dict"])
+        require.imports = imports
+        tree2 = require.visit(tree1)
+        self.assertEqual(imports.importfrom, {"typing": {"List": "List", "Optional": "Optional"}})
+        self.assertNotIn("D", imports.importas)
+        detect = app.DetectImportsTransformer()
+        detect.visit(tree2)
+        self.assertEqual(imports.importfrom, detect.importfrom)
+        self.assertEqual(imports.imported, detect.imported)
+        require2 = app.RequireImportFrom()
+        require2.remove(["typing.List"])
+        require2.imports = imports
+        tree3 = require2.visit(tree2)
+        self.assertEqual(imports.importfrom, {"typing": {"List": "List", "Optional": "Optional"}}) # still in f()
+        self.assertEqual(app.ast_unparse(tree3).splitlines()[:2], ["from typing import Optional", "import os.path as fs"])
+
+    def test_1707(self) -> None:
+        text1 = "def f(a: int, *, b: str = 'x') -> int:\n    return a + len(b)\n"
+        oldsettings = app.want_settings()
+        session27 = app.StripSession(["--make-stubs"])
+        session36 = app.StripSession(["--python-version=3.6", "--no-make-pyi"])
+        result27 = session27.transform_source(text1, "a.py")
+        result36 = session36.transform_source(text1, "a.py")
+        self.assertEqual(result27.py.splitlines()[0], "def f(a, b='x'):")
+        self.assertEqual(result27.pyi.splitlines()[0], "def f(a: int, *, b: str='x') -> int:")
+        self.assertEqual(result27.stubs, result27.pyi)
+        self.assertEqual(result36.py.splitlines()[0], "def f(a: int, *, b: str='x') -> int:")
+        self.assertEqual(result36.pyi, "")
+        self.assertEqual(app.want_settings(), oldsettings)
+        texts = dict((F"m{num}.py", text1.replace("f(", F"f{num}(")) for num in range(20))
+        expected = list(session27.transform_many(texts.items()))
+        results: Dict[str, List[app.StripResult]] = {}
+        def transform_in_thread(name: str, session: app.StripSession) -> None:
+            results[name] = list(session.transform_many(texts.items()))
+        threads = [threading.Thread(target=transform_in_thread, args=(F"t{num}", [session27, session36][num % 2])) for num in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results["t0"], expected)
+        self.assertEqual(results["t2"], expected)
+        self.assertEqual(results["t1"][3].py.splitlines()[0], "def f3(a: int, *, b: str='x') -> int:")
+        broken = session36.transform_source("x = (", "b.py")
+        self.assertEqual(broken.py, "")
+        self.assertTrue(broken.diagnostics[0].startswith("b.py:1: "))
+        with self.assertRaises(ValueError):
+            app.StripSession(["--no-such-option"])
+        with self.assertRaises(ValueError):
+            app.StripSession(settings={"no_such_setting": 1})
+    def test_1708(self) -> None:
+        data = b"a3.py\0def f(): pass\n\0b3.py\0\0c3.py\0x = 1"
+        for chunksize in [1, 2, 3, 5, 7, 64]:
+            self.assertEqual(list(app.stream_fields(io.BytesIO(data), chunksize)), [b"a3.py", b"def f(): pass\n", b"b3.py", b"", b"c3.py", b"x = 1"])
+        self.assertEqual(list(app.stream_fields(io.BytesIO(b""))), [])
+        output = io.BytesIO()
+        self.assertEqual(app.stream_records(io.BytesIO(b"a3.py\0x: int = 1\0"), output, typehints=True), 0)
+        self.assertEqual(output.getvalue(), b"a3.py\0x: int = 1\n\0x: int\n\0") # want defaults
+    def test_1709(self) -> None:
+        self.assertEqual(app.path_patterns(".*/, __pycache__/ build"), [".*/", "__pycache__/", "build"])
+        self.assertTrue(app.path_matches("src/a3.py", False, ["*3.py"]))
+        self.assertFalse(app.path_matches("src/a.py", False, ["*3.py"]))
+        self.assertTrue(app.path_matches("src/.git", True, [".*/"]))
+        self.assertFalse(app.path_matches("src/.gitignore", False, [".*/"]))
+        self.assertTrue(app.path_matches("src/pkg/a3.py", False, ["/src/pkg/*.py"]))
+        self.assertFalse(app.path_matches("lib/src/pkg/a3.py", False, ["/src/pkg/*.py"]))
+        self.assertEqual(app.transformfile_out("src/pkg/a3.py", app.EACH_REMOVE3, outdir="out", basedir="src"), "out/pkg/a.py")
+        self.assertEqual(app.transformfile_out("src/pkg/a3.py", 0, outdir="out", basedir="src"), "out/pkg/a3.py")
+        self.assertEqual(app.transformfile_out("a3.py", app.EACH_APPEND2, outdir="out"), "out/a3_2.py")
+        self.assertTrue(app.outdir_outside("../a3.py"))
+        self.assertTrue(app.outdir_outside("src/a3.py", "src/pkg"))
+        self.assertFalse(app.outdir_outside("src/pkg/a3.py", "src"))
+        self.assertFalse(app.outdir_outside("..a3.py"))
+    def test_1710(self) -> None:
+        symbols = app.PackageSymbols()
+        symbols.scan("pkg", ast.parse("from .base import *\nfrom .sub.more import Helper as Helper\nimport os"), ispackage=True)
+        symbols.scan("pkg.base", ast.parse("class Base: pass\n_hidden = 1"))
+        symbols.scan("pkg.sub.more", ast.parse("try:\n    from typing import List\nexcept ImportError: pass\nclass Helper: pass"))
+        symbols.scan("pkg.user", ast.parse("from pkg import *\nfrom ..other import Thing"))
+        self.assertEqual(symbols.resolve("pkg.user", "Base"), "pkg.base.Base")
+        self.assertEqual(symbols.resolve("pkg.user", "Helper"), "pkg.sub.more.Helper")
+        self.assertEqual(symbols.resolve("pkg.user", "_hidden"), "")
+        self.assertEqual(symbols.resolve("pkg.user", "Thing"), "other.Thing")
+        self.assertEqual(symbols.resolve("pkg.sub.more", "List"), "typing.List")
+        self.assertEqual(symbols.resolve("pkg", "os"), "os")
+        self.assertEqual(symbols.resolve("pkg.user", "Unknown"), "")
+        self.assertEqual(symbols.resolve("elsewhere", "Base"), "")
+    def test_1711(self) -> None:
+        tree = ast.parse(app.text4("""
+        from typing import List
+        x: list[int] = []
+        @staticmethod
+        def f(a: int, /, b: "str" = "b", *args: int, c: int = 1, d: list[int], **kw: str) -> List[int]:
+            return [a]
+        class A(object, metaclass=type):
+            y: dict[str, int]
+            def g(self, z) -> int:
+                return 1
+            def h(self, z):
+                return 2
+        """))
+        extracted = app.ExtractTypeHints()
+        extracted.visit(tree)
+        self.assertEqual([record.kind for record in extracted.typedefs], ["import", "var", "def", "class"])
+        self.assertEqual([record.name for record in extracted.typedefs[3].body], ["y", "g"])
+        pyi1 = app.ast_unparse(app.pyi_module(extracted.typedefs))
+        for node in ast.walk(tree): # the records do not share nodes with the tree
+            if isinstance(node, ast.Name):
+                node.id = "changed"
+        pyi2 = app.ast_unparse(app.pyi_module(extracted.typedefs))
+        self.assertEqual(pyi1, pyi2)
+        self.assertEqual(pyi2, app.text4("""
+        from typing import List
+        x: list[int]
+
+        @staticmethod
+        def f(a: int, /, b: 'str'='b', *args: int, c: int=1, d: list[int], **kw: str) -> List[int]:
+            pass
+
+        class A(object, metaclass=type):
+            y: dict[str, int]
+
+            def g(self, z) -> int:
+                pass""").rstrip())
+    def test_1712(self) -> None:
+        import tempfile # pylint: disable=import-outside-toplevel
+        with tempfile.TemporaryDirectory() as tmp:
+            configfile = os.path.join(tmp, "pyproject.toml")
+            with open(configfile, "w", encoding="utf-8") as f:
+                f.write("[tool.strip-python3]\npython-version = '3.6'\n")
+            section1 = app.config_section(configfile, "strip-python3")
+            self.assertEqual(section1, {"python-version": "3.6"})
+            self.assertIs(app.config_section(configfile, "strip-python3"), section1) # the snapshot
+            with open(configfile, "w", encoding="utf-8") as f:
+                f.write("[tool.strip-python3]\npython-version = '2.7'\nremove3 = 1\n")
+            os.utime(configfile, ns=(0, 0))
+            self.assertEqual(app.config_section(configfile, "strip-python3"), {"python-version": "2.7", "remove3": 1})
+            self.assertEqual(app.config_section(configfile, "other"), None)
+            configfile = os.path.join(tmp, "setup.cfg")
+            with open(configfile, "w", encoding="utf-8") as f:
+                f.write("[strip-python3]\npython-version = 3.6\n")
+            self.assertEqual(app.config_section(configfile, "strip-python3"), {"python-version": "3.6"})
+            self.assertEqual(app.config_section(os.path.join(tmp, "missing.toml"), "strip-python3"), None)
+    def test_1713(self) -> None:
+        import tempfile # pylint: disable=import-outside-toplevel
+        settings = app.want_settings()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                configfile = os.path.join(tmp, "pyproject.toml")
+                with open(configfile, "w", encoding="utf-8") as f:
+                    f.write("[tool.strip-python3]\npython-version = '3.6'\n")
+                app.want.cache_dir = os.path.join(tmp, "cache")
+                app.want.cache_config = 2
+                with self.assertLogs(app.logg, "WARNING") as logs:
+                    app.config_snapshots.clear()
+                    self.assertEqual(app.config_section(configfile, "strip-python3"), {"python-version": "3.6"})
+                    app.config_snapshots.clear()
+                    self.assertEqual(app.config_section(configfile, "strip-python3"), {"python-version": "3.6"})
+                    with open(configfile, "w", encoding="utf-8") as f:
+                        f.write("[tool.strip-python3]\npython-version = '2.7'\n")
+                    os.utime(configfile, ns=(0, 0))
+                    app.config_snapshots.clear()
+                    self.assertEqual(app.config_section(configfile, "strip-python3"), {"python-version": "2.7"})
+                self.assertEqual([message.split(":")[-2] for message in logs.output],
+                                 ["config cache miss", "config cache hit", "config cache miss"])
+                self.assertEqual(len(os.listdir(os.path.join(tmp, "cache", "config"))), 1)
+                self.assertEqual(app.TransformCache(app.want.cache_dir, 1).evict(), (0, 0, 0))
+                self.assertEqual(len(os.listdir(os.path.join(tmp, "cache", "config"))), 1)
+        finally:
+            app.want_settings_update(settings)
+            app.config_snapshots.clear()
+    def test_1714(self) -> None:
+        text1 = app.text4("""
+        from typing import NamedTuple as NT
+        def foo1(a, /, b, *, c=1):
+            print("{c}".format(**locals()))
+            return typing.Self
+        """)
+        census = app.SyntaxCensus(ast.parse(text1))
+        self.assertTrue(census.present("NamedTuple", "Self", "posonlyargs", "kwonlyargs"))
+        self.assertFalse(census.present("JoinedStr", "NamedExpr", "isinstance"))
+        self.assertFalse(census.fires(app.FStringToFormatTransformer()))
+        self.assertTrue(census.fires(app.FStringFromLocalsFormat())) # produces JoinedStr
+        self.assertTrue(census.fires(app.FStringToFormatTransformer()))
+        self.assertTrue(census.fires(app.StripTypeHints())) # no triggers
+        settings = app.want_settings()
+        try:
+            app.want.replace_fstring = 1
+            app.want.replace_walrus_operator = 1
+            app.want.define_basestring = 1
+            app.want.timings = 1
+            for text, skipped in [("x = 1\n", ["FStringToFormatTransformer", "WalrusTransformer", "ReplaceIsinstanceBaseType"]),
+                                  ("x = f'{y}'\nif (z := x):\n    pass\n", ["ReplaceIsinstanceBaseType"])]:
+                del app.stage_timings.stages[:]
+                done = app.StripPythonTransformer().visit(ast.parse(text))
+                stages = "+".join(stage for stage, _, _ in app.stage_timings.stages).split("+")
+                for transformer in ["FStringToFormatTransformer", "WalrusTransformer", "ReplaceIsinstanceBaseType"]:
+                    self.assertEqual(transformer in stages, transformer not in skipped)
+                app.want.syntax_census = 0
+                self.assertEqual(ast.unparse(app.StripPythonTransformer().visit(ast.parse(text))), ast.unparse(done))
+                app.want.syntax_census = 1
+        finally:
+            app.want_settings_update(settings)
+            del app.stage_timings.stages[:]
+    def test_1715(self) -> None:
+        """ the walks of the transformers have no recursion limit (the tree is built as ast.parse needs a higher limit) """
+        loc: Dict[str, int] = dict(lineno=1, col_offset=0, end_lineno=1, end_col_offset=1)
+        depth = 100000
+        chains: Dict[str, Callable[[ast.expr], ast.expr]] = {
+            "binop": lambda expr: ast.BinOp(expr, ast.Add(), ast.Constant("s", None, **loc), **loc),
+            "attribute": lambda expr: ast.Attribute(expr, "b", ast.Load(), **loc),
+            "dict": lambda expr: ast.Dict([ast.Constant("k", None, **loc)], [expr], **loc),
+            "call": lambda expr: ast.Call(ast.Name("f", ast.Load(), **loc), [expr], [], **loc),
+        }
+        class CountNames(app.DispatchVisitor):
+            names = 0
+            def visit_Name(self, node: ast.Name) -> None:
+                self.names += 1
+        settings = app.want_settings()
+        try:
+            app.want.replace_fstring = 1
+            app.want.define_basestring = 1
+            for sequential in [0, 1]:
+                app.want.sequential_walks = sequential
+                for name, chain in chains.items():
+                    if sequential and name != "call":
+                        continue # the visit_Call methods would have been a recursion
+                    expr: ast.expr = ast.Name("a", ast.Load(), **loc)
+                    for _ in range(depth):
+                        expr = chain(expr)
+                    tree = ast.Module([ast.Assign([ast.Name("x", ast.Store(), **loc)], expr, None, **loc)], [])
+                    done = app.StripPythonTransformer((2,7)).visit(tree)
+                    counts = CountNames()
+                    counts.visit(done)
+                    self.assertEqual(counts.names, (depth if name == "call" else 0) + 2, F"{name} sequential={sequential}")
+        finally:
+            app.want_settings_update(settings)
+        text = "x = (" + " + ".join(["a"] * depth) + ")  # sum\n"
+        limit = sys.getrecursionlimit()
+        try:
+            sys.setrecursionlimit(depth * 2)
+            tree1 = ast.parse(text)
+        finally:
+            sys.setrecursionlimit(limit)
+        app.ast_enrich(text, tree1)
+        self.assertEqual([type(stmt).__name__ for stmt in tree1.body], ["Assign", "Comment"])
+    def test_1716(self) -> None:
+        """ the literals of constants only are not descended by the walks that have no use for them """
+        tree = ast.parse("x = [1, (2, -3.5), {'a': [None]}, {1, 2}]\ny = [1, (2, z), {**w}, -b]\n")
+        value1 = cast(ast.List, cast(ast.Assign, tree.body[0]).value)
+        value2 = cast(ast.List, cast(ast.Assign, tree.body[1]).value)
+        self.assertTrue(app.constant_only(value1))
+        self.assertEqual([app.constant_only(elem) for elem in value1.elts], [True, True, True, True])
+        self.assertFalse(app.constant_only(value2))
+        self.assertEqual([app.constant_only(elem) for elem in value2.elts], [True, False, False, False])
+        class CountConstants(app.DispatchVisitor):
+            constants = 0
+            def visit_Constant(self, node: ast.Constant) -> None:
+                self.constants += 1
+        class CountNames(app.DispatchVisitor):
+            names = 0
+            def visit_Name(self, node: ast.Name) -> None:
+                self.names += 1
+        self.assertFalse(CountConstants.skip_constants)
+        self.assertTrue(CountNames.skip_constants)
+        constants, names = CountConstants(), CountNames()
+        constants.visit(tree)
+        names.visit(tree)
+        self.assertEqual(constants.constants, 7 + 2)
+        self.assertEqual(names.names, 5)
+        text = "TABLE = [(1, 'a', -1.5), (2, F'{x}', None)]\nx = isinstance(y, str)\n"
+        settings = app.want_settings()
+        try:
+            app.want.replace_fstring = 1
+            app.want.define_basestring = 1
+            done: Dict[int, str] = {}
+            for skip in [1, 0]:
+                app.want.skip_constants = skip
+                done[skip] = ast.unparse(app.StripPythonTransformer((2,7)).visit(ast.parse(text)))
+            self.assertEqual(done[1], done[0])
+            self.assertIn("'{}'.format(x)", done[1])
+            self.assertIn("basestring", done[1])
+        finally:
+            app.want_settings_update(settings)
+    def test_1717(self) -> None:
+        """ the streamed unparse gives the same text in chunks of the top-level statements """
+        text = '#! /usr/bin/python3\n""" doc """\nimport os # inline\n@dec\ndef f(x):\n    if x:\n        return 1\n    # comment\n    return 2\nclass A:\n    pass\n# end\n'
+        settings = app.want_settings()
+        try:
+            for bare in [0, 1]:
+                app.want.no_unparser = bare
+                tree = app.ast_parse(text)
+                chunks: List[str] = []
+                app.ast_unparse_stream(tree, chunks.append)
+                self.assertEqual("".join(chunks), app.ast_unparse(tree))
+                self.assertGreater(len(chunks), 3)
+                self.assertIn("\nclass A:\n    pass", chunks)
+        finally:
+            app.want_settings_update(settings)
+        tree = app.ast_parse(text)
+        self.assertEqual(app.ast_unparse_text(tree), app.ast_unparse(tree))
+        done = app.ast_unparse(tree)
+        if done.startswith("#!"):
+            done = done.split("\n", 1)[1]
+        self.assertEqual(app.ast_unparse_text(tree, "python2"), "#! /usr/bin/env python2\n" + done)
+        self.assertEqual(app.ast_unparse_text(app.ast_parse("x = 1"), "/bin/python"), "#! /bin/python\nx = 1")
+        self.assertEqual(app.ast_unparse_text(app.ast_parse(""), "python2"), "#! /usr/bin/env python2\n")
+        written: List[str] = []
+        stream = app.UnparseStream(written.append, newline=True)
+        self.assertEqual(stream.unparse(app.ast_parse("x = 1\ny = 2")), len("x = 1\ny = 2\n"))
+        self.assertEqual("".join(written), "x = 1\ny = 2\n")
+        written = []
+        self.assertEqual(app.UnparseStream(written.append, newline=True).unparse(app.ast_parse("")), 0)
+        self.assertEqual(written, [])
+    def test_1718(self) -> None:
+        """ the --watch mode goes on after a transform has failed """
+        def broken(args: List[str]) -> int:
+            raise app.TransformerSyntaxError("bad", (args[0], 3, 0, ""))
+        def missing(args: List[str]) -> int:
+            raise FileNotFoundError(2, "no such file", args[0])
+        with self.assertLogs(app.logg, "ERROR") as logs:
+            self.assertEqual(app.watch_transform(broken, ["a3.py"]), 1)
+            self.assertEqual(app.watch_transform(missing, ["b3.py"]), 1)
+        self.assertEqual(logs.output[0], "ERROR:%s:a3.py:3: bad" % app.logg.name)
+        self.assertIn("b3.py", logs.output[1])
+        self.assertEqual(app.watch_transform(lambda args: 0, ["c3.py"]), 0)
+    def test_1719(self) -> None:
+        """ a cache hit has the diagnostics and warnings (of its own file), and eviction looks at the size counter """
+        import tempfile # pylint: disable=import-outside-toplevel
+        settings = app.want_settings()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                text = "a = 1\nx = '{a}'\nprint(x.format(**locals()))\nprint(x)\n"
+                for name in ["x3.py", "y3.py"]:
+                    with open(os.path.join(tmp, name), "w", encoding="utf-8") as f:
+                        f.write(text)
+                app.want.fstring_from_var_locals_format = 1
+                app.want.cache_dir = os.path.join(tmp, "cache")
+                cache = app.TransformCache(app.want.cache_dir, 1000)
+                with self.assertLogs(app.logg, "WARNING") as logs:
+                    self.assertFalse(app.transformfile(os.path.join(tmp, "x3.py")).cached)
+                    self.assertTrue(app.transformfile(os.path.join(tmp, "y3.py")).cached)
+                self.assertEqual([message.split(": can not")[0] for message in logs.output],
+                                 ["WARNING:%s:%s/x3.py:2" % (app.logg.name, tmp), "WARNING:%s:%s/y3.py:2" % (app.logg.name, tmp)])
+                self.assertFalse(cache.oversize())
+                key = cache.key(text)
+                found = cache.load(key)
+                assert found is not None
+                cache.save(key, found._replace(diagnostics=[F"{found.filename}:1: bad"]))
+                cache.save(key, found._replace(diagnostics=[F"{found.filename}:1: bad"])) # replacing the entry
+                with open(os.path.join(app.want.cache_dir, cache.sizefile), encoding="utf-8") as f:
+                    self.assertEqual(sum(int(line) for line in f), os.path.getsize(cache.path(key)))
+                with self.assertLogs(app.logg, "WARNING"):
+                    transformed = app.transformfile(os.path.join(tmp, "y3.py"))
+                self.assertTrue(transformed.cached)
+                self.assertEqual(transformed.diagnostics, [F"{tmp}/y3.py:1: bad"])
+                app.want.sequential_walks = 1 # the same result
+                app.want.check_fused_walks = 1
+                self.assertEqual(cache.key(text), key)
+                self.assertFalse(cache.oversize())
+                cache.save(cache.key("y" * 1000), app.CacheEntry("y" * 1000, "", [], [], "z3.py"))
+                self.assertTrue(cache.oversize())
+                self.assertEqual(cache.evict(), (0, 0, 2))
+                self.assertFalse(cache.oversize())
+        finally:
+            app.want_settings_update(settings)
+    def test_1720(self) -> None:
+        """ the --timings of a transformation in another thread are not mixed into this one """
+        settings = app.want_settings()
+        try:
+            app.want.timings = 1
+            app.transform_text("x = 1\n", "a3.py")
+            stages = list(app.stage_timings.stages)
+            other = threading.Thread(target=app.transform_text, args=("def f(x: int) -> int:\n    return x\n", "b3.py"))
+            other.start()
+            other.join()
+            self.assertEqual(app.stage_timings.stages, stages)
+        finally:
+            app.want_settings_update(settings)
+            del app.stage_timings.stages[:]
+    def test_1721(self) -> None:
+        """ a --recursive directory is scanned once - the commandline is parsed again after reading the config """
+        import tempfile # pylint: disable=import-outside-toplevel
+        settings = app.want_settings()
+        transformfiles = app.transformfiles
+        argv = sys.argv
+        handed: List[List[str]] = []
+        def transformed(args: List[str], **kwargs: object) -> int:
+            handed.append(list(args))
+            return 0
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                os.makedirs(os.path.join(tmp, "d"))
+                with open(os.path.join(tmp, "d", "a.py"), "w", encoding="utf-8") as f:
+                    f.write("x = 1\n")
+                app.transformfiles = transformed # type: ignore[assignment]
+                for _ in range(2):
+                    sys.argv = ["strip_python3.py", "-r", os.path.join(tmp, "d"), "--outdir", os.path.join(tmp, "out")]
+                    self.assertEqual(app.main(), 0)
+            self.assertEqual(handed, [[os.path.join(tmp, "d", "a.py")]] * 2)
+        finally:
+            app.transformfiles = transformfiles # type: ignore[assignment]
+            sys.argv = argv
+            app.want_settings_update(settings)
 
 
 